@@ -4,9 +4,17 @@ Streamlit UI for Thai RAG Chatbot
 """
 
 import streamlit as st
+import hashlib
 import os
+import re
+import shelve
 import tempfile
-from typing import List, Dict, Any
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+from typing import List, Dict, Any, Iterable, TYPE_CHECKING
 from pathlib import Path
 import time
 
@@ -14,9 +22,13 @@ import time
 import sys
 sys.path.append('./src')
 
-from document_processor import ThaiDocumentProcessor
-from vector_store import ThaiVectorStoreManager, RECOMMENDED_THAI_MODELS
-from rag_system import ThaiRAGSystem, RECOMMENDED_THAI_LLM_MODELS
+# รายชื่อโมเดลเบาๆ สำหรับ Sidebar - โมดูลหนัก (torch, langchain, ollama) โหลดผ่าน _load_backends()
+from recommended_models import RECOMMENDED_THAI_MODELS, RECOMMENDED_THAI_LLM_MODELS, EMBEDDING_BACKENDS
+
+if TYPE_CHECKING:
+    from document_processor import ThaiDocumentProcessor
+    from vector_store import ThaiVectorStoreManager
+    from rag_system import ThaiRAGSystem, OllamaLLM
 
 
 # กำหนดค่าหน้าเว็บ
@@ -27,400 +39,38 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# 🎨 CSS สำหรับปรับแต่งหน้าเว็บให้สวยงาม
-st.markdown("""
-<style>
-    /* ===== GLOBAL STYLES ===== */
-    @import url('https://fonts.googleapis.com/css2?family=Sarabun:wght@300;400;600;700&display=swap');
-    
-    * {
-        font-family: 'Sarabun', 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-    }
-    
-    .main {
-        background: linear-gradient(135deg, #1a1a2e 0%, #16213e 100%);
-    }
-    
-    /* ===== HEADER ===== */
-    .main-header {
-        font-size: 3rem;
-        font-weight: 700;
-        color: #ffffff;
-        text-align: center;
-        padding: 2rem 1rem;
-        margin-bottom: 2rem;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 50%, #f093fb 100%);
-        border-radius: 20px;
-        box-shadow: 0 10px 30px rgba(102, 126, 234, 0.4);
-        position: relative;
-        overflow: hidden;
-    }
-    
-    .main-header::before {
-        content: '';
-        position: absolute;
-        top: -50%;
-        left: -50%;
-        width: 200%;
-        height: 200%;
-        background: linear-gradient(45deg, transparent, rgba(255,255,255,0.1), transparent);
-        transform: rotate(45deg);
-        animation: shine 3s infinite;
-    }
-    
-    @keyframes shine {
-        0% { transform: translateX(-100%) rotate(45deg); }
-        100% { transform: translateX(100%) rotate(45deg); }
-    }
-    
-    /* ===== SIDEBAR ===== */
-    [data-testid="stSidebar"] {
-        background: linear-gradient(180deg, #1e3a5f 0%, #2d4a6f 100%);
-        border-right: 2px solid #667eea;
-    }
-    
-    [data-testid="stSidebar"] h1, 
-    [data-testid="stSidebar"] h2, 
-    [data-testid="stSidebar"] h3 {
-        color: #ffd93d !important;
-        text-shadow: 0 2px 4px rgba(0,0,0,0.3);
-    }
-    
-    /* ===== CHAT CONTAINER ===== */
-    .chat-container {
-        background: linear-gradient(135deg, #2d3748 0%, #1a202c 100%);
-        border-radius: 20px;
-        padding: 2rem;
-        margin: 1.5rem 0;
-        box-shadow: 0 15px 35px rgba(0, 0, 0, 0.3);
-        border: 1px solid rgba(102, 126, 234, 0.2);
-    }
-    
-    /* ===== CHAT MESSAGES ===== */
-    .chat-message {
-        padding: 1.5rem;
-        border-radius: 20px;
-        margin: 1.5rem 0;
-        max-width: 80%;
-        line-height: 1.8;
-        box-shadow: 0 8px 16px rgba(0, 0, 0, 0.2);
-        animation: slideIn 0.3s ease-out;
-        position: relative;
-    }
-    
-    @keyframes slideIn {
-        from {
-            opacity: 0;
-            transform: translateY(20px);
-        }
-        to {
-            opacity: 1;
-            transform: translateY(0);
-        }
-    }
-    
-    /* ===== USER MESSAGE ===== */
-    .user-message {
-        background: linear-gradient(135deg, #ff6b6b 0%, #ee5a52 50%, #ff8787 100%);
-        color: white;
-        margin-left: auto;
-        border-bottom-right-radius: 5px;
-        box-shadow: 0 8px 20px rgba(255, 107, 107, 0.4);
-    }
-    
-    .user-message::before {
-        content: "👤";
-        position: absolute;
-        right: -3rem;
-        top: 0.5rem;
-        background: linear-gradient(135deg, #ff6b6b, #ff8787);
-        border-radius: 50%;
-        width: 2.5rem;
-        height: 2.5rem;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-size: 1.2rem;
-        box-shadow: 0 4px 12px rgba(255, 107, 107, 0.5);
-    }
-    
-    /* ===== BOT MESSAGE ===== */
-    .bot-message {
-        background: linear-gradient(135deg, #ffd93d 0%, #ffb700 50%, #ffe66d 100%);
-        color: #1a202c;
-        margin-right: auto;
-        border-bottom-left-radius: 5px;
-        box-shadow: 0 8px 20px rgba(255, 217, 61, 0.4);
-    }
-    
-    .bot-message::before {
-        content: "🤖";
-        position: absolute;
-        left: -3rem;
-        top: 0.5rem;
-        background: linear-gradient(135deg, #ffd93d, #ffe66d);
-        border-radius: 50%;
-        width: 2.5rem;
-        height: 2.5rem;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-size: 1.2rem;
-        box-shadow: 0 4px 12px rgba(255, 217, 61, 0.5);
-    }
-    
-    /* ===== BUTTONS ===== */
-    .stButton>button {
-        width: 100%;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        border: none;
-        padding: 0.75rem 1.5rem;
-        font-size: 1.1rem;
-        font-weight: 600;
-        border-radius: 12px;
-        cursor: pointer;
-        transition: all 0.3s ease;
-        box-shadow: 0 4px 15px rgba(102, 126, 234, 0.4);
-    }
-    
-    .stButton>button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 6px 20px rgba(102, 126, 234, 0.6);
-        background: linear-gradient(135deg, #764ba2 0%, #667eea 100%);
-    }
-    
-    .stButton>button:active {
-        transform: translateY(0);
-    }
-    
-    /* ===== INPUT FIELDS ===== */
-    .stTextInput>div>div>input,
-    .stTextArea>div>div>textarea {
-        background-color: rgba(45, 55, 72, 0.8);
-        color: white;
-        border: 2px solid rgba(102, 126, 234, 0.3);
-        border-radius: 12px;
-        padding: 0.75rem;
-        font-size: 1rem;
-        transition: all 0.3s ease;
-    }
-    
-    .stTextInput>div>div>input:focus,
-    .stTextArea>div>div>textarea:focus {
-        border-color: #667eea;
-        box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.2);
-        outline: none;
-    }
-    
-    /* ===== SELECT BOX ===== */
-    .stSelectbox>div>div>div {
-        background-color: rgba(45, 55, 72, 0.8);
-        color: white;
-        border: 2px solid rgba(102, 126, 234, 0.3);
-        border-radius: 12px;
-        transition: all 0.3s ease;
-    }
-    
-    .stSelectbox>div>div>div:hover {
-        border-color: #667eea;
-    }
-    
-    /* ===== FILE UPLOADER ===== */
-    [data-testid="stFileUploader"] {
-        background: linear-gradient(135deg, rgba(45, 55, 72, 0.6), rgba(26, 32, 44, 0.6));
-        border: 2px dashed rgba(102, 126, 234, 0.5);
-        border-radius: 15px;
-        padding: 2rem;
-        transition: all 0.3s ease;
-    }
-    
-    [data-testid="stFileUploader"]:hover {
-        border-color: #667eea;
-        background: linear-gradient(135deg, rgba(45, 55, 72, 0.8), rgba(26, 32, 44, 0.8));
-        box-shadow: 0 8px 20px rgba(102, 126, 234, 0.3);
-    }
-    
-    /* ===== SPINNER ===== */
-    .stSpinner>div {
-        border-top-color: #667eea !important;
-        border-right-color: #764ba2 !important;
-    }
-    
-    /* ===== SUCCESS/ERROR MESSAGES ===== */
-    .stSuccess {
-        background: linear-gradient(135deg, #48bb78, #38a169);
-        color: white;
-        padding: 1rem;
-        border-radius: 12px;
-        box-shadow: 0 4px 15px rgba(72, 187, 120, 0.4);
-        animation: slideIn 0.3s ease-out;
-    }
-    
-    .stError {
-        background: linear-gradient(135deg, #f56565, #e53e3e);
-        color: white;
-        padding: 1rem;
-        border-radius: 12px;
-        box-shadow: 0 4px 15px rgba(245, 101, 101, 0.4);
-        animation: slideIn 0.3s ease-out;
-    }
-    
-    /* ===== EXPANDER ===== */
-    .streamlit-expanderHeader {
-        background: linear-gradient(135deg, rgba(102, 126, 234, 0.2), rgba(118, 75, 162, 0.2));
-        border-radius: 10px;
-        font-weight: 600;
-        color: #ffd93d;
-        transition: all 0.3s ease;
-    }
-    
-    .streamlit-expanderHeader:hover {
-        background: linear-gradient(135deg, rgba(102, 126, 234, 0.3), rgba(118, 75, 162, 0.3));
-        box-shadow: 0 4px 12px rgba(102, 126, 234, 0.3);
-    }
-    
-    /* ===== SCROLLBAR ===== */
-    ::-webkit-scrollbar {
-        width: 12px;
-        height: 12px;
-    }
-    
-    ::-webkit-scrollbar-track {
-        background: #1a202c;
-        border-radius: 10px;
-    }
-    
-    ::-webkit-scrollbar-thumb {
-        background: linear-gradient(135deg, #667eea, #764ba2);
-        border-radius: 10px;
-        border: 2px solid #1a202c;
-    }
-    
-    ::-webkit-scrollbar-thumb:hover {
-        background: linear-gradient(135deg, #764ba2, #667eea);
-    }
-    
-    /* ===== LOADING ANIMATION ===== */
-    @keyframes pulse {
-        0%, 100% { opacity: 1; }
-        50% { opacity: 0.5; }
-    }
-    
-    .loading {
-        animation: pulse 1.5s ease-in-out infinite;
-    }
-    
-    /* ===== INFO BOX ===== */
-    .info-box {
-        background: linear-gradient(135deg, rgba(102, 126, 234, 0.2), rgba(118, 75, 162, 0.2));
-        border-left: 4px solid #667eea;
-        padding: 1.5rem;
-        border-radius: 10px;
-        margin: 1rem 0;
-        box-shadow: 0 4px 12px rgba(102, 126, 234, 0.2);
-    }
-    
-    /* ===== METRICS ===== */
-    [data-testid="stMetricValue"] {
-        font-size: 2rem;
-        font-weight: 700;
-        background: linear-gradient(135deg, #667eea, #764ba2);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-    }
-    
-    /* ===== RESPONSIVE DESIGN ===== */
-    @media (max-width: 768px) {
-        .main-header {
-            font-size: 2rem;
-            padding: 1.5rem 1rem;
-        }
-        
-        .chat-message {
-            max-width: 90%;
-            padding: 1rem;
-        }
-        
-        .user-message::before,
-        .bot-message::before {
-            width: 2rem;
-            height: 2rem;
-            font-size: 1rem;
-        }
-    }
-    
-    /* ===== MESSAGE CONTENT ===== */
-    .message-content {
-        margin-left: 0.5rem;
-        font-weight: 500;
-    }
-    
-    /* ===== SOURCE CARD ===== */
-    .source-card {
-        background: linear-gradient(135deg, #4facfe, #00f2fe);
-        color: white;
-        padding: 1rem;
-        border-radius: 12px;
-        margin: 0.8rem 0;
-        font-size: 0.9rem;
-        box-shadow: 0 3px 10px rgba(79, 172, 254, 0.3);
-        transition: all 0.3s ease;
-    }
-    
-    .source-card:hover {
-        transform: translateX(5px);
-        box-shadow: 0 5px 15px rgba(79, 172, 254, 0.5);
-    }
-    
-    /* ===== STATS CARD ===== */
-    .stats-card {
-        background: linear-gradient(135deg, #667eea, #764ba2);
-        color: white;
-        padding: 1.5rem;
-        border-radius: 15px;
-        margin: 0.8rem 0;
-        box-shadow: 0 4px 15px rgba(102, 126, 234, 0.4);
-        transition: all 0.3s ease;
-    }
-    
-    .stats-card:hover {
-        transform: translateY(-3px);
-        box-shadow: 0 6px 20px rgba(102, 126, 234, 0.6);
-    }
-    
-    /* ===== CHAT INPUT CONTAINER ===== */
-    .stChatInputContainer,
-    .chat-input-container {
-        background: linear-gradient(135deg, rgba(45, 55, 72, 0.6), rgba(26, 32, 44, 0.6));
-        border-radius: 15px;
-        padding: 1.5rem;
-        margin: 1rem 0;
-        border: 2px solid rgba(102, 126, 234, 0.3);
-        box-shadow: 0 4px 15px rgba(0, 0, 0, 0.2);
-    }
-    
-    .chat-input {
-        background-color: rgba(74, 85, 104, 0.8);
-        border: 2px solid #718096;
-        border-radius: 25px;
-        color: white;
-        padding: 0.8rem 1.5rem;
-        transition: all 0.3s ease;
-    }
-    
-    .chat-input::placeholder {
-        color: #a0aec0;
-    }
-    
-    .chat-input:focus {
-        border-color: #667eea;
-        box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.2);
-        outline: none;
-    }
-</style>
-""", unsafe_allow_html=True)
+# 🎨 ไฟล์ CSS สำหรับปรับแต่งหน้าเว็บให้สวยงาม
+CSS_PATH = Path(__file__).parent / "assets" / "app.css"
+
+# ฟอนต์ Sarabun - โหลดผ่าน <link> แทน @import ใน CSS เพื่อไม่ให้บล็อกการแสดงผล
+FONT_LINKS = (
+    '<link rel="preconnect" href="https://fonts.googleapis.com">'
+    '<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>'
+    '<link rel="stylesheet" href="https://fonts.googleapis.com/css2?family=Sarabun:wght@300;400;600;700&display=swap">'
+)
+
+
+@st.cache_resource(show_spinner=False)
+def _css_tag() -> str:
+    """อ่าน CSS จากดิสก์ครั้งเดียวต่อ process แล้วคืนเป็น <link> ฟอนต์ + <style> tag"""
+    return f"{FONT_LINKS}\n<style>\n{CSS_PATH.read_text(encoding='utf-8')}</style>"
+
+
+@st.cache_resource(show_spinner="กำลังโหลดโมดูลของระบบ...")
+def _load_backends() -> SimpleNamespace:
+    """import โมดูลหนักครั้งแรกที่ต้องใช้ เพื่อให้หน้าเว็บแสดงผลได้ก่อน"""
+    from langchain.schema import Document
+    from document_processor import ThaiDocumentProcessor
+    from vector_store import ThaiVectorStoreManager
+    from rag_system import ThaiRAGSystem, OllamaLLM
+    
+    return SimpleNamespace(
+        Document=Document,
+        ThaiDocumentProcessor=ThaiDocumentProcessor,
+        ThaiVectorStoreManager=ThaiVectorStoreManager,
+        ThaiRAGSystem=ThaiRAGSystem,
+        OllamaLLM=OllamaLLM
+    )
 
 
 def initialize_session_state():
@@ -435,7 +85,8 @@ def initialize_session_state():
         st.session_state.rag_system = None
     
     if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
+        # ring buffer - รอบเก่าสุดถูกดันออกอัตโนมัติเมื่อครบ MAX_CHAT_HISTORY
+        st.session_state.chat_history = deque(maxlen=MAX_CHAT_HISTORY)
     
     if 'processed_files' not in st.session_state:
         st.session_state.processed_files = []
@@ -444,24 +95,41 @@ def initialize_session_state():
         st.session_state.system_ready = False
 
 
+# ตาราง escape HTML (str.maketrans แทนที่พร้อมกัน จึงไม่ escape '&' ซ้ำ)
+_HTML_ESCAPE_TABLE = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&#x27;'
+})
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+
 def clean_html_content(text: str) -> str:
     """ทำความสะอาดข้อความจาก HTML tags และ entities"""
     if not text:
         return ""
     
-    # แทนที่ HTML tags
-    text = text.replace('<', '&lt;').replace('>', '&gt;')
-    
-    # แทนที่ HTML entities อื่นๆ
-    text = text.replace('&', '&amp;')
-    text = text.replace('"', '&quot;')
-    text = text.replace("'", '&#x27;')
-    
-    # ลบ HTML tags ที่อาจรั่วมา
-    import re
-    text = re.sub(r'<[^>]+>', '', text)
-    
-    return text.strip()
+    # ลบ HTML tags ก่อน (หลัง escape แล้ว '<' จะกลายเป็น &lt; และ regex จะจับไม่ได้)
+    # จากนั้น escape ที่เหลือทั้งหมดใน pass เดียว
+    return _HTML_TAG_RE.sub('', text).translate(_HTML_ESCAPE_TABLE).strip()
+
+
+# ตัวเลือกและ label ของ selectbox โมเดล (คำนวณครั้งเดียวตอนโหลดโมดูล)
+_EMBEDDING_MODEL_KEYS = tuple(RECOMMENDED_THAI_MODELS)
+_EMBEDDING_MODEL_LABELS = {
+    key: f"{key}: {model.split('/')[-1]}"
+    for key, model in RECOMMENDED_THAI_MODELS.items()
+}
+_LLM_MODEL_KEYS = tuple(RECOMMENDED_THAI_LLM_MODELS)
+_LLM_MODEL_LABELS = {
+    key: f"{key}: {model}"
+    for key, model in RECOMMENDED_THAI_LLM_MODELS.items()
+}
+
+# จำนวนรอบสนทนาสูงสุดที่เก็บไว้ (ทั้งใน session_state และ memory ของ RAG system)
+MAX_CHAT_HISTORY = 20
 
 
 def setup_sidebar():
@@ -483,16 +151,16 @@ def setup_sidebar():
     # เลือก Embedding Model
     embedding_model = st.sidebar.selectbox(
         "Embedding Model",
-        options=list(RECOMMENDED_THAI_MODELS.keys()),
-        format_func=lambda x: f"{x}: {RECOMMENDED_THAI_MODELS[x].split('/')[-1]}",
+        options=_EMBEDDING_MODEL_KEYS,
+        format_func=_EMBEDDING_MODEL_LABELS.__getitem__,
         help="เลือกโมเดลสำหรับการสร้าง embeddings"
     )
     
     # เลือก LLM Model
     llm_model = st.sidebar.selectbox(
         "LLM Model (Ollama)",
-        options=list(RECOMMENDED_THAI_LLM_MODELS.keys()),
-        format_func=lambda x: f"{x}: {RECOMMENDED_THAI_LLM_MODELS[x]}",
+        options=_LLM_MODEL_KEYS,
+        format_func=_LLM_MODEL_LABELS.__getitem__,
         help="เลือกโมเดล LLM สำหรับการตอบคำถาม"
     )
     
@@ -515,6 +183,23 @@ def setup_sidebar():
         help="จำนวน tokens สูงสุดในการตอบ (ไม่ใช่จำนวนขั้นต่ำ - LLM จะตอบสั้นตามความเหมาะสม)"
     )
     
+    # การตั้งค่าขั้นสูง
+    with st.sidebar.expander("🔬 ขั้นสูง"):
+        embed_batch_size = st.slider(
+            "Embedding Batch Size",
+            min_value=16,
+            max_value=256,
+            value=128,
+            step=16,
+            help="จำนวน chunks ต่อ batch ตอนสร้าง embeddings (มาก = เร็วขึ้น แต่ใช้ RAM มากขึ้น)"
+        )
+        
+        embedding_backend = st.selectbox(
+            "Embedding Backend",
+            options=EMBEDDING_BACKENDS,
+            help="auto = GPU FP16 ถ้ามี CUDA, ไม่งั้นใช้ ONNX INT8 บน CPU"
+        )
+    
     st.sidebar.divider()
     
     # การตั้งค่าการประมวลผลเอกสาร
@@ -579,7 +264,9 @@ def setup_sidebar():
             max_tokens=max_tokens,
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            use_dynamic_chunking=use_dynamic_chunking
+            use_dynamic_chunking=use_dynamic_chunking,
+            embed_batch_size=embed_batch_size,
+            embedding_backend=embedding_backend
         )
     
     st.sidebar.divider()
@@ -597,48 +284,124 @@ def setup_sidebar():
         clear_chat_history()
 
 
+@st.cache_resource(show_spinner=False)
+def _get_document_processor(
+    chunk_size: int,
+    chunk_overlap: int,
+    use_dynamic_chunking: bool
+) -> "ThaiDocumentProcessor":
+    """สร้าง Document Processor ครั้งเดียวต่อชุดการตั้งค่า"""
+    backends = _load_backends()
+    if use_dynamic_chunking:
+        return backends.ThaiDocumentProcessor(use_dynamic_chunking=True)
+
+    return backends.ThaiDocumentProcessor(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        use_dynamic_chunking=False
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _get_vector_store_manager(
+    embedding_model_path: str,
+    vector_store_path: str,
+    embedding_backend: str = "auto"
+) -> "ThaiVectorStoreManager":
+    """โหลดโมเดล embedding และ Vector Store Manager ครั้งเดียวต่อโมเดล/backend (แชร์ข้าม reruns และ sessions)"""
+    return _load_backends().ThaiVectorStoreManager(
+        embedding_model=embedding_model_path,
+        vector_store_path=vector_store_path,
+        embedding_backend=embedding_backend
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _get_llm(llm_model: str) -> "OllamaLLM":
+    """สร้าง LLM และตรวจสอบการเชื่อมต่อ Ollama ครั้งเดียวต่อโมเดล (temperature/max_tokens ตั้งต่อ session)"""
+    return _load_backends().OllamaLLM(model_name=llm_model)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_save_worker() -> SimpleNamespace:
+    """thread สำหรับบันทึก vector store เบื้องหลัง (lock ใช้ร่วมกับทุกจุดที่แก้ไข index)
+
+    สร้างผ่าน cache_resource เพราะตัวแปรระดับโมดูลของ Streamlit ถูกสร้างใหม่ทุก rerun
+    """
+    return SimpleNamespace(
+        lock=threading.Lock(),
+        executor=ThreadPoolExecutor(max_workers=1, thread_name_prefix="vectorstore-save"),
+        future=None
+    )
+
+
+def _save_vector_store_async(vector_store_manager: "ThaiVectorStoreManager") -> None:
+    """ส่ง save_vector_store ไปทำใน background thread"""
+    worker = _get_save_worker()
+
+    def _save():
+        with worker.lock:
+            vector_store_manager.save_vector_store()
+
+    worker.future = worker.executor.submit(_save)
+
+
+def _wait_for_pending_save() -> None:
+    """รอให้การบันทึกที่ค้างอยู่เสร็จก่อน (เช่น ก่อนล้างข้อมูล)"""
+    future = _get_save_worker().future
+    if future is not None:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"❌ บันทึก vector store ไม่สำเร็จ: {str(e)}")
+
+
 def setup_system(
-    embedding_model: str, 
+    embedding_model: str,
     llm_model: str, 
     temperature: float, 
     max_tokens: int, 
     chunk_size: int = None, 
     chunk_overlap: int = None,
-    use_dynamic_chunking: bool = True
+    use_dynamic_chunking: bool = True,
+    embed_batch_size: int = 128,
+    embedding_backend: str = "auto"
 ):
     """ตั้งค่าระบบ พร้อม Dynamic Chunking"""
     with st.spinner("กำลังตั้งค่าระบบ..."):
         try:
-            # สร้าง Document Processor
+            # สร้าง Document Processor (cache ต่อชุดการตั้งค่า)
             if use_dynamic_chunking:
                 st.info("✨ ใช้ Dynamic Chunking Strategy")
-                st.session_state.document_processor = ThaiDocumentProcessor(
-                    use_dynamic_chunking=True
-                )
             else:
                 st.info(f"📝 ใช้ Manual Chunking ({chunk_size}/{chunk_overlap})")
-                st.session_state.document_processor = ThaiDocumentProcessor(
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap,
-                    use_dynamic_chunking=False
-                )
-            
-            # สร้าง Vector Store Manager
-            st.session_state.vector_store_manager = ThaiVectorStoreManager(
-                embedding_model=RECOMMENDED_THAI_MODELS[embedding_model],
-                vector_store_path="./vectorstore"
+            st.session_state.document_processor = _get_document_processor(
+                chunk_size, chunk_overlap, use_dynamic_chunking
             )
-            
-            # ลองโหลด vector store ที่มีอยู่
-            if st.session_state.vector_store_manager.load_vector_store():
+
+            # สร้าง Vector Store Manager (โหลดโมเดล embedding ครั้งเดียว)
+            st.session_state.vector_store_manager = _get_vector_store_manager(
+                RECOMMENDED_THAI_MODELS[embedding_model],
+                "./vectorstore",
+                embedding_backend
+            )
+            st.session_state.vector_store_manager.embeddings.batch_size = embed_batch_size
+
+            # ลองโหลด vector store ที่มีอยู่ (ข้ามถ้า manager ที่ cache ไว้โหลดแล้ว)
+            with _get_save_worker().lock:
+                loaded = (st.session_state.vector_store_manager.vector_store is None and
+                          st.session_state.vector_store_manager.load_vector_store())
+            if loaded:
                 st.success("✅ โหลด vector store ที่มีอยู่สำเร็จ")
-            
-            # สร้าง RAG System
-            st.session_state.rag_system = ThaiRAGSystem(
+
+            # สร้าง RAG System (แยกต่อ session เพราะเก็บ memory ของการสนทนา)
+            st.session_state.rag_system = _load_backends().ThaiRAGSystem(
                 vector_store_manager=st.session_state.vector_store_manager,
                 llm_model=RECOMMENDED_THAI_LLM_MODELS[llm_model],
                 temperature=temperature,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                llm=_get_llm(RECOMMENDED_THAI_LLM_MODELS[llm_model]),
+                max_history_turns=MAX_CHAT_HISTORY
             )
             
             st.session_state.system_ready = True
@@ -650,6 +413,12 @@ def setup_system(
             st.error(traceback.format_exc())
 
 
+@st.cache_data(ttl=5, show_spinner=False)
+def _system_stats_snapshot(rag_system_id: int, _rag_system: "ThaiRAGSystem") -> Dict[str, Any]:
+    """สถิติระบบแบบ cache (รีเฟรชอย่างมากทุก 5 วินาที ต่อ RAG system)"""
+    return _rag_system.get_system_stats()
+
+
 def display_system_stats():
     """แสดงสถิติระบบ"""
     st.sidebar.subheader("📊 สถิติระบบ")
@@ -671,7 +440,13 @@ def display_system_stats():
             """)
     
     if st.session_state.rag_system:
-        stats = st.session_state.rag_system.get_system_stats()
+        stats = _system_stats_snapshot(id(st.session_state.rag_system), st.session_state.rag_system)
+        
+        st.sidebar.checkbox(
+            "📈 อัปเดตสถิติทุกครั้งที่ถาม",
+            key="live_stats",
+            help="rerun ทั้งหน้าหลังตอบคำถาม (ช้ากว่า) เพื่อให้สถิติใน Sidebar เป็นปัจจุบัน"
+        )
         
         st.sidebar.metric(
             "เอกสารในระบบ", 
@@ -689,6 +464,58 @@ def display_system_stats():
         st.sidebar.info("กรุณาตั้งค่าระบบก่อน")
 
 
+# การ์ดของไฟล์ที่ประมวลผลแล้ว 1 ไฟล์ (ใช้กับ str.format)
+_FILE_CARD_TEMPLATE = """<div style="background: linear-gradient(135deg, rgba(102, 126, 234, 0.15), rgba(118, 75, 162, 0.15)); 
+            border-radius: 12px; padding: 1.2rem; margin: 0.8rem 0; 
+            border-left: 4px solid #667eea; transition: all 0.3s ease;">
+    <div style="display: flex; justify-content: space-between; align-items: center;">
+        <div>
+            <p style="color: #ffd93d; margin: 0; font-size: 1.1rem; font-weight: 600;">
+                📄 {filename}
+            </p>
+            <p style="color: #a0aec0; margin: 0.3rem 0 0 0; font-size: 0.9rem;">
+                🧩 {chunks} chunks | 📦 ประมวลผลเสร็จสิ้น
+            </p>
+        </div>
+        <div style="background: linear-gradient(135deg, #667eea, #764ba2); 
+                    padding: 0.5rem 1rem; border-radius: 20px; color: white; 
+                    font-weight: 600; font-size: 0.9rem;">
+            #{i}
+        </div>
+    </div>
+</div>"""
+
+
+@st.fragment
+def upload_tab():
+    """แท็บอัพโหลดเอกสาร (fragment - เลือกไฟล์/ประมวลผลไม่ต้อง rerun ทั้งหน้า)"""
+    upload_documents()
+    display_processed_files()
+
+
+def display_processed_files():
+    """แสดงรายการไฟล์ที่ประมวลผลแล้ว"""
+    # แสดงไฟล์ที่ประมวลผลแล้วในรูปแบบสวยงาม
+    if st.session_state.processed_files:
+        st.markdown("""
+        <div style="margin-top: 2rem;">
+            <h3 style="color: #ffd93d; margin-bottom: 1rem; display: flex; align-items: center; gap: 0.5rem;">
+                <span>📋</span>
+                <span>ไฟล์ที่ประมวลผลแล้ว</span>
+            </h3>
+        </div>
+        """, unsafe_allow_html=True)
+        
+        # รวมการ์ดทุกไฟล์เป็น HTML ก้อนเดียว (ส่งไป browser ครั้งเดียว)
+        st.markdown(
+            "\n".join(
+                _FILE_CARD_TEMPLATE.format(i=i, filename=file_info['filename'], chunks=file_info['chunks'])
+                for i, file_info in enumerate(st.session_state.processed_files, 1)
+            ),
+            unsafe_allow_html=True
+        )
+
+
 def upload_documents():
     """ส่วนการอัพโหลดเอกสาร"""
     st.markdown("""
@@ -750,69 +577,150 @@ def upload_documents():
             process_uploaded_files(uploaded_files)
 
 
+def _upload_digest(uploaded_file) -> str:
+    """hash ของเนื้อหาไฟล์ที่อัพโหลด (อ่านจาก buffer โดยตรง ไม่ copy เป็น bytes)"""
+    return hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _process_upload(
+    digest: str,
+    filename: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    use_dynamic_chunking: bool,
+    _uploaded_file
+) -> List[Dict[str, Any]]:
+    """
+    แบ่ง chunks จากไฟล์ที่อัพโหลด (cache ตาม hash ของเนื้อหา + การตั้งค่า chunking)
+    
+    _uploaded_file ไม่ถูก hash โดย Streamlit - อ่านจากหน่วยความจำโดยตรงเมื่อ cache ไม่มีเท่านั้น
+    คืนค่าเป็น dict ธรรมดา เพราะ LangChain Document ไม่ควรเก็บใน st.cache_data โดยตรง
+    """
+    processor = _get_document_processor(chunk_size, chunk_overlap, use_dynamic_chunking)
+    documents = processor.process_bytes(
+        _uploaded_file,
+        filename,
+        metadata={"uploaded_filename": filename, "file_hash": digest}
+    )
+    
+    return [
+        {"page_content": doc.page_content, "metadata": doc.metadata}
+        for doc in documents
+    ]
+
+
 def process_uploaded_files(uploaded_files):
     """ประมวลผลไฟล์ที่อัพโหลด"""
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    Document = _load_backends().Document
     
     all_documents = []
-    processed_count = 0
+    new_entries = []  # รวบรวมไว้ก่อน แล้วเขียนลง session_state ครั้งเดียว
     
-    for i, uploaded_file in enumerate(uploaded_files):
-        try:
-            status_text.text(f"กำลังประมวลผล: {uploaded_file.name}")
-            
-            # บันทึกไฟล์ชั่วคราว
-            with tempfile.NamedTemporaryFile(delete=False, suffix=Path(uploaded_file.name).suffix) as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_path = tmp_file.name
-            
-            # ประมวลผลเอกสาร
-            documents = st.session_state.document_processor.process_document(
-                tmp_path,
-                metadata={"uploaded_filename": uploaded_file.name}
-            )
-            
-            all_documents.extend(documents)
-            processed_count += 1
-            
-            # ลบไฟล์ชั่วคราว
-            os.unlink(tmp_path)
-            
-            # อัพเดท progress
-            progress_bar.progress((i + 1) / len(uploaded_files))
-            
-            st.session_state.processed_files.append({
-                "filename": uploaded_file.name,
-                "chunks": len(documents),
-                "size": uploaded_file.size
-            })
-            
-        except Exception as e:
-            st.error(f"❌ ไม่สามารถประมวลผล {uploaded_file.name}: {str(e)}")
+    processed_hashes = []
     
-    if all_documents:
-        # เพิ่มเอกสารลงใน vector store
-        status_text.text("กำลังสร้าง embeddings และบันทึกลง vector store...")
-        st.session_state.vector_store_manager.add_documents(all_documents)
-        st.session_state.vector_store_manager.save_vector_store()
+    processor = st.session_state.document_processor
+    vector_store_manager = st.session_state.vector_store_manager
+    
+    with st.status(f"📤 กำลังประมวลผล {len(uploaded_files)} ไฟล์...", expanded=True) as status:
+        progress_bar = status.progress(0)
         
-        # อัพเดท RAG system
-        st.session_state.rag_system.update_vector_store(st.session_state.vector_store_manager)
+        # ข้ามไฟล์ที่นำเข้าแล้ว (เทียบ hash ของเนื้อหา ก่อนอ่านไฟล์และสร้าง embeddings)
+        new_files = {}
+        for uploaded_file in uploaded_files:
+            digest = _upload_digest(uploaded_file)
+            if digest in vector_store_manager.file_hashes or digest in new_files:
+                status.write(f"⏭️ {uploaded_file.name} - อยู่ในระบบแล้ว")
+            else:
+                new_files[digest] = uploaded_file
         
-        status_text.empty()
-        progress_bar.empty()
+        if not new_files:
+            progress_bar.progress(1.0)
+            status.update(label="✅ ไฟล์ทั้งหมดอยู่ในระบบแล้ว", state="complete", expanded=False)
+            return
         
-        st.success(f"✅ ประมวลผลเสร็จสิ้น: {processed_count} ไฟล์, {len(all_documents)} chunks")
+        # อ่านและแบ่ง chunks หลายไฟล์พร้อมกัน (UI อัพเดทใน thread หลักเท่านั้น)
+        with ThreadPoolExecutor(max_workers=min(8, len(new_files))) as executor:
+            futures = {
+                executor.submit(
+                    _process_upload,
+                    digest,
+                    uploaded_file.name,
+                    processor.chunk_size,
+                    processor.chunk_overlap,
+                    processor.use_dynamic_chunking,
+                    uploaded_file
+                ): (digest, uploaded_file)
+                for digest, uploaded_file in new_files.items()
+            }
+            
+            for i, future in enumerate(as_completed(futures)):
+                digest, uploaded_file = futures[future]
+                try:
+                    # ประมวลผลเอกสาร (ไฟล์เดิม + การตั้งค่าเดิม → ใช้ผลจาก cache)
+                    chunk_dicts = future.result()
+                    documents = [
+                        Document(page_content=chunk["page_content"], metadata=chunk["metadata"])
+                        for chunk in chunk_dicts
+                    ]
+                    
+                    all_documents.extend(documents)
+                    processed_hashes.append(digest)
+                    status.write(f"✅ {uploaded_file.name} - {len(documents)} chunks")
+                    
+                    new_entries.append({
+                        "filename": uploaded_file.name,
+                        "chunks": len(documents),
+                        "size": uploaded_file.size
+                    })
+                    
+                except Exception as e:
+                    st.error(f"❌ ไม่สามารถประมวลผล {uploaded_file.name}: {str(e)}")
+                
+                # อัพเดท progress
+                progress_bar.progress((i + 1) / len(new_files))
+        
+        st.session_state.processed_files.extend(new_entries)
+        
+        if not all_documents:
+            status.update(label="❌ ไม่มีเอกสารที่ประมวลผลได้", state="error", expanded=True)
+            return
+        
+        # เพิ่มเอกสารลงใน vector store
+        status.update(label="🧠 กำลังสร้าง embeddings และบันทึกลง vector store...")
+        with _get_save_worker().lock:
+            added_count = vector_store_manager.add_documents(all_documents, file_hashes=processed_hashes)
+            vector_store_manager.build_ann_index()
+        skipped_count = len(all_documents) - added_count
+        
+        # บันทึกลงดิสก์เบื้องหลัง - ผู้ใช้ถามคำถามได้ทันที
+        _save_vector_store_async(vector_store_manager)
+        
+        # อัพเดท RAG system
+        st.session_state.rag_system.update_vector_store(vector_store_manager)
+        _system_stats_snapshot.clear()
         
-        # แสดงรายละเอียดไฟล์ที่ประมวลผล
-        with st.expander("📋 รายละเอียดไฟล์ที่ประมวลผล"):
-            for file_info in st.session_state.processed_files[-processed_count:]:
-                st.markdown(f"**{file_info['filename']}** - {file_info['chunks']} chunks, {file_info['size']} bytes")
+        status.update(
+            label=f"✅ ประมวลผลเสร็จสิ้น: {len(new_entries)} ไฟล์, {len(all_documents)} chunks"
+            + (f" (ข้าม chunk ที่ซ้ำ {skipped_count} ชิ้น)" if skipped_count else ""),
+            state="complete",
+            expanded=False
+        )
+
+
+def _clear_question_input():
+    """callback ของปุ่มล้างข้อความ (ทำงานก่อน render ช่องป้อนคำถาม)"""
+    st.session_state.question_input = ""
 
 
+def _toggle_example_questions():
+    """callback ของปุ่มตัวอย่างคำถาม"""
+    st.session_state.show_example_questions = not st.session_state.get("show_example_questions", False)
+
+
+@st.fragment
 def chat_interface():
-    """ส่วนการสนทนา"""
+    """ส่วนการสนทนา (fragment - rerun เฉพาะส่วนนี้เมื่อถามคำถาม)"""
     st.markdown("""
     <div style="background: linear-gradient(135deg, rgba(102, 126, 234, 0.1), rgba(118, 75, 162, 0.1)); 
                 border-radius: 15px; padding: 1.5rem; margin-bottom: 2rem; 
@@ -838,51 +746,22 @@ def chat_interface():
         """, unsafe_allow_html=True)
         return
     
-    # แสดงประวัติการสนทนาใน chat container สวยๆ
-    st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-    
+    # แสดงประวัติการสนทนาด้วย chat message ของ Streamlit (escape ข้อความให้อยู่แล้ว)
     for chat in st.session_state.chat_history:
         # ข้อความผู้ใช้
-        st.markdown(f"""
-        <div class="chat-message user-message">
-            <div class="message-content">
-                <strong>คำถาม:</strong><br>
-                {chat['question']}
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
+        with st.chat_message("user"):
+            st.write(chat['question'])
         
         # ข้อความบอท
-        # ทำความสะอาดข้อความให้ปลอดภัยจาก HTML tags
-        clean_answer = clean_html_content(chat['answer'])
-        st.markdown(f"""
-        <div class="chat-message bot-message">
-            <div class="message-content">
-                <strong>คำตอบ:</strong><br>
-                {clean_answer}
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        # แสดงแหล่งที่มาใน expander
-        if 'sources' in chat and chat['sources']:
-            with st.expander(f"📚 ดูแหล่งที่มาข้อมูล ({len(chat['sources'])} แหล่ง)", expanded=False):
-                for i, source in enumerate(chat['sources'], 1):
-                    # ทำความสะอาดข้อมูลแหล่งที่มาจาก HTML tags
-                    clean_content = clean_html_content(source['content'])
-                    filename = source.get('filename', 'ไม่ทราบชื่อไฟล์')
-                    chunk_index = source.get('chunk_index', 'ไม่ทราบ')
-                    
-                    st.markdown(f"""
-                    <div class="source-card">
-                        <strong>📄 แหล่งที่มา {i}:</strong> {filename} (ส่วนที่ {chunk_index})<br>
-                        <div style="margin-top: 0.5rem; font-style: italic;">
-                            {clean_content[:300]}{'...' if len(clean_content) > 300 else ''}
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
+        with st.chat_message("assistant"):
+            st.write(chat['answer'])
+            
+            # แสดงแหล่งที่มาใน expander (โหลดจากดิสก์เมื่อเปิดดู)
+            if chat.get('source_id'):
+                display_lazy_sources(chat['source_id'], chat['source_count'])
     
-    st.markdown('</div>', unsafe_allow_html=True)
+    # พื้นที่สำหรับคำตอบใหม่ (อยู่ต่อจากประวัติ แต่อยู่เหนือช่องป้อนคำถาม)
+    response_area = st.container()
     
     # ช่องป้อนคำถามในสไตล์สวยๆ
     st.markdown('<div class="chat-input-container">', unsafe_allow_html=True)
@@ -896,43 +775,149 @@ def chat_interface():
             key="question_input"
         )
         
-        col1, col2, col3 = st.columns([1, 1, 3])
-        with col1:
-            submit_button = st.form_submit_button("🚀 ส่งคำถาม", use_container_width=True, type="primary")
-        with col2:
-            if st.form_submit_button("🗑️ ล้างข้อความ", use_container_width=True):
-                st.rerun()
-        with col3:
-            if st.form_submit_button("💡 ตัวอย่างคำถาม", use_container_width=True):
-                st.info("""
-                **ตัวอย่างคำถามที่ดี:**
-                - เอกสารนี้เกี่ยวกับเรื่องอะไร?
-                - สรุปประเด็นสำคัญของเอกสาร
-                - มีข้อมูลเกี่ยวกับ [หัวข้อ] หรือไม่?
-                - วิธีการ [ทำสิ่งนั้น] คืออะไร?
-                """)
-        
-        if submit_button and question.strip():
-            ask_question(question.strip())
+        submit_button = st.form_submit_button("🚀 ส่งคำถาม", use_container_width=True, type="primary")
+    
+    # ปุ่มเสริมอยู่นอก form - กดแล้วไม่ส่งคำถาม และไม่ต้อง submit form ทั้งก้อน
+    col1, col2, _ = st.columns([1, 1, 3])
+    with col1:
+        st.button("🗑️ ล้างข้อความ", use_container_width=True, on_click=_clear_question_input)
+    with col2:
+        st.button("💡 ตัวอย่างคำถาม", use_container_width=True, on_click=_toggle_example_questions)
+    
+    if st.session_state.get("show_example_questions", False):
+        st.info("""
+        **ตัวอย่างคำถามที่ดี:**
+        - เอกสารนี้เกี่ยวกับเรื่องอะไร?
+        - สรุปประเด็นสำคัญของเอกสาร
+        - มีข้อมูลเกี่ยวกับ [หัวข้อ] หรือไม่?
+        - วิธีการ [ทำสิ่งนั้น] คืออะไร?
+        """)
     
     st.markdown('</div>', unsafe_allow_html=True)
+    
+    if submit_button and question.strip():
+        ask_question(question.strip(), response_area)
 
 
-def ask_question(question: str):
-    """ถามคำถามและแสดงผล"""
-    with st.spinner("🤔 กำลังคิด..."):
-        result = st.session_state.rag_system.ask_question(question)
-        
-        # เพิ่มลงประวัติการสนทนา
-        st.session_state.chat_history.append(result)
+@st.cache_resource(show_spinner=False)
+def _get_source_cache() -> SimpleNamespace:
+    """เปิด cache บนดิสก์สำหรับเก็บแหล่งที่มาของคำตอบ (ครั้งเดียวต่อ process)
+
+    shelve ไม่ thread-safe และทุก session ใช้ไฟล์เดียวกัน → lock สร้างคู่กับ shelf ผ่าน cache_resource
+    (ตัวแปรระดับโมดูลของ Streamlit ถูกสร้างใหม่ทุก rerun จึงใช้เป็น lock ร่วมกันไม่ได้)
+    """
+    return SimpleNamespace(
+        shelf=shelve.open(os.path.join(tempfile.gettempdir(), "rag_chatbot_sources"), writeback=False),
+        lock=threading.Lock()
+    )
+
+
+def store_sources(sources: List[Dict[str, Any]]) -> str:
+    """บันทึกแหล่งที่มาลงดิสก์ แล้วคืน id สำหรับเก็บใน session_state แทนเนื้อหาเต็ม"""
+    source_id = uuid.uuid4().hex
+    cache = _get_source_cache()
+    with cache.lock:
+        cache.shelf[source_id] = sources
+    return source_id
+
+
+def load_sources(source_id: str) -> List[Dict[str, Any]]:
+    """โหลดแหล่งที่มาจากดิสก์ตาม id"""
+    cache = _get_source_cache()
+    with cache.lock:
+        return cache.shelf.get(source_id, [])
+
+
+def delete_sources(chat_history: Iterable[Dict[str, Any]]):
+    """ลบแหล่งที่มาของประวัติการสนทนาออกจากดิสก์"""
+    cache = _get_source_cache()
+    with cache.lock:
+        for chat in chat_history:
+            source_id = chat.get('source_id')
+            if source_id and source_id in cache.shelf:
+                del cache.shelf[source_id]
+
+
+def display_lazy_sources(source_id: str, source_count: int):
+    """แสดง expander ของแหล่งที่มา โดยโหลดเนื้อหาจากดิสก์เมื่อผู้ใช้ขอดูเท่านั้น"""
+    with st.expander(f"📚 ดูแหล่งที่มาข้อมูล ({source_count} แหล่ง)", expanded=False):
+        if st.toggle("แสดงเนื้อหา", key=f"show_sources_{source_id}"):
+            render_source_cards(load_sources(source_id))
+
+
+def display_sources(previews: List[Dict[str, Any]]):
+    """แสดงแหล่งที่มาของคำตอบใน expander"""
+    with st.expander(f"📚 ดูแหล่งที่มาข้อมูล ({len(previews)} แหล่ง)", expanded=False):
+        render_source_cards(previews)
+
+
+def render_source_cards(previews: List[Dict[str, Any]]):
+    """แสดงการ์ดแหล่งที่มาทั้งหมด (จากข้อมูลที่เตรียมไว้ด้วย _source_previews) ใน st.markdown เดียว"""
+    cards = [
+        f"""<div class="source-card">
+            <strong>📄 แหล่งที่มา {i}:</strong> {preview['filename']} (ส่วนที่ {preview['chunk_index']})<br>
+            <div style="margin-top: 0.5rem; font-style: italic;">
+                {preview['preview']}{'...' if preview['truncated'] else ''}
+            </div>
+        </div>"""
+        for i, preview in enumerate(previews, 1)
+    ]
+    st.markdown("\n".join(cards), unsafe_allow_html=True)
+
+
+def _source_previews(sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """เตรียมข้อมูลการ์ดแหล่งที่มาครั้งเดียวตอนได้คำตอบ (ทำความสะอาดและตัดข้อความไว้ล่วงหน้า)"""
+    return [
+        {
+            "filename": source.get('filename', 'ไม่ทราบชื่อไฟล์'),
+            "chunk_index": source.get('chunk_index', 'ไม่ทราบ'),
+            # ตัดข้อความก่อนทำความสะอาดจาก HTML tags (แสดงแค่ 300 ตัวอักษรอยู่แล้ว)
+            "preview": clean_html_content(source['content'][:400])[:300],
+            "truncated": len(source['content']) > 300
+        }
+        for source in sources
+    ]
+
+
+def ask_question(question: str, response_area):
+    """ถามคำถามและแสดงคำตอบแบบ streaming"""
+    rag_system = st.session_state.rag_system
+    
+    with response_area:
+        with st.chat_message("user"):
+            st.write(question)
         
-        # รีเฟรชหน้าเพื่อแสดงคำตอบใหม่
-        st.rerun()
+        with st.chat_message("assistant"):
+            st.write_stream(rag_system.ask_question_stream(question))
+            result = rag_system.last_result
+            previews = _source_previews(result.get('sources', []))
+            
+            if previews:
+                display_sources(previews)
+    
+    # deque เต็มแล้ว - รอบเก่าสุดจะถูกดันออก ลบแหล่งที่มาของรอบนั้นออกจากดิสก์ก่อน
+    chat_history = st.session_state.chat_history
+    if len(chat_history) == chat_history.maxlen:
+        delete_sources([chat_history[0]])
+    
+    # เพิ่มลงประวัติการสนทนา (เก็บแหล่งที่มาไว้บนดิสก์ เหลือแค่ id ใน session_state)
+    chat_history.append({
+        "question": result['question'],
+        "answer": result['answer'],
+        "timestamp": result['timestamp'],
+        "source_id": store_sources(previews) if previews else None,
+        "source_count": len(previews)
+    })
+    
+    # ข้อความใหม่แสดงอยู่แล้ว - rerun ทั้งหน้าเฉพาะเมื่อเปิดอัปเดตสถิติสด
+    if st.session_state.get("live_stats", False):
+        st.rerun(scope="app")
 
 
 def clear_chat_history():
     """ล้างประวัติการสนทนา"""
-    st.session_state.chat_history = []
+    delete_sources(st.session_state.chat_history)
+    st.session_state.chat_history.clear()
     if st.session_state.rag_system:
         st.session_state.rag_system.clear_chat_history()
     st.success("✅ ล้างประวัติการสนทนาเสร็จสิ้น")
@@ -940,21 +925,33 @@ def clear_chat_history():
 
 def clear_all_data():
     """ล้างข้อมูลทั้งหมด"""
-    st.session_state.chat_history = []
+    delete_sources(st.session_state.chat_history)
+    st.session_state.chat_history.clear()
     st.session_state.processed_files = []
     st.session_state.system_ready = False
     
+    # รอให้การบันทึกเบื้องหลังเสร็จก่อน ไม่งั้นไฟล์ที่เพิ่งลบอาจถูกเขียนกลับมา
+    _wait_for_pending_save()
+    
     if st.session_state.vector_store_manager:
-        st.session_state.vector_store_manager.clear_vector_store()
+        with _get_save_worker().lock:
+            st.session_state.vector_store_manager.clear_vector_store()
     
     st.session_state.vector_store_manager = None
     st.session_state.rag_system = None
-    
+
+    # ล้างเฉพาะสถิติที่ cache ไว้ - resource ใน cache_resource (โมเดล embedding, LLM, manager,
+    # save worker, shelve) แชร์กับ session อื่นที่ยังใช้งานอยู่ และข้อมูลใน manager ถูกล้างแล้วข้างบน
+    _system_stats_snapshot.clear()
+
     st.success("✅ ล้างข้อมูลทั้งหมดเสร็จสิ้น")
 
 
 def main():
     """ฟังก์ชันหลัก"""
+    # CSS (อ่านจาก cache)
+    st.markdown(_css_tag(), unsafe_allow_html=True)
+    
     # Enhanced Header with Animation
     st.markdown('''
     <h1 class="main-header">
@@ -996,75 +993,11 @@ def main():
     setup_sidebar()
     
     # เนื้อหาหลักด้วย Tabs สวยงาม
-    st.markdown("""
-    <style>
-        .stTabs [data-baseweb="tab-list"] {
-            gap: 24px;
-            background: linear-gradient(135deg, rgba(45, 55, 72, 0.6), rgba(26, 32, 44, 0.6));
-            padding: 1rem;
-            border-radius: 15px;
-        }
-        
-        .stTabs [data-baseweb="tab"] {
-            height: 50px;
-            background: linear-gradient(135deg, rgba(102, 126, 234, 0.2), rgba(118, 75, 162, 0.2));
-            border-radius: 10px;
-            color: white;
-            font-weight: 600;
-            transition: all 0.3s ease;
-        }
-        
-        .stTabs [aria-selected="true"] {
-            background: linear-gradient(135deg, #667eea, #764ba2) !important;
-            box-shadow: 0 4px 15px rgba(102, 126, 234, 0.5);
-            transform: translateY(-2px);
-        }
-        
-        .stTabs [data-baseweb="tab"]:hover {
-            background: linear-gradient(135deg, rgba(102, 126, 234, 0.4), rgba(118, 75, 162, 0.4));
-            transform: translateY(-2px);
-        }
-    </style>
-    """, unsafe_allow_html=True)
     
     tab1, tab2, tab3 = st.tabs(["📁 อัพโหลดเอกสาร", "💬 สนทนา", "ℹ️ ข้อมูลระบบ"])
     
     with tab1:
-        upload_documents()
-        
-        # แสดงไฟล์ที่ประมวลผลแล้วในรูปแบบสวยงาม
-        if st.session_state.processed_files:
-            st.markdown("""
-            <div style="margin-top: 2rem;">
-                <h3 style="color: #ffd93d; margin-bottom: 1rem; display: flex; align-items: center; gap: 0.5rem;">
-                    <span>📋</span>
-                    <span>ไฟล์ที่ประมวลผลแล้ว</span>
-                </h3>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            for i, file_info in enumerate(st.session_state.processed_files, 1):
-                st.markdown(f"""
-                <div style="background: linear-gradient(135deg, rgba(102, 126, 234, 0.15), rgba(118, 75, 162, 0.15)); 
-                            border-radius: 12px; padding: 1.2rem; margin: 0.8rem 0; 
-                            border-left: 4px solid #667eea; transition: all 0.3s ease;">
-                    <div style="display: flex; justify-content: space-between; align-items: center;">
-                        <div>
-                            <p style="color: #ffd93d; margin: 0; font-size: 1.1rem; font-weight: 600;">
-                                📄 {file_info['filename']}
-                            </p>
-                            <p style="color: #a0aec0; margin: 0.3rem 0 0 0; font-size: 0.9rem;">
-                                🧩 {file_info['chunks']} chunks | 📦 ประมวลผลเสร็จสิ้น
-                            </p>
-                        </div>
-                        <div style="background: linear-gradient(135deg, #667eea, #764ba2); 
-                                    padding: 0.5rem 1rem; border-radius: 20px; color: white; 
-                                    font-weight: 600; font-size: 0.9rem;">
-                            #{i}
-                        </div>
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
+        upload_tab()
     
     with tab2:
         chat_interface()
@@ -1078,7 +1011,7 @@ def display_system_info():
     st.subheader("ℹ️ ข้อมูลระบบ")
     
     if st.session_state.rag_system:
-        stats = st.session_state.rag_system.get_system_stats()
+        stats = _system_stats_snapshot(id(st.session_state.rag_system), st.session_state.rag_system)
         
         col1, col2 = st.columns(2)
         
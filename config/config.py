@@ -4,7 +4,9 @@ Configuration Manager for Thai RAG Chatbot
 """
 
 import os
-from typing import Dict, Any, List
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -47,11 +49,14 @@ class Config:
     # File size limit (50MB)
     MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "52428800"))
     
-    # Supported file extensions
-    SUPPORTED_EXTENSIONS = os.getenv(
-        "SUPPORTED_EXTENSIONS", 
-        ".txt,.pdf,.docx,.doc,.pptx,.ppt"
-    ).split(",")
+    # Supported file extensions (frozenset - normalize ครั้งเดียว และเช็คแบบ O(1))
+    SUPPORTED_EXTENSIONS = frozenset(
+        ext.strip().lower()
+        for ext in os.getenv(
+            "SUPPORTED_EXTENSIONS", 
+            ".txt,.pdf,.docx,.doc,.pptx,.ppt"
+        ).split(",")
+    )
     
     # =============================================
     # Streamlit Configuration
@@ -75,30 +80,35 @@ class Config:
     MAX_CHAT_HISTORY_LENGTH = int(os.getenv("MAX_CHAT_HISTORY_LENGTH", "50"))
     BATCH_SIZE = int(os.getenv("BATCH_SIZE", "32"))
     
+    # รายการโมเดล (สร้างครั้งเดียว แบบอ่านอย่างเดียว)
+    _EMBEDDING_MODELS = MappingProxyType({
+        "fast": "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+        "balanced": "sentence-transformers/distiluse-base-multilingual-cased",
+        "best": "sentence-transformers/paraphrase-multilingual-mpnet-base-v2",
+        "thai_optimized": "sentence-transformers/LaBSE"
+    })
+    
+    _LLM_MODELS = MappingProxyType({
+        "small_fast": "llama3.1:8b",
+        "balanced": "llama3.1:70b", 
+        "large": "llama3.1:405b",
+        "coding": "codellama:7b",
+        "chat": "mistral:7b"
+    })
+    
     @classmethod
-    def get_embedding_models(cls) -> Dict[str, str]:
+    def get_embedding_models(cls) -> Mapping[str, str]:
         """รายการโมเดล embedding ที่รองรับ"""
-        return {
-            "fast": "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-            "balanced": "sentence-transformers/distiluse-base-multilingual-cased",
-            "best": "sentence-transformers/paraphrase-multilingual-mpnet-base-v2",
-            "thai_optimized": "sentence-transformers/LaBSE"
-        }
+        return cls._EMBEDDING_MODELS
     
     @classmethod
-    def get_llm_models(cls) -> Dict[str, str]:
+    def get_llm_models(cls) -> Mapping[str, str]:
         """รายการโมเดล LLM ที่แนะนำ"""
-        return {
-            "small_fast": "llama3.1:8b",
-            "balanced": "llama3.1:70b", 
-            "large": "llama3.1:405b",
-            "coding": "codellama:7b",
-            "chat": "mistral:7b"
-        }
+        return cls._LLM_MODELS
     
     @classmethod
     def create_directories(cls) -> None:
-        """สร้างโฟลเดอร์ที่จำเป็น"""
+        """สร้างโฟลเดอร์ที่จำเป็น (เรียกเองตอนเริ่มระบบ - ไม่ทำอัตโนมัติตอน import)"""
         dirs_to_create = [
             cls.VECTOR_STORE_PATH,
             cls.DATA_DIR,
@@ -106,7 +116,9 @@ class Config:
         ]
         
         for dir_path in dirs_to_create:
-            Path(dir_path).mkdir(parents=True, exist_ok=True)
+            # กรณีปกติโฟลเดอร์มีอยู่แล้ว → stat ครั้งเดียวแล้วข้าม
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path, exist_ok=True)
     
     @classmethod
     def validate_file(cls, file_path: str, file_size: int) -> tuple[bool, str]:
@@ -124,8 +136,9 @@ class Config:
         return True, "ไฟล์ถูกต้อง"
     
     @classmethod
+    @lru_cache(maxsize=1)
     def get_config_summary(cls) -> Dict[str, Any]:
-        """สรุปการตั้งค่าปัจจุบัน"""
+        """สรุปการตั้งค่าปัจจุบัน (สร้างครั้งเดียว - ค่าที่คืนใช้ร่วมกัน ห้ามแก้ไข)"""
         return {
             "ollama": {
                 "base_url": cls.OLLAMA_BASE_URL,
@@ -144,7 +157,7 @@ class Config:
             },
             "files": {
                 "max_size_mb": cls.MAX_FILE_SIZE / 1024 / 1024,
-                "supported_extensions": cls.SUPPORTED_EXTENSIONS
+                "supported_extensions": sorted(cls.SUPPORTED_EXTENSIONS)
             },
             "processing": {
                 "chunk_size": cls.DEFAULT_CHUNK_SIZE,
@@ -155,15 +168,14 @@ class Config:
         }
 
 
-# สร้างโฟลเดอร์ที่จำเป็นเมื่อ import
-Config.create_directories()
-
-
 # ตัวอย่างการใช้งาน
 if __name__ == "__main__":
     print("🔧 การตั้งค่าระบบ Thai RAG Chatbot")
     print("=" * 50)
     
+    # สร้างโฟลเดอร์ที่จำเป็น
+    Config.create_directories()
+    
     config_summary = Config.get_config_summary()
     
     for section, settings in config_summary.items():
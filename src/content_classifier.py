@@ -3,11 +3,116 @@ Content Classifier for Dynamic Chunking Strategy
 จำแนกประเภทเนื้อหาเพื่อเลือก chunking strategy ที่เหมาะสม
 """
 
+import hashlib
+import logging
 import re
-from typing import Literal
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Dict, Literal, Mapping, Optional, Tuple
 
 ContentType = Literal["general", "curriculum_table", "course_description", "appendix"]
 
+# log ผลการจำแนก (ระดับ DEBUG - ปิดอยู่ตามปกติ จึงไม่เสียเวลาจัดรูปแบบข้อความ)
+logger = logging.getLogger(__name__)
+
+# Regex ที่ใช้จำแนกเนื้อหา (compile ครั้งเดียวตอนโหลดโมดูล)
+_RE_YEAR = re.compile(r'ปี\s*ที่\s*\d+|ชั้นปี\s*\d+', re.IGNORECASE)
+_RE_SEMESTER = re.compile(r'ภาค\s*การศึกษา\s*ที่\s*\d+|ภาค\s*\d+|เทอม\s*\d+', re.IGNORECASE)
+_RE_COURSE_CODE = re.compile(r'\b\d{8}\b')
+_RE_TOTAL_CREDITS = re.compile(r'รวม\s+\d+\s+หน่วยกิต')
+_RE_COURSE_START = re.compile(r'^\s*(\d{8})\s+')
+_RE_ENGLISH_NAME = re.compile(r'\([A-Z][a-zA-Z\s]+\)')
+_RE_APPENDIX_KW = re.compile(
+    r'ภาคผนวก|Appendix|แผนที่หลักสูตร|Curriculum\s+Map|เอกสารอ้างอิง|รายชื่ออาจารย์',
+    re.IGNORECASE
+)
+
+# รวม pattern ของตาราง/ภาคผนวกเป็น regex เดียว เพื่อสแกนข้อความรอบเดียวแทนหลายรอบ
+_RE_FEATURES = re.compile(
+    rf'(?P<year>{_RE_YEAR.pattern})'
+    rf'|(?P<semester>{_RE_SEMESTER.pattern})'
+    rf'|(?P<total>{_RE_TOTAL_CREDITS.pattern})'
+    rf'|(?P<code>{_RE_COURSE_CODE.pattern})'
+    rf'|(?P<appendix>{_RE_APPENDIX_KW.pattern})',
+    re.IGNORECASE
+)
+
+_RE_DIGIT = re.compile(r'\d')
+
+# จำนวนรหัสวิชาขั้นต่ำที่ถือว่าเป็นตารางหลักสูตร
+_MIN_TABLE_COURSE_CODES = 3
+
+
+# cache ผลการจำแนก (key = hash ของข้อความ + หมายเลขหน้า) - เก็บแค่ hash ไม่เก็บข้อความยาวๆ
+_CLASSIFY_CACHE_SIZE = 4096
+_classify_cache: "OrderedDict[Tuple[bytes, Optional[int]], ContentType]" = OrderedDict()
+_classify_cache_lock = threading.Lock()  # เอกสารหลายไฟล์ถูกประมวลผลพร้อมกันใน thread pool
+
+# ข้อมูล strategy ของแต่ละประเภท (สร้างครั้งเดียว เป็นแบบอ่านอย่างเดียวเพราะแชร์ให้ทุกผู้เรียก)
+_STRATEGIES: Mapping[str, Mapping[str, Any]] = MappingProxyType({
+    "general": MappingProxyType({
+        "chunk_size": 1000,
+        "chunk_overlap": 200,
+        "description": "เนื้อหาทั่วไป (บทความ, คำอธิบาย)"
+    }),
+    "curriculum_table": MappingProxyType({
+        "chunk_size": 3000,
+        "chunk_overlap": 500,
+        "description": "ตารางรายวิชา (ครบถ้วน, ไม่ตัด)"
+    }),
+    "course_description": MappingProxyType({
+        "chunk_size": 1500,
+        "chunk_overlap": 300,
+        "description": "คำอธิบายรายวิชา (1 chunk = 1 วิชา)"
+    }),
+    "appendix": MappingProxyType({
+        "chunk_size": 800,
+        "chunk_overlap": 150,
+        "description": "ภาคผนวก (ประหยัด)"
+    }),
+})
+
+
+def _leading_course_code(text: str) -> Optional[str]:
+    """
+    คืนรหัสวิชา 8 หลักที่อยู่ต้นข้อความ (ถ้ามี) - เทียบเท่า _RE_COURSE_START
+    
+    เช็คด้วย str method บนส่วนหัวของข้อความก่อน ใช้ regex เฉพาะกรณีที่ข้อความสั้น
+    หรือมีช่องว่างนำหน้ายาวมาก
+    """
+    head = text[:64].lstrip()
+    if len(head) >= 9:
+        if head[:8].isdecimal() and head[8].isspace():
+            return head[:8]
+        return None
+    
+    match = _RE_COURSE_START.match(text)
+    return match.group(1) if match else None
+
+
+def _scan_features(text: str) -> Dict[str, int]:
+    """
+    สแกนข้อความรอบเดียวแล้วนับจำนวน match ของแต่ละ feature
+    (year, semester, total, code, appendix)
+    
+    หยุดทันทีเมื่อผลการจำแนกตารางไม่เปลี่ยนแล้ว (มีครบทุก feature และรหัสวิชาถึงเกณฑ์)
+    """
+    features = {"year": 0, "semester": 0, "total": 0, "code": 0, "appendix": 0}
+    
+    # ปี/ภาค/หน่วยกิตรวม/รหัสวิชา ต้องมีตัวเลขเสมอ - ข้อความทั่วไปที่ไม่มีตัวเลขเลย
+    # เช็คแค่คำสำคัญของภาคผนวก (regex ง่ายกว่า regex รวมมาก)
+    if not _RE_DIGIT.search(text):
+        features["appendix"] = int(_RE_APPENDIX_KW.search(text) is not None)
+        return features
+    
+    for match in _RE_FEATURES.finditer(text):
+        features[match.lastgroup] += 1
+        if (features["code"] >= _MIN_TABLE_COURSE_CODES and features["year"]
+                and features["semester"] and features["total"]):
+            break
+    return features
+
 
 class ContentClassifier:
     """จำแนกประเภทเนื้อหาเพื่อเลือก chunking strategy"""
@@ -15,7 +120,7 @@ class ContentClassifier:
     @staticmethod
     def classify(text: str, page_num: int = None) -> ContentType:
         """
-        จำแนกประเภทเนื้อหา
+        จำแนกประเภทเนื้อหา (ข้อความเดิมที่เคยจำแนกแล้วจะใช้ผลจาก cache)
         
         Args:
             text: ข้อความที่ต้องการจำแนก
@@ -24,10 +129,31 @@ class ContentClassifier:
         Returns:
             ประเภทเนื้อหา: general, curriculum_table, course_description, appendix
         """
+        key = (hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest(), page_num)
+        
+        with _classify_cache_lock:
+            if key in _classify_cache:
+                _classify_cache.move_to_end(key)
+                return _classify_cache[key]
+        
+        content_type = ContentClassifier._classify_uncached(text, page_num)
+        
+        with _classify_cache_lock:
+            _classify_cache[key] = content_type
+            if len(_classify_cache) > _CLASSIFY_CACHE_SIZE:
+                _classify_cache.popitem(last=False)
+        
+        return content_type
+    
+    @staticmethod
+    def _classify_uncached(text: str, page_num: int = None) -> ContentType:
+        """จำแนกประเภทเนื้อหาจริง (ไม่ผ่าน cache)"""
+        # สแกน pattern ของตาราง/ภาคผนวกรอบเดียว ใช้ร่วมกันทั้งสองเงื่อนไข
+        features = _scan_features(text)
         
         # 🔥 1. ตรวจสอบ Curriculum Table ก่อน (มีลำดับความสำคัญสูงสุด!)
         # ต้องเช็คก่อน appendix เพราะตารางอาจมีคำว่า "ภาคผนวก" ด้วย
-        if ContentClassifier._is_curriculum_table(text):
+        if ContentClassifier._is_curriculum_table(text, features):
             return "curriculum_table"
         
         # 2. ตรวจสอบ Course Description
@@ -35,14 +161,14 @@ class ContentClassifier:
             return "course_description"
         
         # 3. ตรวจสอบ Appendix (เช็คทีหลัง เพื่อไม่ให้ทับตาราง)
-        if ContentClassifier._is_appendix(text, page_num):
+        if ContentClassifier._is_appendix(text, page_num, features):
             return "appendix"
         
         # 4. Default: General content
         return "general"
     
     @staticmethod
-    def _is_curriculum_table(text: str) -> bool:
+    def _is_curriculum_table(text: str, features: Optional[Dict[str, int]] = None) -> bool:
         """
         ตรวจสอบว่าเป็นตารางแผนการศึกษาหรือไม่
         
@@ -51,31 +177,28 @@ class ContentClassifier:
         - มีรหัสวิชา 3 รายการขึ้นไป
         - มีคำว่า "หน่วยกิต"
         - มีรูปแบบ "รวม XX หน่วยกิต"
+        
+        features: ผลจาก _scan_features (ถ้าไม่ส่งมาจะสแกนเอง)
         """
+        if features is None:
+            features = _scan_features(text)
+        
         # เงื่อนไข 1: มีหัวข้อ "ปีที่ X" และ "ภาคการศึกษาที่ Y" (แยกเช็ค - ยืดหยุ่นกว่า)
-        has_year = bool(re.search(
-            r'ปี\s*ที่\s*\d+|ชั้นปี\s*\d+', 
-            text,
-            re.IGNORECASE
-        ))
-        
-        has_semester = bool(re.search(
-            r'ภาค\s*การศึกษา\s*ที่\s*\d+|ภาค\s*\d+|เทอม\s*\d+',
-            text,
-            re.IGNORECASE
-        ))
+        has_year = features["year"] > 0
+        
+        has_semester = features["semester"] > 0
         
         has_year_semester = has_year and has_semester
         
         # เงื่อนไข 2: มีรหัสวิชา 3 รายการขึ้นไป (8 หลัก เช่น 05506232)
-        course_codes = re.findall(r'\b\d{8}\b', text)
-        has_multiple_courses = len(course_codes) >= 3
+        course_count = features["code"]
+        has_multiple_courses = course_count >= _MIN_TABLE_COURSE_CODES
         
         # เงื่อนไข 3: มีคำว่า "หน่วยกิต"
         has_credits = 'หน่วยกิต' in text
         
         # เงื่อนไข 4: มีรูปแบบ "รวม XX หน่วยกิต"
-        has_total = bool(re.search(r'รวม\s+\d+\s+หน่วยกิต', text))
+        has_total = features["total"] > 0
         
         # 🔥 ลดเกณฑ์: ต้องผ่านอย่างน้อย 2/4 เงื่อนไข (แต่ต้องมีรหัสวิชา!)
         score = sum([
@@ -89,7 +212,7 @@ class ContentClassifier:
         is_table = (score >= 2 and has_multiple_courses) or score >= 3
         
         if is_table:
-            print(f"   ✅ ตรวจพบตารางหลักสูตร (คะแนน {score}/4, รหัสวิชา {len(course_codes)} รายการ)")
+            logger.debug("✅ ตรวจพบตารางหลักสูตร (คะแนน %d/4, รหัสวิชา %d+ รายการ)", score, course_count)
         
         return is_table
     
@@ -104,26 +227,26 @@ class ContentClassifier:
         - มีชื่อวิชาภาษาอังกฤษในวงเล็บ
         """
         # เงื่อนไข 1: ขึ้นต้นด้วยรหัสวิชา 8 หลัก
-        starts_with_code = bool(re.match(r'^\s*\d{8}\s+', text))
-        
-        # เงื่อนไข 2: มีคำว่า "วัตถุประสงค์" หรือ "เนื้อหารายวิชา"
-        has_objective = 'วัตถุประสงค์' in text or 'เนื้อหารายวิชา' in text or 'เนื้อหา' in text[:200]
+        course_code = _leading_course_code(text)
+        if course_code is None:
+            # ไม่ขึ้นต้นด้วยรหัสวิชา → ไม่ต้องสแกนเงื่อนไขอื่นทั้งข้อความ
+            return False
         
-        # เงื่อนไข 3: มีชื่อวิชาภาษาอังกฤษในวงเล็บ
-        has_english_name = bool(re.search(r'\([A-Z][a-zA-Z\s]+\)', text[:300]))
+        # เงื่อนไข 3: มีชื่อวิชาภาษาอังกฤษในวงเล็บ (เช็คก่อน เพราะดูแค่ 300 ตัวอักษรแรก)
+        has_english_name = bool(_RE_ENGLISH_NAME.search(text[:300]))
         
-        is_course = starts_with_code and (has_objective or has_english_name)
+        # เงื่อนไข 2: มีคำว่า "วัตถุประสงค์" หรือ "เนื้อหารายวิชา" (สแกนทั้งข้อความเมื่อจำเป็นเท่านั้น)
+        is_course = has_english_name or (
+            'วัตถุประสงค์' in text or 'เนื้อหารายวิชา' in text or 'เนื้อหา' in text[:200]
+        )
         
         if is_course:
-            # ดึงรหัสวิชาเพื่อแสดง
-            code_match = re.match(r'^\s*(\d{8})\s+', text)
-            code = code_match.group(1) if code_match else "unknown"
-            print(f"   ✅ ตรวจพบคำอธิบายรายวิชา (รหัส {code})")
+            logger.debug("✅ ตรวจพบคำอธิบายรายวิชา (รหัส %s)", course_code)
         
         return is_course
     
     @staticmethod
-    def _is_appendix(text: str, page_num: int = None) -> bool:
+    def _is_appendix(text: str, page_num: int = None, features: Optional[Dict[str, int]] = None) -> bool:
         """
         ตรวจสอบว่าเป็นภาคผนวกหรือไม่
         
@@ -132,19 +255,20 @@ class ContentClassifier:
         - มีคำว่า "แผนที่หลักสูตร" หรือ "Curriculum Map"
         - หน้ามากกว่า 45 (ถ้ามี page_num)
         - **แต่ห้ามมีรหัสวิชา 3+ รายการ** (คงเป็นตาราง)
+        
+        features: ผลจาก _scan_features (ถ้าไม่ส่งมาจะสแกนเอง)
         """
+        if features is None:
+            features = _scan_features(text)
+        
         # ตรวจสอบว่ามีรหัสวิชาเยอะไหม (ถ้ามี = คงเป็นตาราง ไม่ใช่ appendix)
-        course_codes = re.findall(r'\b\d{8}\b', text)
-        if len(course_codes) >= 3:
+        course_count = features["code"]
+        if course_count >= _MIN_TABLE_COURSE_CODES:
             # มีรหัสวิชาเยอะ → น่าจะเป็นตาราง ไม่ใช่ appendix
             return False
         
         # มีคำสำคัญ
-        has_appendix_keyword = bool(re.search(
-            r'ภาคผนวก|Appendix|แผนที่หลักสูตร|Curriculum\s+Map|เอกสารอ้างอิง|รายชื่ออาจารย์',
-            text,
-            re.IGNORECASE
-        ))
+        has_appendix_keyword = features["appendix"] > 0
         
         # หน้ามากกว่า 45 (สันนิษฐาน)
         is_late_page = page_num and page_num > 45
@@ -152,39 +276,16 @@ class ContentClassifier:
         is_appendix = has_appendix_keyword or is_late_page
         
         if is_appendix:
-            print(f"   ✅ ตรวจพบภาคผนวก (รหัสวิชา: {len(course_codes)} รายการ)")
+            logger.debug("✅ ตรวจพบภาคผนวก (รหัสวิชา: %d รายการ)", course_count)
         
         return is_appendix
     
     @staticmethod
-    def get_strategy_info(content_type: ContentType) -> dict:
+    def get_strategy_info(content_type: ContentType) -> Mapping[str, Any]:
         """
         ดึงข้อมูล strategy สำหรับแต่ละประเภท
         
         Returns:
-            dict with chunk_size, chunk_overlap, description
+            mapping (อ่านอย่างเดียว) with chunk_size, chunk_overlap, description
         """
-        strategies = {
-            "general": {
-                "chunk_size": 1000,
-                "chunk_overlap": 200,
-                "description": "เนื้อหาทั่วไป (บทความ, คำอธิบาย)"
-            },
-            "curriculum_table": {
-                "chunk_size": 3000,
-                "chunk_overlap": 500,
-                "description": "ตารางรายวิชา (ครบถ้วน, ไม่ตัด)"
-            },
-            "course_description": {
-                "chunk_size": 1500,
-                "chunk_overlap": 300,
-                "description": "คำอธิบายรายวิชา (1 chunk = 1 วิชา)"
-            },
-            "appendix": {
-                "chunk_size": 800,
-                "chunk_overlap": 150,
-                "description": "ภาคผนวก (ประหยัด)"
-            }
-        }
-        
-        return strategies.get(content_type, strategies["general"])
+        return _STRATEGIES.get(content_type, _STRATEGIES["general"])
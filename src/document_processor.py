@@ -4,30 +4,173 @@ Document Processor for Thai RAG Chatbot
 รองรับ Dynamic Chunking Strategy
 """
 
+import codecs
+import hashlib
+import io
+import mmap
 import os
 import re
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+from importlib.util import find_spec
+from typing import List, Dict, Any, BinaryIO, Iterator, Optional, Tuple, Union
 from pathlib import Path
 import chardet
 
-# Document reading libraries
-import PyPDF2
-from docx import Document
-from pptx import Presentation
-
-# Thai language processing
-import pythainlp
-from pythainlp.tokenize import word_tokenize
-from pythainlp.corpus.common import thai_words
+# ไลบรารีอ่านเอกสาร (PyPDF2/pypdfium2, python-docx, python-pptx) และ pythainlp import เมื่อใช้งานจริง
+# ใน method ที่ต้องใช้ - ไม่ต้องโหลดทุกตัว (และพจนานุกรมไทย) ตอน import โมดูล
 
 # LangChain text processing
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document as LangChainDocument
 
 # Dynamic Chunking
-from dynamic_text_splitter import DynamicTextSplitter
+from dynamic_text_splitter import ThaiRecursiveCharacterTextSplitter, get_dynamic_splitter
 from content_classifier import ContentType
 
+# อักขระความกว้างศูนย์ (ZWSP, ZWNJ, ZWJ, WORD JOINER, BOM) ที่มักติดมากับข้อความจาก PDF/Word
+# ลบด้วย str.translate รอบเดียวก่อนใช้ regex เพื่อให้ขั้นตอนรวมช่องว่างไทยทำงานได้ครบ
+_ZERO_WIDTH_TABLE = dict.fromkeys(map(ord, '\u200b\u200c\u200d\u2060\ufeff'))
+
+# PDFium (C++) ดึงข้อความ PDF เร็วกว่า PyPDF2 (pure Python) มาก - ใช้ถ้าติดตั้งไว้
+_HAS_PDFIUM = find_spec("pypdfium2") is not None
+
+# PDFium ไม่ thread-safe - ทุกการเรียก PDFium ใน process ต้องทำทีละ thread
+# (app.py อ่านไฟล์ที่อัพโหลดหลายไฟล์พร้อมกันใน ThreadPoolExecutor)
+_PDFIUM_LOCK = threading.Lock()
+
+# engine ตัดคำสำหรับ get_text_stats: ใช้ nlpo3 (Rust) ถ้าติดตั้งไว้ ไม่งั้นใช้ newmm (pure Python)
+_STATS_TOKENIZER_ENGINE = "nlpo3" if find_spec("nlpo3") else "newmm"
+
+# จำนวน bytes ต้นไฟล์ที่ส่งให้ chardet (chardet เป็น pure Python - ตรวจทั้งไฟล์ใหญ่ๆ ช้ามาก)
+_ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# Regex สำหรับทำความสะอาดข้อความไทย (compile ครั้งเดียวตอนโหลดโมดูล)
+# ช่องว่างที่ PDF แทรกระหว่างตัวอักษรไทย/สระ/วรรณยุกต์ - รวมหลายกฎเป็น alternation เดียว สแกนข้อความรอบเดียว
+# ใน PDF: ไทย+ช่องว่าง+ไทย, ไทย+ช่องว่าง+สระ/วรรณยุกต์ และช่องว่างใดๆ ก่อนสระ/วรรณยุกต์
+_RE_PDF_THAI_SPACE = re.compile(
+    r'([\u0E00-\u0E7F])\s+([\u0E00-\u0E7F])'
+    r'|\s+(?=[\u0E31-\u0E3A\u0E47-\u0E4E])'
+)
+# ใน clean_thai_text: ไทย+ช่องว่าง+ไทย และไทย+ช่องว่าง+สระ/วรรณยุกต์ (ขั้นตอนที่ 1-2)
+_RE_THAI_SPACE = re.compile(
+    r'([\u0E00-\u0E7F])\s+([\u0E00-\u0E7F])'
+    r'|(?<=[\u0E00-\u0E7F])\s+(?=[\u0E31-\u0E3A\u0E47-\u0E4E])'
+)
+
+
+def _join_thai_space(match: re.Match) -> str:
+    """replacement ของ _RE_PDF_THAI_SPACE/_RE_THAI_SPACE: ต่อตัวอักษรสองตัว หรือลบช่องว่างก่อนสระ"""
+    first = match.group(1)
+    return first + match.group(2) if first else ''
+
+
+# ขั้นตอนที่ 1-4 ของ clean_thai_text: (pattern, replacement) ตามลำดับที่ต้องใช้
+_THAI_CLEAN_RULES = [
+    # ขั้นตอนที่ 1-2: ลบช่องว่างระหว่างตัวอักษรไทย และระหว่างตัวอักษรกับสระ/วรรณยุกต์
+    # "ก ว า ย" → "กวาย", "น ้ อ ย" → "น้อย", "ร ั บ" → "รับ"
+    (_RE_THAI_SPACE, _join_thai_space),
+    (re.compile(r'\s+([\u0E31-\u0E3A\u0E47-\u0E4E])\s+'), r'\1'),
+    
+    # ขั้นตอนที่ 3: 🔥 แก้ช่องว่างในรหัสวิชา ก่อนแก้อย่างอื่น - "0550 6231" → "05506231"
+    (re.compile(r'\b(\d{4})\s+(\d{4})\b'), r'\1\2'),
+    (re.compile(r'\b(\d{2})\s+(\d{2})\s+(\d{4})\b'), r'\1\2\3'),
+    
+    # ขั้นตอนที่ 4: แก้ตัวเลข/อักขระพิเศษที่ติดคำไทย
+    (re.compile(r'คอมพิวเตอร4'), 'คอมพิวเตอร์'),
+    (re.compile(r'([\u0E00-\u0E7F]+)4'), r'\1์'),  # แปลง "คำ4" → "คำ์"
+    (re.compile(r'([\u0E00-\u0E7F]+)e'), r'\1ี'),  # แปลง "ปe" → "ปี"
+    (re.compile(r'([\u0E00-\u0E7F]+)F'), r'\1้'),  # แปลง "หนF" → "หน้"
+    (re.compile(r'([\u0E00-\u0E7F]+)Q'), r'\1้'),  # แปลง "กQ" → "ก้"
+    
+    # เพิ่มตัวอักษรพิเศษอื่นๆ ที่พบในเอกสาร
+    (re.compile(r'เปbด'), 'เปิด'),
+    (re.compile(r'ไม้น้อยกว้า'), 'ไม่น้อยกว่า'),
+    (re.compile(r'ได้แก้'), 'ได้แก่'),
+    (re.compile(r'ฝå'), 'ฝึ'),
+    (re.compile(r'พระจอมเกล<าเจ<า'), 'พระจอมเกล้าเจ้า'),
+]
+
+# ขั้นตอนที่ 5: แก้คำที่พบบ่อยซึ่งมักมีปัญหาใน PDF
+# (คำที่ต้องแก้เป็นข้อความธรรมดาทั้งหมด จึงรวมเป็น alternation เดียวแล้วสแกนข้อความรอบเดียว
+#  ลำดับใน dict สำคัญ - คำยาวที่ขึ้นต้นเหมือนกันต้องอยู่ก่อนคำสั้น)
+_COMMON_FIXES = {
+    r'ห น ่ ว ย': 'หน่วย',
+    r'ห น ่ วย': 'หน่วย',
+    r'หนวยกิต': 'หน่วยกิต',
+    r'ก ิ ต': 'กิต',
+    r'ก ิต': 'กิต',
+    r'ห ล ั ก ส ู ต ร': 'หลักสูตร',
+    r'ห ล ั กส ู ตร': 'หลักสูตร',
+    r'ว ิ ท ย า': 'วิทยา',
+    r'ว ิทย า': 'วิทยา',
+    r'ศ ึ ก ษ า': 'ศึกษา',
+    r'ศ ึกษ า': 'ศึกษา',
+    r'ภ า ค': 'ภาค',
+    r'เท อ ม': 'เทอม',
+    r'ป ร ะ จ ำ': 'ประจำ',
+    r'เกลQาเจQา': 'เกล้าเจ้า',
+    r'วFา': 'ว่า',
+    r'ดQวย': 'ด้วย',
+    # 🔥 เพิ่มคำที่พบจากการทดสอบ
+    r'คดีศาสตร์ดิลิลธิล': 'คณิตศาสตร์ดิสครีต',
+    r'คดีศาสตร์': 'คณิตศาสตร์',
+    r'ดิลิลธิล': 'ดิสครีต',
+    r'ปฏิสัมพันระ': 'ปฏิสัมพันธ์',
+    r'สวัดกรรม': 'วิศวกรรม',
+    r'สวัด': 'วิศว',
+}
+_RE_COMMON_FIXES = re.compile('|'.join(map(re.escape, _COMMON_FIXES)))
+
+# ขั้นตอนที่ 6-8
+_RE_MULTI_SPACE = re.compile(r' {2,}')
+_RE_DISALLOWED_CHARS = re.compile(r'[^\u0E00-\u0E7F\w\s\.\,\!\?\;\:\-\(\)\"\'\/\n]')
+_RE_MULTI_NEWLINE = re.compile(r'\n{3,}')
+
+# Regex สำหรับ metadata ของแต่ละ chunk (ใช้ใน _iter_split_document ทุก chunk)
+# รหัสวิชา 8 หลัก ทั้งแบบติดกันและแยกด้วยช่องว่าง/ขีด เช่น 05506232, 0550 6232, 9064-1001
+_RE_CHUNK_COURSE_CODE = re.compile(r'\b(\d{4})\s*(?:-\s*)?(\d{4})\b')
+# ชั้นปี/ภาคการศึกษา: ลองทีละ pattern ตามลำดับ ใช้ pattern แรกที่เจอ
+_RE_CHUNK_YEARS = (
+    re.compile(r'ปีที่\s*(\d+)'),
+    re.compile(r'ชั้นปี\s*(\d+)'),
+    re.compile(r'แผนการศึกษา\s*ปีที่\s*(\d+)'),
+)
+_RE_CHUNK_SEMESTERS = (
+    re.compile(r'ภาคการศึกษาที่\s*(\d+)'),
+    re.compile(r'ภาค\s*(\d+)'),
+    re.compile(r'เทอม\s*(\d+)'),
+)
+_RE_CHUNK_TOTAL_CREDITS = re.compile(r'รวม\s+(\d+)\s+หน่วยกิต')
+_RE_CHUNK_CREDITS = re.compile(r'(\d+)\s*หน่วยกิต')
+
+
+def _first_group(patterns, text: str) -> Optional[str]:
+    """คืน group แรกของ pattern แรก (ตามลำดับ) ที่พบในข้อความ"""
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            return match.group(1)
+    return None
+
+
+@lru_cache(maxsize=256)
+def _detect_encoding_cached(file_path: str, mtime_ns: int, size: int) -> str:
+    """ตรวจ encoding จากตัวอย่างต้นไฟล์ (cache ตาม path + เวลาแก้ไข + ขนาด ไฟล์ที่แก้แล้วจะตรวจใหม่)"""
+    with open(file_path, 'rb') as file:
+        sample = file.read(_ENCODING_SAMPLE_SIZE)
+    return chardet.detect(sample)['encoding'] or 'utf-8'
+
+
+def _file_digest(file_path: str) -> str:
+    """sha256 ของเนื้อหาไฟล์ (อ่านทีละ 1 MB ไม่โหลดทั้งไฟล์)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 
 class ThaiDocumentProcessor:
     """คลาสสำหรับประมวลผลเอกสารภาษาไทย พร้อม Dynamic Chunking"""
@@ -46,13 +189,13 @@ class ThaiDocumentProcessor:
         if use_dynamic_chunking:
             # ใช้ Dynamic Text Splitter (แนะนำ!)
             print("✨ เปิดใช้งาน Dynamic Chunking Strategy")
-            self.dynamic_splitter = DynamicTextSplitter()
+            self.dynamic_splitter = get_dynamic_splitter()
             self.text_splitter = None  # ไม่ใช้ fixed splitter
         else:
             # ใช้ Fixed Text Splitter (แบบเดิม)
             print(f"⚠️ ใช้ Fixed Chunking ({chunk_size}/{chunk_overlap})")
             self.dynamic_splitter = None
-            self.text_splitter = RecursiveCharacterTextSplitter(
+            self.text_splitter = ThaiRecursiveCharacterTextSplitter(
                 chunk_size=chunk_size,
                 chunk_overlap=chunk_overlap,
                 length_function=len,
@@ -78,152 +221,143 @@ class ThaiDocumentProcessor:
     def detect_encoding(self, file_path: str) -> str:
         """ตัวอย่างการตรวจสอบ encoding ของไฟล์"""
         try:
-            with open(file_path, 'rb') as file:
-                raw_data = file.read()
-                result = chardet.detect(raw_data)
-                return result['encoding'] or 'utf-8'
+            stat = os.stat(file_path)
+            return _detect_encoding_cached(file_path, stat.st_mtime_ns, stat.st_size)
         except Exception:
             return 'utf-8'
     
     def read_text_file(self, file_path: str) -> str:
-        """อ่านไฟล์ text ธรรมดา"""
-        encoding = self.detect_encoding(file_path)
+        """อ่านไฟล์ text ธรรมดา (mmap ไฟล์แล้ว decode จาก page cache โดยตรง ไม่ต้อง read() เป็น bytes ก่อน)"""
+        with open(file_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return ""  # mmap ไฟล์ขนาด 0 ไม่ได้
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return self.decode_text(mapped, file_path, file_path=file_path)
+    
+    def decode_text(self, raw_data: Union[bytes, mmap.mmap], name: str = "", file_path: Optional[str] = None) -> str:
+        """แปลง bytes ของไฟล์ text เป็นข้อความ (ตรวจ encoding ด้วย chardet จากตัวอย่างต้นไฟล์)
+        
+        ถ้าระบุ file_path จะใช้ผลตรวจ encoding ที่ cache ไว้ของไฟล์นั้น (detect_encoding)
+        """
+        # มี UTF-8 BOM → รู้ encoding แน่นอนแล้ว ไม่ต้องเรียก chardet
+        if raw_data[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+            encoding = 'utf-8-sig'
+        else:
+            # เอกสารไทยส่วนใหญ่เป็น UTF-8 - ถ้า decode แบบ strict ผ่านก็ไม่ต้องเรียก chardet
+            # (ข้อมูล cp874/TIS-620 ที่มีอักษรไทยแทบไม่มีทางเป็น UTF-8 ที่ถูกต้อง)
+            try:
+                return str(raw_data, 'utf-8')
+            except UnicodeDecodeError:
+                pass
+            if file_path is not None:
+                encoding = self.detect_encoding(file_path)
+            else:
+                encoding = chardet.detect(raw_data[:_ENCODING_SAMPLE_SIZE])['encoding'] or 'utf-8'
         try:
-            with open(file_path, 'r', encoding=encoding) as file:
-                return file.read()
-        except UnicodeDecodeError:
+            return str(raw_data, encoding)
+        except (UnicodeDecodeError, LookupError):
             # ลองใช้ encoding อื่น
             for enc in ['utf-8', 'cp874', 'iso-8859-11']:
                 try:
-                    with open(file_path, 'r', encoding=enc) as file:
-                        return file.read()
+                    return str(raw_data, enc)
                 except UnicodeDecodeError:
                     continue
-            raise ValueError(f"ไม่สามารถอ่านไฟล์ {file_path} ได้")
+            raise ValueError(f"ไม่สามารถอ่านไฟล์ {name} ได้")
     
-    def read_pdf_file(self, file_path: str) -> str:
-        """อ่านไฟล์ PDF ด้วยการปรับปรุงคุณภาพข้อความ"""
-        text = ""
+    def read_pdf_file(self, file_path: Union[str, BinaryIO]) -> str:
+        """อ่านไฟล์ PDF ด้วยการปรับปรุงคุณภาพข้อความ (รับได้ทั้ง path และ stream ในหน่วยความจำ)"""
+        pages = []  # เก็บข้อความทีละหน้าแล้ว join ครั้งเดียว (ไม่ต่อ string ซ้ำๆ ใน loop)
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page_num, page in enumerate(pdf_reader.pages):
-                    page_text = page.extract_text()
-                    
-                    # ลบช่องว่างพิเศษระหว่างตัวอักษรไทย (ปัญหาหลักของ PDF)
-                    # "ร ้ า น ง า น" → "ร้านงาน"
-                    page_text = re.sub(r'([\u0E00-\u0E7F])\s+([\u0E00-\u0E7F])', r'\1\2', page_text)
-                    
-                    # ลบช่องว่างระหว่างตัวอักษรไทยกับสระ/วรรณยุกต์
-                    # "น ้ อ ย" → "น้อย"
-                    page_text = re.sub(r'([\u0E00-\u0E7F])\s+([\u0E31-\u0E3A\u0E47-\u0E4E])', r'\1\2', page_text)
+            with (open(file_path, 'rb') if isinstance(file_path, str) else nullcontext(file_path)) as file:
+                for page_num, page_text in enumerate(self._iter_pdf_page_texts(file)):
+                    page_text = page_text.translate(_ZERO_WIDTH_TABLE)
                     
-                    # ลบช่องว่างก่อนสระบน/ล่าง
-                    page_text = re.sub(r'\s+([\u0E31-\u0E3A\u0E47-\u0E4E])', r'\1', page_text)
+                    # ลบช่องว่างพิเศษระหว่างตัวอักษรไทย/สระ/วรรณยุกต์ (ปัญหาหลักของ PDF) ในรอบเดียว
+                    # "ร ้ า น ง า น" → "ร้านงาน", "น ้ อ ย" → "น้อย"
+                    page_text = _RE_PDF_THAI_SPACE.sub(_join_thai_space, page_text)
                     
-                    text += page_text + "\n"
+                    pages.append(page_text)
                     
                     # Debug: แสดงตัวอย่างข้อความที่อ่านได้
                     if page_num == 0:
                         print(f"📄 ตัวอย่างข้อความหน้า 1: {page_text[:200]}")
             
-            return text
+            return "".join(f"{page_text}\n" for page_text in pages)
         except Exception as e:
             raise ValueError(f"ไม่สามารถอ่านไฟล์ PDF {file_path}: {str(e)}")
     
-    def read_docx_file(self, file_path: str) -> str:
-        """อ่านไฟล์ Word (.docx)"""
+    @staticmethod
+    def _iter_pdf_page_texts(file: BinaryIO) -> Iterator[str]:
+        """ดึงข้อความดิบทีละหน้า - ใช้ PDFium ถ้าติดตั้งไว้ ไม่งั้นใช้ PyPDF2"""
+        if not _HAS_PDFIUM:
+            import PyPDF2
+            for page in PyPDF2.PdfReader(file).pages:
+                yield page.extract_text()
+            return
+        
+        import pypdfium2 as pdfium
+        
+        # ดึงข้อความทุกหน้าภายใต้ lock (ไม่ yield ระหว่างถือ lock - ผู้เรียกทำความสะอาดข้อความ
+        # ของแต่ละหน้าได้โดยไม่ขวาง thread อื่นที่รออ่าน PDF)
+        page_texts = []
+        with _PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(file)
+            try:
+                for page_index in range(len(pdf)):
+                    page = pdf[page_index]
+                    textpage = page.get_textpage()
+                    # PDFium ขึ้นบรรทัดใหม่ด้วย \r\n - แปลงให้เหมือน PyPDF2 ก่อนทำความสะอาด
+                    page_texts.append(textpage.get_text_range().replace('\r\n', '\n'))
+                    textpage.close()
+                    page.close()
+            finally:
+                pdf.close()
+        
+        yield from page_texts
+    
+    def read_docx_file(self, file_path: Union[str, BinaryIO]) -> str:
+        """อ่านไฟล์ Word (.docx) จาก path หรือ stream"""
         try:
+            from docx import Document
             doc = Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
+            return "".join(f"{paragraph.text}\n" for paragraph in doc.paragraphs)
         except Exception as e:
             raise ValueError(f"ไม่สามารถอ่านไฟล์ Word {file_path}: {str(e)}")
     
-    def read_pptx_file(self, file_path: str) -> str:
-        """อ่านไฟล์ PowerPoint (.pptx)"""
+    def read_pptx_file(self, file_path: Union[str, BinaryIO]) -> str:
+        """อ่านไฟล์ PowerPoint (.pptx) จาก path หรือ stream"""
         try:
+            from pptx import Presentation
             prs = Presentation(file_path)
-            text = ""
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text += shape.text + "\n"
-            return text
+            return "".join(
+                f"{shape.text}\n"
+                for slide in prs.slides
+                for shape in slide.shapes
+                if hasattr(shape, "text")
+            )
         except Exception as e:
             raise ValueError(f"ไม่สามารถอ่านไฟล์ PowerPoint {file_path}: {str(e)}")
     
     def clean_thai_text(self, text: str) -> str:
         """ทำความสะอาดข้อความภาษาไทย (ปรับปรุงสำหรับ PDF ที่มีปัญหา)"""
-        # ขั้นตอนที่ 1: ลบช่องว่างพิเศษระหว่างตัวอักษรไทย
-        # "ก ว า ย" → "กวาย"
-        text = re.sub(r'([\u0E00-\u0E7F])\s+([\u0E00-\u0E7F])', r'\1\2', text)
-        
-        # ขั้นตอนที่ 2: ลบช่องว่างระหว่างตัวอักษรกับสระ/วรรณยุกต์
-        # "น ้ อ ย" → "น้อย", "ร ั บ" → "รับ"
-        text = re.sub(r'([\u0E00-\u0E7F])\s+([\u0E31-\u0E3A\u0E47-\u0E4E])', r'\1\2', text)
-        text = re.sub(r'\s+([\u0E31-\u0E3A\u0E47-\u0E4E])\s+', r'\1', text)
-        
-        # ขั้นตอนที่ 3: 🔥 แก้ช่องว่างในรหัสวิชา ก่อนแก้อย่างอื่น
-        # "0550 6231" → "05506231", "0550  6231" → "05506231"
-        text = re.sub(r'\b(\d{4})\s+(\d{4})\b', r'\1\2', text)
-        text = re.sub(r'\b(\d{2})\s+(\d{2})\s+(\d{4})\b', r'\1\2\3', text)
-        
-        # ขั้นตอนที่ 4: แก้ตัวเลข/อักขระพิเศษที่ติดคำไทย
-        text = re.sub(r'คอมพิวเตอร4', 'คอมพิวเตอร์', text)
-        text = re.sub(r'([\u0E00-\u0E7F]+)4', r'\1์', text)  # แปลง "คำ4" → "คำ์"
-        text = re.sub(r'([\u0E00-\u0E7F]+)e', r'\1ี', text)  # แปลง "ปe" → "ปี"
-        text = re.sub(r'([\u0E00-\u0E7F]+)F', r'\1้', text)  # แปลง "หนF" → "หน้"
-        text = re.sub(r'([\u0E00-\u0E7F]+)Q', r'\1้', text)  # แปลง "กQ" → "ก้"
-        
-        # เพิ่มตัวอักษรพิเศษอื่นๆ ที่พบในเอกสาร
-        text = re.sub(r'เปbด', 'เปิด', text)
-        text = re.sub(r'ไม้น้อยกว้า', 'ไม่น้อยกว่า', text)
-        text = re.sub(r'ได้แก้', 'ได้แก่', text)
-        text = re.sub(r'ฝå', 'ฝึ', text)
-        text = re.sub(r'พระจอมเกล<าเจ<า', 'พระจอมเกล้าเจ้า', text)
+        # ขั้นตอนที่ 0: ลบอักขระความกว้างศูนย์ก่อน ไม่ให้ขวางการรวมช่องว่างด้านล่าง
+        text = text.translate(_ZERO_WIDTH_TABLE)
         
-        # ขั้นตอนที่ 5: แก้คำที่พบบ่อยซึ่งมักมีปัญหาใน PDF
-        common_fixes = {
-            r'ห น ่ ว ย': 'หน่วย',
-            r'ห น ่ วย': 'หน่วย',
-            r'หนวยกิต': 'หน่วยกิต',
-            r'ก ิ ต': 'กิต',
-            r'ก ิต': 'กิต',
-            r'ห ล ั ก ส ู ต ร': 'หลักสูตร',
-            r'ห ล ั กส ู ตร': 'หลักสูตร',
-            r'ว ิ ท ย า': 'วิทยา',
-            r'ว ิทย า': 'วิทยา',
-            r'ศ ึ ก ษ า': 'ศึกษา',
-            r'ศ ึกษ า': 'ศึกษา',
-            r'ภ า ค': 'ภาค',
-            r'เท อ ม': 'เทอม',
-            r'ป ร ะ จ ำ': 'ประจำ',
-            r'เกลQาเจQา': 'เกล้าเจ้า',
-            r'วFา': 'ว่า',
-            r'ดQวย': 'ด้วย',
-            # 🔥 เพิ่มคำที่พบจากการทดสอบ
-            r'คดีศาสตร์ดิลิลธิล': 'คณิตศาสตร์ดิสครีต',
-            r'คดีศาสตร์': 'คณิตศาสตร์',
-            r'ดิลิลธิล': 'ดิสครีต',
-            r'ปฏิสัมพันระ': 'ปฏิสัมพันธ์',
-            r'สวัดกรรม': 'วิศวกรรม',
-            r'สวัด': 'วิศว',
-        }
+        # ขั้นตอนที่ 1-4: รวมช่องว่างไทย, แก้รหัสวิชา, แก้อักขระเพี้ยนที่ติดคำไทย
+        for pattern, replacement in _THAI_CLEAN_RULES:
+            text = pattern.sub(replacement, text)
         
-        for pattern, replacement in common_fixes.items():
-            text = re.sub(pattern, replacement, text)
+        # ขั้นตอนที่ 5: แก้คำที่พบบ่อยซึ่งมักมีปัญหาใน PDF
+        text = _RE_COMMON_FIXES.sub(lambda m: _COMMON_FIXES[m.group()], text)
         
         # ขั้นตอนที่ 6: ลบ whitespace ที่ไม่จำเป็น (มากกว่า 1 ช่องว่าง)
-        text = re.sub(r' {2,}', ' ', text)
+        text = _RE_MULTI_SPACE.sub(' ', text)
         
         # ขั้นตอนที่ 7: ลบอักขระพิเศษที่ไม่ต้องการ (แต่เก็บอักขระไทยและตัวเลข)
-        text = re.sub(r'[^\u0E00-\u0E7F\w\s\.\,\!\?\;\:\-\(\)\"\'\/\n]', '', text)
+        text = _RE_DISALLOWED_CHARS.sub('', text)
         
         # ขั้นตอนที่ 8: ลบบรรทัดว่างซ้ำ (มากกว่า 2 บรรทัด)
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        text = _RE_MULTI_NEWLINE.sub('\n\n', text)
         
         # ขั้นตอนที่ 9: ลบช่องว่างต้นและท้ายบรรทัด
         text = '\n'.join(line.strip() for line in text.split('\n'))
@@ -260,6 +394,24 @@ class ThaiDocumentProcessor:
             except:
                 raise ValueError(f"ไม่รองรับไฟล์ประเภท {file_extension}")
     
+    def read_document_stream(self, stream: BinaryIO, filename: str) -> str:
+        """อ่านเอกสารจาก stream ในหน่วยความจำ (เช่น ไฟล์ที่อัพโหลด) โดยไม่ต้องเขียนลงดิสก์"""
+        file_extension = Path(filename).suffix.lower()
+        stream.seek(0)
+        
+        if file_extension == '.pdf':
+            return self.read_pdf_file(stream)
+        elif file_extension in ['.docx', '.doc']:
+            return self.read_docx_file(stream)
+        elif file_extension in ['.pptx', '.ppt']:
+            return self.read_pptx_file(stream)
+        else:
+            # .txt และไฟล์ประเภทอื่น ลองอ่านเป็น text
+            try:
+                return self.decode_text(stream.read(), filename)
+            except:
+                raise ValueError(f"ไม่รองรับไฟล์ประเภท {file_extension}")
+    
     def process_document(self, file_path: str, metadata: Dict[str, Any] = None) -> List[LangChainDocument]:
         """
         ประมวลผลเอกสารและแบ่งเป็น chunks (รองรับ Dynamic Chunking)
@@ -271,15 +423,49 @@ class ThaiDocumentProcessor:
         Returns:
             List[LangChainDocument]: รายการ chunks พร้อม metadata
         """
-        # อ่านเอกสาร
-        text = self.read_document(file_path)
+        return list(self.process_document_iter(file_path, metadata))
+    
+    def process_document_iter(self, file_path: str, metadata: Dict[str, Any] = None) -> Iterator[LangChainDocument]:
+        """
+        เหมือน process_document แต่คืน chunks ทีละตัว (สร้าง LangChainDocument เมื่อผู้เรียกดึงไปใช้)
+        
+        Args:
+            file_path: เส้นทางไฟล์
+            metadata: ข้อมูลเพิ่มเติมของเอกสาร
+            
+        Yields:
+            LangChainDocument: chunk พร้อม metadata
+        """
+        # อ่านเอกสาร (ส่งต่อโดยไม่ถือ reference ไว้ ข้อความดิบจะถูกปล่อยทันทีหลังทำความสะอาด)
+        yield from self._iter_split_document(self.read_document(file_path), file_path, metadata)
+    
+    def process_bytes(self, data: Union[bytes, BinaryIO], filename: str,
+                      metadata: Dict[str, Any] = None) -> List[LangChainDocument]:
+        """
+        ประมวลผลเอกสารจากเนื้อหาในหน่วยความจำ (ไม่ต้องเขียนไฟล์ชั่วคราว)
+        
+        Args:
+            data: เนื้อหาไฟล์ (bytes หรือ binary stream เช่น UploadedFile ของ Streamlit)
+            filename: ชื่อไฟล์ (ใช้ดูประเภทไฟล์จากนามสกุล)
+            metadata: ข้อมูลเพิ่มเติมของเอกสาร
+            
+        Returns:
+            List[LangChainDocument]: รายการ chunks พร้อม metadata
+        """
+        stream = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
         
-        # ประมวลผลข้อความ
+        return list(self._iter_split_document(self.read_document_stream(stream, filename), filename, metadata))
+    
+    def _iter_split_document(self, text: str, file_path: str,
+                             metadata: Dict[str, Any] = None) -> Iterator[LangChainDocument]:
+        """ทำความสะอาดข้อความ แบ่ง chunks และเติม metadata สำหรับการค้นหา"""
+        # ประมวลผลข้อความ แล้วปล่อยข้อความดิบ - ไม่ต้องถือทั้งสองชุดไว้ระหว่างแบ่ง chunks
         processed_text = self.preprocess_text(text)
+        del text
         
         if not processed_text.strip():
             print("⚠️ ไม่พบข้อความในเอกสาร")
-            return []
+            return
         
         # แบ่ง chunks ตาม strategy
         if self.use_dynamic_chunking:
@@ -292,8 +478,7 @@ class ThaiDocumentProcessor:
             chunks = self.text_splitter.split_text(processed_text)
             content_type = "general"  # Default
         
-        # สร้าง LangChain Documents พร้อม metadata ที่ช่วยในการค้นหา
-        documents = []
+        # สร้าง LangChain Documents พร้อม metadata ที่ช่วยในการค้นหา (ทีละ chunk)
         file_name = Path(file_path).name
         
         base_metadata = {
@@ -310,44 +495,20 @@ class ThaiDocumentProcessor:
             base_metadata["content_type"] = content_type
         
         for i, chunk in enumerate(chunks):
-            chunk_metadata = base_metadata.copy()
-            chunk_metadata.update({
-                "chunk_index": i,
-                "chunk_size": len(chunk)
-            })
+            # สร้าง dict ของ chunk ในคำสั่งเดียว (แทน copy() + update())
+            chunk_metadata = {**base_metadata, "chunk_index": i, "chunk_size": len(chunk)}
             
             # 🔍 เพิ่ม metadata เฉพาะสำหรับการค้นหาที่แม่นยำขึ้น
-            # ตรวจจับรหัสวิชา (8 หลัก เช่น 05506232, 90641001)
-            course_codes = re.findall(r'\b\d{8}\b', chunk)
+            # ตรวจจับรหัสวิชา (8 หลัก เช่น 05506232, 90641001) เก็บเป็นรูปแบบ 8 หลักติดกันเสมอ
+            # ตอนถามรหัสวิชาจึงเช็คจาก metadata ได้เลยโดยไม่ต้องค้น content ด้วย regex
+            course_codes = [head + tail for head, tail in _RE_CHUNK_COURSE_CODE.findall(chunk)]
             if course_codes:
-                chunk_metadata["course_codes"] = ",".join(list(set(course_codes)))
+                chunk_metadata["course_codes"] = ",".join(sorted(set(course_codes)))
             
             # 🔥 ตรวจจับชั้นปีและภาคการศึกษา (ปรับ regex ให้จับได้หลายรูปแบบ)
-            # รูปแบบ 1: "ปีที่ 1" หรือ "ปีที่1"
-            year_patterns = [
-                r'ปีที่\s*(\d+)',
-                r'ชั้นปี\s*(\d+)',
-                r'แผนการศึกษา\s*ปีที่\s*(\d+)',
-            ]
-            year_found = None
-            for pattern in year_patterns:
-                match = re.search(pattern, chunk)
-                if match:
-                    year_found = match.group(1)
-                    break
-            
-            # รูปแบบ 2: "ภาคการศึกษาที่ 1" หรือ "ภาค 1"
-            semester_patterns = [
-                r'ภาคการศึกษาที่\s*(\d+)',
-                r'ภาค\s*(\d+)',
-                r'เทอม\s*(\d+)',
-            ]
-            semester_found = None
-            for pattern in semester_patterns:
-                match = re.search(pattern, chunk)
-                if match:
-                    semester_found = match.group(1)
-                    break
+            # รูปแบบ 1: "ปีที่ 1" หรือ "ปีที่1", รูปแบบ 2: "ภาคการศึกษาที่ 1" หรือ "ภาค 1"
+            year_found = _first_group(_RE_CHUNK_YEARS, chunk)
+            semester_found = _first_group(_RE_CHUNK_SEMESTERS, chunk)
             
             if year_found:
                 chunk_metadata["year"] = year_found
@@ -361,7 +522,7 @@ class ThaiDocumentProcessor:
                         chunk_metadata["course_count"] = len(course_codes)
                     
                     # ดึงจำนวนหน่วยกิตรวม
-                    total_match = re.search(r'รวม\s+(\d+)\s+หน่วยกิต', chunk)
+                    total_match = _RE_CHUNK_TOTAL_CREDITS.search(chunk)
                     if total_match:
                         chunk_metadata["total_credits"] = total_match.group(1)
                     
@@ -371,40 +532,77 @@ class ThaiDocumentProcessor:
                 chunk_metadata["semester"] = semester_found
             
             # ตรวจจับหน่วยกิต
-            credit_matches = re.findall(r'(\d+)\s*หน่วยกิต', chunk)
-            if credit_matches:
+            if _RE_CHUNK_CREDITS.search(chunk):
                 chunk_metadata["has_credits"] = "yes"
             
             # เพิ่มคำสำคัญจาก chunk เป็น preview
             chunk_metadata["preview"] = chunk[:150].strip().replace('\n', ' ')
             
-            documents.append(LangChainDocument(
+            yield LangChainDocument(
                 page_content=chunk,
                 metadata=chunk_metadata
-            ))
-        
-        print(f"✅ แบ่ง chunks เสร็จสิ้น: {len(documents)} chunks")
+            )
         
-        return documents
+        print(f"✅ แบ่ง chunks เสร็จสิ้น: {len(chunks)} chunks")
     
     def process_multiple_documents(self, file_paths: List[str]) -> List[LangChainDocument]:
-        """ประมวลผลหลายเอกสารพร้อมกัน"""
+        """ประมวลผลหลายเอกสารพร้อมกัน (แต่ละไฟล์แยก process - อ่าน PDF, regex, ตัดคำ ใช้ CPU และติด GIL)"""
         all_documents = []
+        file_paths = self._dedupe_file_paths(file_paths)
+        
+        if len(file_paths) > 1:
+            settings = (self.chunk_size, self.chunk_overlap, self.use_dynamic_chunking)
+            with ProcessPoolExecutor(
+                max_workers=min(len(file_paths), os.cpu_count() or 1),
+                initializer=_init_worker_processor,
+                initargs=settings
+            ) as executor:
+                # map คืนผลตามลำดับไฟล์เดิม ลำดับ chunks จึงเหมือนประมวลผลทีละไฟล์
+                results = executor.map(_process_document_in_worker, file_paths)
+                outcomes = list(zip(file_paths, results))
+        else:
+            outcomes = [(file_path, self._try_process_document(file_path)) for file_path in file_paths]
         
-        for file_path in file_paths:
-            try:
-                documents = self.process_document(file_path)
+        for file_path, (documents, error) in outcomes:
+            if error is None:
                 all_documents.extend(documents)
                 print(f"✅ ประมวลผลไฟล์ {Path(file_path).name} เสร็จสิ้น - {len(documents)} chunks")
-            except Exception as e:
-                print(f"❌ ไม่สามารถประมวลผลไฟล์ {Path(file_path).name}: {str(e)}")
+            else:
+                print(f"❌ ไม่สามารถประมวลผลไฟล์ {Path(file_path).name}: {error}")
         
         return all_documents
     
+    @staticmethod
+    def _dedupe_file_paths(file_paths: List[str]) -> List[str]:
+        """ตัดไฟล์ที่เนื้อหาซ้ำกัน (เทียบ sha256 เหมือนที่ app ใช้ตรวจไฟล์อัพโหลดซ้ำ) เหลือไฟล์แรก"""
+        seen = set()
+        unique_paths = []
+        for file_path in file_paths:
+            try:
+                digest = _file_digest(file_path)
+            except OSError:
+                unique_paths.append(file_path)  # ให้ process_document รายงาน error ตามปกติ
+                continue
+            if digest in seen:
+                print(f"⏭️ ข้ามไฟล์ {Path(file_path).name} - เนื้อหาซ้ำกับไฟล์ก่อนหน้า")
+                continue
+            seen.add(digest)
+            unique_paths.append(file_path)
+        return unique_paths
+    
+    def _try_process_document(self, file_path: str) -> Tuple[List[LangChainDocument], Optional[str]]:
+        """ประมวลผลไฟล์เดียว คืน (documents, ข้อความ error) แทนการ raise"""
+        try:
+            return self.process_document(file_path), None
+        except Exception as e:
+            return [], str(e)
+    
     def get_text_stats(self, text: str) -> Dict[str, Any]:
         """สถิติของข้อความ"""
-        words = word_tokenize(text, engine='newmm')
-        thai_words_count = len([w for w in words if re.match(r'[\u0E00-\u0E7F]+', w)])
+        from pythainlp.tokenize import word_tokenize
+        words = word_tokenize(text, engine=_STATS_TOKENIZER_ENGINE)
+        # นับคำที่ขึ้นต้นด้วยอักษรไทย (เทียบ code point ตัวแรกตรงๆ แทน re.match ทีละคำ)
+        thai_words_count = sum(1 for w in words if w and 0x0E00 <= ord(w[0]) <= 0x0E7F)
         
         return {
             "total_characters": len(text),
@@ -415,6 +613,21 @@ class ThaiDocumentProcessor:
         }
 
 
+# processor ประจำ worker process ของ process_multiple_documents (สร้างครั้งเดียวต่อ process)
+_worker_processor: Optional[ThaiDocumentProcessor] = None
+
+
+def _init_worker_processor(chunk_size: int, chunk_overlap: int, use_dynamic_chunking: bool):
+    """initializer ของ ProcessPoolExecutor: สร้าง processor ด้วยค่าตั้งเดียวกับ processor หลัก"""
+    global _worker_processor
+    _worker_processor = ThaiDocumentProcessor(chunk_size, chunk_overlap, use_dynamic_chunking)
+
+
+def _process_document_in_worker(file_path: str) -> Tuple[List[LangChainDocument], Optional[str]]:
+    """งานของ worker process: ประมวลผลไฟล์เดียว"""
+    return _worker_processor._try_process_document(file_path)
+
+
 # ตัวอย่างการใช้งาน
 if __name__ == "__main__":
     processor = ThaiDocumentProcessor(chunk_size=1000, chunk_overlap=200)
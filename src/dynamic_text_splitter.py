@@ -3,10 +3,35 @@ Dynamic Text Splitter for Thai RAG Chatbot
 แบ่ง chunks โดยปรับ strategy ตามประเภทเนื้อหา
 """
 
+import logging
+import re
+from functools import lru_cache
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from typing import List, Tuple
 from content_classifier import ContentClassifier, ContentType
 
+# log การเลือก strategy ต่อ chunk (ระดับ DEBUG - ปิดอยู่ตามปกติ)
+logger = logging.getLogger(__name__)
+
+
+class ThaiRecursiveCharacterTextSplitter(RecursiveCharacterTextSplitter):
+    """
+    RecursiveCharacterTextSplitter ที่ไม่ตัดกลางกลุ่มอักษรไทย
+    
+    ภาษาไทยมักไม่มีช่องว่าง/จุดให้แบ่ง splitter เดิมจึงตกไปใช้ separator "" (ตัดทีละตัวอักษร)
+    ซึ่งตัดสระ/วรรณยุกต์ออกจากพยัญชนะได้ - กรณีนั้นจะแบ่งตามขอบ TCC (Thai Character Cluster) แทน
+    """
+    
+    def _split_text(self, text: str, separators: List[str]) -> List[str]:
+        # หา separator ที่ splitter เดิมจะเลือก (ตัวแรกที่พบในข้อความ หรือ "")
+        for separator in separators:
+            if separator == "":
+                from pythainlp.tokenize import subword_tokenize
+                return self._merge_splits(subword_tokenize(text, engine="tcc"), "")
+            if re.search(separator if self._is_separator_regex else re.escape(separator), text):
+                break
+        return super()._split_text(text, separators)
+
 
 class DynamicTextSplitter:
     """Text Splitter ที่ปรับ strategy ตามประเภทเนื้อหา"""
@@ -15,7 +40,7 @@ class DynamicTextSplitter:
         """สร้าง splitters สำหรับแต่ละประเภทเนื้อหา"""
         
         # Strategy 1: General Content (เนื้อหาทั่วไป)
-        self.general_splitter = RecursiveCharacterTextSplitter(
+        self.general_splitter = ThaiRecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
             length_function=len,
@@ -30,7 +55,7 @@ class DynamicTextSplitter:
         )
         
         # Strategy 2: Curriculum Table (ตารางรายวิชา) - สำคัญที่สุด!
-        self.table_splitter = RecursiveCharacterTextSplitter(
+        self.table_splitter = ThaiRecursiveCharacterTextSplitter(
             chunk_size=3000,    # ใหญ่มาก! รองรับตารางทั้งภาค
             chunk_overlap=500,  # Overlap สูง 16%
             length_function=len,
@@ -46,7 +71,7 @@ class DynamicTextSplitter:
         )
         
         # Strategy 3: Course Description (คำอธิบายรายวิชา)
-        self.course_splitter = RecursiveCharacterTextSplitter(
+        self.course_splitter = ThaiRecursiveCharacterTextSplitter(
             chunk_size=1500,
             chunk_overlap=300,
             length_function=len,
@@ -60,7 +85,7 @@ class DynamicTextSplitter:
         )
         
         # Strategy 4: Appendix (ภาคผนวก)
-        self.appendix_splitter = RecursiveCharacterTextSplitter(
+        self.appendix_splitter = ThaiRecursiveCharacterTextSplitter(
             chunk_size=800,
             chunk_overlap=150,
             length_function=len,
@@ -87,15 +112,16 @@ class DynamicTextSplitter:
         Returns:
             Tuple of (chunks, content_type)
         """
-        # 🔍 Debug: แสดงตัวอย่างข้อความ
-        preview = text[:200].replace('\n', ' ')
-        print(f"\n🔍 กำลังจำแนกเนื้อหา...")
-        print(f"   Preview: {preview}...")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        
+        # 🔍 Debug: แสดงตัวอย่างข้อความ (สร้าง preview เฉพาะเมื่อเปิด DEBUG)
+        if debug:
+            logger.debug("🔍 กำลังจำแนกเนื้อหา... Preview: %s...", text[:200].replace('\n', ' '))
         
         # จำแนกประเภทเนื้อหา
         content_type = ContentClassifier.classify(text, page_num)
         
-        print(f"   ผลลัพธ์: {content_type}")
+        logger.debug("   ผลลัพธ์: %s", content_type)
         
         # เลือก splitter ตามประเภท
         if content_type == "curriculum_table":
@@ -119,17 +145,18 @@ class DynamicTextSplitter:
             strategy_name = "General Strategy"
             params = "(1000/200)"
         
-        print(f"{strategy_emoji} ใช้ {strategy_name} {params}")
+        logger.debug("%s ใช้ %s %s", strategy_emoji, strategy_name, params)
         
         # แบ่ง chunks
         chunks = splitter.split_text(text)
         
         # แสดงสถิติ
-        total_chars = sum(len(chunk) for chunk in chunks)
-        avg_chunk_size = total_chars // len(chunks) if chunks else 0
-        
-        print(f"   → ได้ {len(chunks)} chunks จาก '{content_type}' "
-              f"(เฉลี่ย {avg_chunk_size} chars/chunk)")
+        if debug:
+            total_chars = sum(map(len, chunks))
+            avg_chunk_size = total_chars // len(chunks) if chunks else 0
+            
+            logger.debug("   → ได้ %d chunks จาก '%s' (เฉลี่ย %d chars/chunk)",
+                         len(chunks), content_type, avg_chunk_size)
         
         return chunks, content_type
     
@@ -151,3 +178,13 @@ class DynamicTextSplitter:
             return self.appendix_splitter
         else:
             return self.general_splitter
+
+
+@lru_cache(maxsize=1)
+def get_dynamic_splitter() -> DynamicTextSplitter:
+    """
+    DynamicTextSplitter ตัวเดียวที่ใช้ร่วมกันทั้ง process
+    
+    splitters ไม่มี state ที่เปลี่ยนหลังสร้าง จึงใช้พร้อมกันจากหลาย thread ได้โดยไม่ต้อง lock
+    """
+    return DynamicTextSplitter()
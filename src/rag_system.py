@@ -3,20 +3,349 @@ RAG System for Thai Chatbot with Chat History Support
 ระบบ RAG ที่รองรับการสนทนาแบบต่อเนื่องและใช้ Local LLM
 """
 
+import asyncio
+import hashlib
+import logging
 import os
-from typing import List, Dict, Any, Optional, Tuple
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Union
 from datetime import datetime
 
 from langchain.schema import Document, BaseMessage, HumanMessage, AIMessage
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
+from langchain.memory import ConversationBufferWindowMemory
+from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
 from langchain.llms.base import LLM
-from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain.schema.output import GenerationChunk
 
+import numpy as np
 import ollama
 import requests
 
+# โมเดล LLM ที่แนะนำสำหรับภาษาไทย
+from recommended_models import RECOMMENDED_THAI_LLM_MODELS
+
+# log ระหว่างค้นหา/ตอบคำถาม (ระดับ DEBUG - ปิดอยู่ตามปกติ จึงไม่เสียเวลาจัดรูปแบบข้อความ)
+logger = logging.getLogger(__name__)
+
+# HTTP session เดียวสำหรับเรียก API ของ Ollama โดยตรง (ใช้ connection เดิมซ้ำ)
+_OLLAMA_HTTP = requests.Session()
+
+# ollama.AsyncClient หนึ่งตัวต่อ event loop (connection pool ของ httpx ผูกกับ loop ที่สร้าง จึงใช้ข้าม loop ไม่ได้)
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ollama.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def _ollama_async_client() -> "ollama.AsyncClient":
+    """AsyncClient ของ event loop ปัจจุบัน (สร้างครั้งแรกแล้วใช้ connection เดิมซ้ำ)"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = ollama.AsyncClient()
+    return client
+
+# ผลตรวจสอบการเชื่อมต่อที่สำเร็จล่าสุด: ชื่อโมเดลที่ขอ → (เวลาที่ตรวจ, ชื่อโมเดลที่ใช้จริง)
+_CONNECTION_CHECK_TTL = 60  # วินาที
+_connection_checks: Dict[str, Tuple[float, str]] = {}
+
+# Regex สำหรับดึงเงื่อนไขจากคำถาม (compile ครั้งเดียวตอนโหลดโมดูล)
+_RE_QUESTION_COURSE_CODE = re.compile(r'\b(\d{4})\s*(\d{4})\b|\b(\d{8})\b')  # 05506231 หรือ 0550 6231
+_RE_QUESTION_YEAR = re.compile(r'ปีที่\s*(\d+)')
+_RE_QUESTION_SEMESTER = re.compile(r'ภาคการศึกษาที่\s*(\d+)')
+
+
+@lru_cache(maxsize=256)
+def _course_code_pattern(code: str) -> "re.Pattern[str]":
+    """รหัสวิชาทุกรูปแบบในครั้งเดียว: "05506231", "0550 6231", "0550-6231" (cache ตามรหัส - มักถามรหัสเดิมซ้ำ)"""
+    return re.compile(code[:4] + r'\s*(?:-\s*)?' + code[4:])
+
+
+@lru_cache(maxsize=64)
+def _year_pattern(year: str) -> "re.Pattern[str]":
+    """pattern ค้นหา "ปีที่ X" ใน content"""
+    return re.compile(rf'ปีที่\s*{year}')
+
+
+@lru_cache(maxsize=64)
+def _semester_pattern(semester: str) -> "re.Pattern[str]":
+    """pattern ค้นหา "ภาคการศึกษาที่ X" ใน content"""
+    return re.compile(rf'ภาคการศึกษาที่\s*{semester}')
+
+# ส่วนต่างๆ ของ prompt - prompt เต็มมีกฎทุกแบบ ส่วนคำถามแต่ละประเภทใช้เฉพาะกฎที่เกี่ยวข้อง
+# (prompt สั้นลง → LLM ประมวลผล prompt เสร็จเร็วขึ้น ได้ token แรกเร็วขึ้น)
+_PROMPT_HEADER = """คุณเป็นผู้ช่วยปัญญาประดิษฐ์ที่เชี่ยวชาญในการตอบคำถามจากหลักสูตรการศึกษาภาษาไทย
+
+ข้อมูลที่เกี่ยวข้องจากเอกสาร:
+{context}
+
+ประวัติการสนทนา:
+{chat_history}
+
+คำถาม: {question}
+
+กฎการตอบ (ปฏิบัติอย่างเคร่งครัด):
+
+"""
+
+_PROMPT_RULES_COURSE_CODE = """**สำหรับคำถามเกี่ยวกับรหัสวิชา (เช่น "05506012 คือวิชาอะไร"):**
+- ✅ ค้นหารหัสวิชาในข้อมูลที่ให้มา
+- ✅ ตอบด้วย: "รหัสวิชา [รหัส] คือ [ชื่อวิชาภาษาไทย] ([ชื่อภาษาอังกฤษถ้ามี]) จำนวน [หน่วยกิต] หน่วยกิต"
+- ❌ ห้ามตอบด้วยเลขอะไรก็ตามที่ไม่ใช่ชื่อวิชา"""
+
+_PROMPT_RULES_LISTING = """**สำหรับคำถามเกี่ยวกับรายวิชาในภาค/ปี (เช่น "ปีที่ 1 ภาคการศึกษาที่ 1 มีอะไรบ้าง"):**
+- ✅ **คำสั่งสำคัญ: ต้องแสดงรายการวิชาครบทั้งหมด 100%**
+- ✅ ตอบเป็นรายการ bullet point ทุกวิชา:
+  • รหัสวิชา ชื่อวิชา (หน่วยกิต)
+  • รหัสวิชา ชื่อวิชา (หน่วยกิต)
+  • (แสดงต่อไปจนครบทุกวิชา)
+- ✅ บอกจำนวนรวมหน่วยกิตท้ายสุด
+- ❌ **ห้ามตอบแค่บางวิชา** - ต้องระบุให้ครบทุกวิชาที่มีในข้อมูล
+- ❌ **ห้ามใช้ "..." หรือ "และอื่นๆ"** - ต้องเขียนครบ
+
+**ตัวอย่างคำตอบที่ถูกต้อง:**
+"ในปีที่ 1 ภาคการศึกษาที่ 2 มีรายวิชาดังนี้:
+
+• 05506233 แคลคูลัสสำหรับวิทยาการคอมพิวเตอร์ (3 หน่วยกิต)
+• 05506001 คณิตศาสตร์ดิสครีต (3 หน่วยกิต)
+• 05506004 การเขียนโปรแกรมเชิงออบเจกต์ (3 หน่วยกิต)
+• 05506008 โครงสร้างและสถาปัตยกรรมคอมพิวเตอร์ (3 หน่วยกิต)
+• 05506011 ปฏิสัมพันธ์ระหว่างมนุษย์และคอมพิวเตอร์ (3 หน่วยกิต)
+• 90644008 ภาษาอังกฤษพื้นฐาน 2 (3 หน่วยกิต)
+• 90xxxxxx วิชาเลือกหมวดวิชาศึกษาทั่วไป (3 หน่วยกิต)
+
+รวม 21 หน่วยกิต\""""
+
+_PROMPT_RULES_GENERAL = """**สำหรับคำถามทั่วไป:**
+- ✅ ใช้เฉพาะข้อมูลจากเอกสาร
+- ✅ ตอบสั้น กระชับ 3-5 ประโยค
+- ❌ ห้ามแต่งข้อมูล ห้ามซ้ำคำ
+- ❌ ถ้าไม่พบข้อมูล → ตอบว่า "ไม่พบข้อมูลในเอกสาร\""""
+
+_PROMPT_FOOTER = """
+
+คำตอบ (ตอบเป็นภาษาไทยเท่านั้น):"""
+
+# ประเภทคำถาม → กฎที่ใส่ใน prompt (กฎทั่วไปใส่ทุกแบบ)
+_PROMPT_RULES = {
+    "full": (_PROMPT_RULES_COURSE_CODE, _PROMPT_RULES_LISTING, _PROMPT_RULES_GENERAL),
+    "course_code": (_PROMPT_RULES_COURSE_CODE, _PROMPT_RULES_GENERAL),
+    "listing": (_PROMPT_RULES_LISTING, _PROMPT_RULES_GENERAL),
+    "general": (_PROMPT_RULES_GENERAL,),
+}
+
+
+def _prompt_text(question_type: str) -> str:
+    """ข้อความ prompt template ของประเภทคำถาม (full = กฎทุกแบบ)"""
+    return _PROMPT_HEADER + "\n\n".join(_PROMPT_RULES[question_type]) + _PROMPT_FOOTER
+
+
+def _question_type(question: str) -> str:
+    """ประเภทคำถามสำหรับเลือก prompt: listing (รายวิชาในปี/ภาค), course_code หรือ general"""
+    if (_RE_QUESTION_YEAR.search(question) or _RE_QUESTION_SEMESTER.search(question)
+            or "อะไรบ้าง" in question or "ทั้งหมด" in question):
+        return "listing"
+    if _RE_QUESTION_COURSE_CODE.search(question):
+        return "course_code"
+    return "general"
+
+
+# อายุของผลค้นหา/คำตอบใน cache (วินาที)
+_CACHE_TTL_SECONDS = 600
+
+
+class _TTLCache:
+    """LRU cache ขนาดจำกัดที่ค่าหมดอายุตาม TTL (ใช้ภายใน ThaiRAGSystem ซึ่งมีหนึ่งตัวต่อ session)"""
+    
+    def __init__(self, maxsize: int, ttl: float = _CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key) -> Any:
+        """คืนค่าที่ยังไม่หมดอายุ หรือ None"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def __contains__(self, key) -> bool:
+        """มีค่าที่ยังไม่หมดอายุหรือไม่ (ไม่นับเป็น hit/miss และไม่เปลี่ยนลำดับ LRU)"""
+        entry = self._data.get(key)
+        return entry is not None and time.monotonic() - entry[0] <= self.ttl
+    
+    def put(self, key, value):
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def clear(self):
+        self._data.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        """จำนวนรายการ และจำนวนครั้งที่พบ/ไม่พบใน cache"""
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+# คำถามที่มีตัวเลข (รหัสวิชา ปี ภาค) ไม่ใช้ semantic cache - embedding แยกตัวเลขที่ต่างกันได้ไม่ดี
+_RE_ANY_DIGIT = re.compile(r'\d')
+
+
+class _SemanticCache:
+    """
+    cache ตามความหมายของคำถาม: คำถามที่ embedding ใกล้กันมาก (cosine ≥ threshold) ใช้ค่าเดิม
+    
+    เก็บ embeddings (normalize แล้ว) เป็น matrix float32 ขนาด (maxsize, dim) ค้นทุก entry
+    ด้วย matrix-vector product ครั้งเดียว เมื่อเต็มจะเขียนทับ entry ที่เก่าที่สุด
+    """
+    
+    def __init__(self, maxsize: int = 256, threshold: float = 0.95):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._vectors: Optional[np.ndarray] = None
+        self._values: List[Any] = []
+        self._next = 0
+    
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def get(self, embedding) -> Any:
+        """ค่าของคำถามที่ใกล้ที่สุด ถ้าความคล้ายถึง threshold หรือ None"""
+        if not self._values:
+            return None
+        similarities = self._vectors[:len(self._values)] @ self._normalize(embedding)
+        best = int(np.argmax(similarities))
+        return self._values[best] if similarities[best] >= self.threshold else None
+    
+    def put(self, embedding, value):
+        vector = self._normalize(embedding)
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            self._vectors = np.empty((self.maxsize, vector.shape[0]), dtype=np.float32)
+            self._values = []
+            self._next = 0
+        
+        self._vectors[self._next] = vector
+        if len(self._values) < self.maxsize:
+            self._values.append(value)
+        else:
+            self._values[self._next] = value
+        self._next = (self._next + 1) % self.maxsize
+    
+    def clear(self):
+        self._vectors = None
+        self._values = []
+        self._next = 0
+
+
+# คำตอบของ OllamaLLM เมื่อเรียก Ollama ไม่สำเร็จ (ไม่เก็บลง answer cache)
+_LLM_ERROR_PREFIX = "ขออภัย เกิดข้อผิดพลาดในการประมวลผล"
+
+# คำตอบแทนเมื่อ LLM ตอบว่าง/สั้นเกินไป (ไม่เก็บลง cache - อาจเป็นความผิดพลาดชั่วคราว)
+_NO_ANSWER_MESSAGE = "ขออภัย ไม่สามารถสร้างคำตอบที่เหมาะสมได้ กรุณาลองถามใหม่อีกครั้ง"
+
+
+def _cacheable_answer(answer: str) -> bool:
+    """คำตอบที่เก็บลง answer/semantic cache ได้ (ไม่สั้นเกินไป ไม่ใช่ข้อความแจ้งข้อผิดพลาดหรือคำตอบแทน)"""
+    return (len(answer.strip()) >= 10 and not answer.startswith(_LLM_ERROR_PREFIX)
+            and answer != _NO_ANSWER_MESSAGE)
+
+
+class _AnswerAccumulator:
+    """
+    รวม token จาก stream ของ Ollama เป็นคำตอบ โดยตัดบรรทัดที่ซ้ำทันทีที่ได้บรรทัดครบ
+    
+    feed() คืน True เมื่อคำตอบ (หลังตัดซ้ำ) ยาวเกิน 1000 ตัวอักษรแล้ว - ส่วนที่เหลือจะถูกตัดทิ้งอยู่ดี
+    ผู้เรียกจึงหยุดรับ stream ได้ทันทีเพื่อให้ Ollama หยุดสร้าง
+    pop_text() คืนข้อความที่ตัดซ้ำแล้วทีละบรรทัดสำหรับแสดงระหว่าง stream (ต่อกันแล้วเป็นส่วนต้นของ result())
+    """
+    
+    MAX_CHARS = 1000
+    
+    def __init__(self):
+        # ตัดส่วนที่ซ้ำออก (ถ้ามีการซ้ำมากกว่า 50 ตัวอักษร)
+        self._seen = set()
+        self._lines: List[str] = []
+        self._length = -1  # ความยาวของ '\n'.join(self._lines)
+        self._pending = ""
+        self._popped_lines = 0  # จำนวนบรรทัดที่ pop_text ส่งออกไปแล้ว
+        self._popped_chars = 0  # ความยาวข้อความที่ pop_text ส่งออกไปแล้ว
+        self.failed = False  # result() คืน _NO_ANSWER_MESSAGE แทนคำตอบจริง
+    
+    def _add_line(self, line: str):
+        line_stripped = line.strip()
+        if len(line_stripped) > 20:  # เฉพาะบรรทัดที่มีเนื้อหา
+            if line_stripped in self._seen:
+                return
+            self._seen.add(line_stripped)
+        self._lines.append(line)
+        self._length += len(line) + 1
+    
+    def feed(self, token: str) -> bool:
+        """เพิ่ม token - คืน True ถ้าได้คำตอบครบความยาวสูงสุดแล้ว"""
+        self._pending += token
+        if '\n' in self._pending:
+            *complete, self._pending = self._pending.split('\n')
+            for line in complete:
+                self._add_line(line)
+        return self._length > self.MAX_CHARS
+    
+    def pop_text(self) -> str:
+        """ข้อความส่วนใหม่ (บรรทัดที่ครบและตัดซ้ำแล้ว ไม่เกินความยาวสูงสุด) นับจากการเรียกครั้งก่อน"""
+        if len(self._lines) == self._popped_lines:
+            return ""
+        self._popped_lines = len(self._lines)
+        # ตัด/strip แบบเดียวกับ result() จึงเป็นส่วนต้นของคำตอบสุดท้ายเสมอ
+        text = '\n'.join(self._lines)[:self.MAX_CHARS - 3].strip()
+        new_text = text[self._popped_chars:]
+        self._popped_chars = len(text)
+        return new_text
+    
+    def result(self) -> str:
+        """คำตอบสุดท้าย (ตัดซ้ำ ตรวจความยาว และตัดให้สั้นแล้ว)"""
+        self._add_line(self._pending)
+        self._pending = ""
+        result = '\n'.join(self._lines)
+        
+        # ตรวจสอบคำตอบ
+        if not result or len(result.strip()) < 5:
+            self.failed = True
+            return _NO_ANSWER_MESSAGE
+        
+        # ตัดให้สั้นถ้ายาวเกินไป (max 1000 chars)
+        if len(result) > self.MAX_CHARS:
+            result = result[:self.MAX_CHARS - 3] + "..."
+        
+        return result.strip()
+
+
+def _keep_alive_seconds(keep_alive: Union[str, int, float]) -> Optional[float]:
+    """แปลงค่า keep_alive ของ Ollama ("30m", "1h", "300s", 300) เป็นวินาที (None = ไม่ unload เลย)"""
+    match = re.fullmatch(r'\s*(-?\d+(?:\.\d+)?)\s*([smh]?)\s*', str(keep_alive))
+    if match is None:
+        return 0.0  # รูปแบบที่ไม่รู้จัก → ถือว่าอาจถูก unload แล้วเสมอ
+    value = float(match.group(1))
+    if value < 0:
+        return None
+    return value * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+
 
 class OllamaLLM(LLM):
     """Custom LLM class สำหรับ Ollama"""
@@ -24,19 +353,30 @@ class OllamaLLM(LLM):
     model_name: str = "llama3.1"
     temperature: float = 0.1
     max_tokens: int = 2048
+    keep_alive: str = "30m"  # ให้ Ollama คงโมเดลไว้ในหน่วยความจำระหว่างคำถาม (ไม่โหลดใหม่ทุกครั้ง)
+    num_ctx: Optional[int] = None  # ขนาด context window (KV cache) - None = ค่าเริ่มต้นของ Ollama/โมเดล
+    last_used: Optional[float] = None  # time.monotonic() ที่ส่งคำขอถึงโมเดลล่าสุด (None = ยังไม่เคย)
     
     def __init__(self, model_name: str = "llama3.1", temperature: float = 0.1, **kwargs):
         super().__init__(**kwargs)
         self.model_name = model_name
         self.temperature = temperature
         
-        # ตรวจสอบการเชื่อมต่อ Ollama
-        self._check_ollama_connection()
+        # ตรวจสอบการเชื่อมต่อ Ollama แล้วเริ่มโหลดโมเดลใน background
+        # (คำถามแรกไม่ต้องรอโหลดโมเดล - ส่วนใหญ่ผู้ใช้ยังต้องอัพโหลดเอกสารก่อนอยู่แล้ว)
+        if self._check_ollama_connection():
+            threading.Thread(target=self.warm_up, daemon=True).start()
     
     def _check_ollama_connection(self) -> bool:
-        """ตรวจสอบการเชื่อมต่อกับ Ollama"""
+        """ตรวจสอบการเชื่อมต่อกับ Ollama (ผลที่สำเร็จใช้ซ้ำได้ภายใน _CONNECTION_CHECK_TTL วินาที)"""
+        requested_model = self.model_name
+        checked = _connection_checks.get(requested_model)
+        if checked is not None and time.monotonic() - checked[0] < _CONNECTION_CHECK_TTL:
+            self.model_name = checked[1]
+            return True
+        
         try:
-            response = requests.get("http://localhost:11434/api/tags", timeout=5)
+            response = _OLLAMA_HTTP.get("http://localhost:11434/api/tags", timeout=5)
             if response.status_code == 200:
                 models = response.json().get('models', [])
                 available_models = [model['name'] for model in models]
@@ -49,6 +389,7 @@ class OllamaLLM(LLM):
                         self.model_name = available_models[0]
                 
                 print(f"✅ เชื่อมต่อ Ollama สำเร็จ - ใช้โมเดล: {self.model_name}")
+                _connection_checks[requested_model] = (time.monotonic(), self.model_name)
                 return True
             else:
                 raise Exception(f"HTTP {response.status_code}")
@@ -58,68 +399,144 @@ class OllamaLLM(LLM):
             print("💡 กรุณาตรวจสอบว่า Ollama ทำงานอยู่ (ollama serve)")
             return False
     
+    def _build_messages(self, prompt: str) -> List[Dict[str, str]]:
+        """สร้างรายการข้อความสำหรับ ollama.chat"""
+        return [
+            {
+                "role": "system", 
+                "content": "คุณเป็นผู้ช่วยที่ตอบคำถามเป็นภาษาไทยเท่านั้น ตอบสั้น กระชับ ตรงประเด็น ห้ามซ้ำคำ ห้ามพูดเยิ่นเย้อ"
+            },
+            {
+                "role": "user", 
+                "content": prompt
+            }
+        ]
+    
+    def _build_options(self) -> Dict[str, Any]:
+        """ตัวเลือกการสร้างข้อความของ Ollama"""
+        options = {
+            "temperature": self.temperature,
+            "num_predict": self.max_tokens,  # ใช้ค่าที่ตั้งจาก UI โดยตรง
+            "top_p": 0.9,
+            "top_k": 40,  # จำกัด choices
+            "repeat_penalty": 1.1,  # ลดค่า penalty - อนุญาตให้ซ้ำรูปแบบเดียวกันได้ (สำหรับรายการ)
+            "stop": [
+                "</s>", 
+                "<|end|>", 
+                "Human:", 
+                "\n\nคำถาม:",  # หยุดถ้าเจอคำถามใหม่
+                "\n\n---\n"  # หยุดถ้าเจอ separator
+            ]
+        }
+        
+        # กำหนดเฉพาะเมื่อตั้งค่าไว้ - ต้องพอสำหรับ prompt (context + ประวัติ) + num_predict ไม่เช่นนั้น
+        # Ollama จะตัด prompt ทิ้ง; ค่าคงที่ต่อโมเดลเท่านั้น (เปลี่ยนค่าแล้ว Ollama ต้องโหลดโมเดลใหม่)
+        if self.num_ctx:
+            options["num_ctx"] = self.num_ctx
+        
+        return options
+    
     def _call(self, prompt: str, stop: Optional[List[str]] = None, 
               run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs) -> str:
         """เรียกใช้ Ollama LLM"""
+        self.last_used = time.monotonic()
         try:
-            response = ollama.chat(
+            # stream แล้วตัดซ้ำทีละบรรทัดที่ได้มา - ถ้าคำตอบ (หลังตัดซ้ำ) ยาวเกิน 1000 ตัวอักษรแล้ว
+            # ส่วนที่เหลือจะถูกตัดทิ้งอยู่ดี จึงหยุดรับ stream ทันทีเพื่อให้ Ollama หยุดสร้าง
+            stream = ollama.chat(
                 model=self.model_name,
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "คุณเป็นผู้ช่วยที่ตอบคำถามเป็นภาษาไทยเท่านั้น ตอบสั้น กระชับ ตรงประเด็น ห้ามซ้ำคำ ห้ามพูดเยิ่นเย้อ"
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                options={
-                    "temperature": self.temperature,
-                    "num_predict": self.max_tokens,  # ใช้ค่าที่ตั้งจาก UI โดยตรง
-                    "top_p": 0.9,
-                    "top_k": 40,  # จำกัด choices
-                    "repeat_penalty": 1.1,  # ลดค่า penalty - อนุญาตให้ซ้ำรูปแบบเดียวกันได้ (สำหรับรายการ)
-                    "stop": [
-                        "</s>", 
-                        "<|end|>", 
-                        "Human:", 
-                        "\n\nคำถาม:",  # หยุดถ้าเจอคำถามใหม่
-                        "\n\n---\n"  # หยุดถ้าเจอ separator
-                    ]
-                }
+                messages=self._build_messages(prompt),
+                options=self._build_options(),
+                keep_alive=self.keep_alive,
+                stream=True
             )
             
-            result = response['message']['content']
-            
-            # ตัดส่วนที่ซ้ำออก (ถ้ามีการซ้ำมากกว่า 50 ตัวอักษร)
-            lines = result.split('\n')
-            seen = set()
-            unique_lines = []
-            for line in lines:
-                line_stripped = line.strip()
-                if len(line_stripped) > 20:  # เฉพาะบรรทัดที่มีเนื้อหา
-                    if line_stripped not in seen:
-                        unique_lines.append(line)
-                        seen.add(line_stripped)
-                else:
-                    unique_lines.append(line)
+            answer = _AnswerAccumulator()
+            for part in stream:
+                if answer.feed(part['message']['content']):
+                    break
+            
+            if hasattr(stream, "close"):
+                stream.close()
+            
+            return answer.result()
             
-            result = '\n'.join(unique_lines)
+        except Exception as e:
+            print(f"❌ เกิดข้อผิดพลาดในการเรียกใช้ LLM: {e}")
+            return f"{_LLM_ERROR_PREFIX}: {str(e)}"
+    
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None,
+                     run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs) -> str:
+        """
+        เรียกใช้ Ollama LLM แบบ async (ผ่าน ollama.AsyncClient) - ใช้กับ ainvoke/asyncio.gather
+        
+        Ollama ตอบหลายคำขอพร้อมกันได้จริงเมื่อตั้ง OLLAMA_NUM_PARALLEL (เช่น 4) ที่ฝั่ง server
+        ไม่เช่นนั้นคำขอจะถูกเข้าคิวทีละคำขอ
+        """
+        self.last_used = time.monotonic()
+        try:
+            stream = await _ollama_async_client().chat(
+                model=self.model_name,
+                messages=self._build_messages(prompt),
+                options=self._build_options(),
+                keep_alive=self.keep_alive,
+                stream=True
+            )
             
-            # ตรวจสอบคำตอบ
-            if not result or len(result.strip()) < 5:
-                return "ขออภัย ไม่สามารถสร้างคำตอบที่เหมาะสมได้ กรุณาลองถามใหม่อีกครั้ง"
+            answer = _AnswerAccumulator()
+            async for part in stream:
+                if answer.feed(part['message']['content']):
+                    break
             
-            # ตัดให้สั้นถ้ายาวเกินไป (max 1000 chars)
-            if len(result) > 1000:
-                result = result[:997] + "..."
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
             
-            return result.strip()
+            return answer.result()
             
         except Exception as e:
             print(f"❌ เกิดข้อผิดพลาดในการเรียกใช้ LLM: {e}")
-            return f"ขออภัย เกิดข้อผิดพลาดในการประมวลผล: {str(e)}"
+            return f"{_LLM_ERROR_PREFIX}: {str(e)}"
+    
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs) -> Iterator[GenerationChunk]:
+        """เรียกใช้ Ollama LLM แบบ streaming (ส่ง token ทันทีที่สร้างได้)"""
+        self.last_used = time.monotonic()
+        stream = ollama.chat(
+            model=self.model_name,
+            messages=self._build_messages(prompt),
+            options=self._build_options(),
+            keep_alive=self.keep_alive,
+            stream=True
+        )
+        
+        try:
+            for part in stream:
+                token = part['message']['content']
+                if not token:
+                    continue
+                chunk = GenerationChunk(text=token)
+                if run_manager:
+                    run_manager.on_llm_new_token(token, chunk=chunk)
+                yield chunk
+        finally:
+            # ผู้เรียกหยุดรับกลางทาง → ปิด connection ให้ Ollama หยุดสร้างต่อ
+            if hasattr(stream, "close"):
+                stream.close()
+    
+    def warm_up(self) -> None:
+        """โหลดโมเดลเข้าหน่วยความจำล่วงหน้า (prompt ว่าง - Ollama โหลดโมเดลโดยไม่สร้างข้อความ)"""
+        try:
+            ollama.generate(model=self.model_name, prompt="", keep_alive=self.keep_alive)
+            self.last_used = time.monotonic()
+        except Exception as e:
+            logger.debug("⚠️ โหลดโมเดลล่วงหน้าไม่สำเร็จ: %s", e)
+    
+    def needs_warm_up(self) -> bool:
+        """โมเดลอาจถูก Ollama unload แล้ว (ยังไม่เคยเรียก หรือเรียกล่าสุดนานกว่า keep_alive)"""
+        if self.last_used is None:
+            return True
+        keep_alive = _keep_alive_seconds(self.keep_alive)
+        return keep_alive is not None and time.monotonic() - self.last_used >= keep_alive
     
     @property
     def _llm_type(self) -> str:
@@ -133,119 +550,500 @@ class ThaiRAGSystem:
                  vector_store_manager,
                  llm_model: str = "llama3.1",
                  temperature: float = 0.1,
-                 max_tokens: int = 2048):
+                 max_tokens: int = 2048,
+                 llm: Optional[OllamaLLM] = None,
+                 history_window: int = 4,
+                 max_history_turns: int = 20):
         """
         Args:
             vector_store_manager: ThaiVectorStoreManager instance
             llm_model: ชื่อโมเดล Ollama ที่จะใช้
             temperature: ความสร้างสรรค์ของการตอบ (0-1)
             max_tokens: จำนวนคำสูงสุดในการตอบ
+            llm: OllamaLLM ที่สร้างไว้แล้ว (ข้ามการตรวจสอบการเชื่อมต่อ Ollama ซ้ำ)
+            history_window: จำนวนรอบสนทนาที่เกี่ยวข้องที่สุดที่ใส่ใน prompt
+            max_history_turns: จำนวนรอบสนทนาสูงสุดที่เก็บใน memory
         """
         self.vector_store_manager = vector_store_manager
+        self.history_window = history_window
+        self.max_history_turns = max_history_turns
         
-        # สร้าง LLM
-        self.llm = OllamaLLM(
-            model_name=llm_model,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+        # embedding ของแต่ละรอบสนทนา (คำนวณครั้งเดียวต่อรอบ)
+        self._turn_embeddings: Dict[str, np.ndarray] = {}
+        
+        # cache ผลค้นหา (key = คำถามที่ตัดช่องว่างแล้ว + ขนาด store) และคำตอบ (key = hash ของ prompt เต็ม
+        # ซึ่งรวม context และประวัติสนทนาแล้ว) - ล้างเมื่อ vector store เปลี่ยน
+        self._retrieval_cache = _TTLCache(maxsize=128)
+        self._answer_cache = _TTLCache(maxsize=64)
+        
+        # cache คำตอบตามความหมาย (คำถามที่ถามซ้ำด้วยถ้อยคำต่างกันเล็กน้อย ไม่ต้องค้นหา/เรียก LLM)
+        self._semantic_cache = _SemanticCache(maxsize=256, threshold=0.95)
+        
+        # สร้าง LLM (ถ้ามี llm ที่ตรวจสอบแล้ว ใช้สำเนาพร้อมค่าของ session นี้ ไม่แก้ตัวที่แชร์อยู่)
+        if llm is not None:
+            self.llm = llm.copy(update={"temperature": temperature, "max_tokens": max_tokens})
+        else:
+            self.llm = OllamaLLM(
+                model_name=llm_model,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
         
         # สร้าง Memory สำหรับเก็บประวัติการสนทนา
-        self.memory = ConversationBufferMemory(
+        # เก็บได้ถึง max_history_turns รอบ (ใช้เลือกรอบที่เกี่ยวข้อง) แต่ load_memory_variables คืนแค่
+        # history_window รอบล่าสุด ผู้ที่โหลดจาก memory จึงไม่ได้ประวัติที่ยาวขึ้นเรื่อยๆ ตามจำนวนรอบสนทนา
+        self.memory = ConversationBufferWindowMemory(
+            k=history_window,
             memory_key="chat_history",
             return_messages=True,
             output_key="answer"
         )
         
         # สร้าง Prompt Template
+        # ask_question* ใช้ข้อความ template ตรงๆ กับ str.format (PromptTemplate.format ตรวจ input และ
+        # parse template ใหม่ทุกครั้งผ่าน Formatter ที่เขียนด้วย Python - template ไม่เปลี่ยนหลังสร้าง)
         self.prompt_template = self._create_prompt_template()
+        self._prompt_templates = {
+            question_type: _prompt_text(question_type)
+            for question_type in ("course_code", "listing", "general")
+        }
+        
+        # ผลลัพธ์ล่าสุดจาก ask_question_stream
+        self.last_result: Optional[Dict[str, Any]] = None
         
         # สร้าง RAG Chain
         self.rag_chain = None
         self._setup_rag_chain()
     
-    def _create_prompt_template(self) -> PromptTemplate:
-        """สร้าง Prompt Template สำหรับภาษาไทย"""
-        template = """คุณเป็นผู้ช่วยปัญญาประดิษฐ์ที่เชี่ยวชาญในการตอบคำถามจากหลักสูตรการศึกษาภาษาไทย
-
-ข้อมูลที่เกี่ยวข้องจากเอกสาร:
-{context}
-
-ประวัติการสนทนา:
-{chat_history}
-
-คำถาม: {question}
-
-กฎการตอบ (ปฏิบัติอย่างเคร่งครัด):
-
-**สำหรับคำถามเกี่ยวกับรหัสวิชา (เช่น "05506012 คือวิชาอะไร"):**
-- ✅ ค้นหารหัสวิชาในข้อมูลที่ให้มา
-- ✅ ตอบด้วย: "รหัสวิชา [รหัส] คือ [ชื่อวิชาภาษาไทย] ([ชื่อภาษาอังกฤษถ้ามี]) จำนวน [หน่วยกิต] หน่วยกิต"
-- ❌ ห้ามตอบด้วยเลขอะไรก็ตามที่ไม่ใช่ชื่อวิชา
-
-**สำหรับคำถามเกี่ยวกับรายวิชาในภาค/ปี (เช่น "ปีที่ 1 ภาคการศึกษาที่ 1 มีอะไรบ้าง"):**
-- ✅ **คำสั่งสำคัญ: ต้องแสดงรายการวิชาครบทั้งหมด 100%**
-- ✅ ตอบเป็นรายการ bullet point ทุกวิชา:
-  • รหัสวิชา ชื่อวิชา (หน่วยกิต)
-  • รหัสวิชา ชื่อวิชา (หน่วยกิต)
-  • (แสดงต่อไปจนครบทุกวิชา)
-- ✅ บอกจำนวนรวมหน่วยกิตท้ายสุด
-- ❌ **ห้ามตอบแค่บางวิชา** - ต้องระบุให้ครบทุกวิชาที่มีในข้อมูล
-- ❌ **ห้ามใช้ "..." หรือ "และอื่นๆ"** - ต้องเขียนครบ
-
-**ตัวอย่างคำตอบที่ถูกต้อง:**
-"ในปีที่ 1 ภาคการศึกษาที่ 2 มีรายวิชาดังนี้:
-
-• 05506233 แคลคูลัสสำหรับวิทยาการคอมพิวเตอร์ (3 หน่วยกิต)
-• 05506001 คณิตศาสตร์ดิสครีต (3 หน่วยกิต)
-• 05506004 การเขียนโปรแกรมเชิงออบเจกต์ (3 หน่วยกิต)
-• 05506008 โครงสร้างและสถาปัตยกรรมคอมพิวเตอร์ (3 หน่วยกิต)
-• 05506011 ปฏิสัมพันธ์ระหว่างมนุษย์และคอมพิวเตอร์ (3 หน่วยกิต)
-• 90644008 ภาษาอังกฤษพื้นฐาน 2 (3 หน่วยกิต)
-• 90xxxxxx วิชาเลือกหมวดวิชาศึกษาทั่วไป (3 หน่วยกิต)
-
-รวม 21 หน่วยกิต"
-
-**สำหรับคำถามทั่วไป:**
-- ✅ ใช้เฉพาะข้อมูลจากเอกสาร
-- ✅ ตอบสั้น กระชับ 3-5 ประโยค
-- ❌ ห้ามแต่งข้อมูล ห้ามซ้ำคำ
-- ❌ ถ้าไม่พบข้อมูล → ตอบว่า "ไม่พบข้อมูลในเอกสาร"
-
-คำตอบ (ตอบเป็นภาษาไทยเท่านั้น):"""
-        
+    def _create_prompt_template(self, question_type: str = "full") -> PromptTemplate:
+        """สร้าง Prompt Template สำหรับภาษาไทย (full = กฎทุกแบบ หรือเฉพาะกฎของประเภทคำถาม)"""
         return PromptTemplate(
-            template=template,
+            template=_prompt_text(question_type),
             input_variables=["context", "chat_history", "question"]
         )
     
+    def _prompt_for(self, question: str) -> str:
+        """prompt template (มี {context}, {chat_history}, {question}) ที่มีเฉพาะกฎสำหรับประเภทของคำถามนี้"""
+        return self._prompt_templates[_question_type(question)]
+    
     def _setup_rag_chain(self):
         """ตั้งค่า RAG Chain"""
         if self.vector_store_manager.vector_store is None:
             print("⚠️ ไม่มี vector store สำหรับการสร้าง RAG chain")
             return
         
-        # สร้าง retriever
-        retriever = self.vector_store_manager.get_retriever(k=5)
+        # chain ไม่ผูกกับ vector store → สร้างครั้งเดียวแล้วใช้ต่อเมื่อ update_vector_store
+        if self.rag_chain is not None:
+            return
         
-        # สร้าง ConversationalRetrievalChain
-        self.rag_chain = ConversationalRetrievalChain.from_llm(
+        # chain รับ context ที่ค้นหา/กรองไว้แล้วจาก _retrieve_documents โดยตรง (prompt เต็ม)
+        # (ไม่มี retriever ในตัว จึงไม่ค้นหาซ้ำ และไม่ต้องเรียก LLM อีกรอบเพื่อเรียบเรียงคำถามใหม่)
+        # ask_question* เรียก LLM ตรงด้วย prompt ที่มีเฉพาะกฎของประเภทคำถาม (_prompt_for)
+        self.rag_chain = LLMChain(
             llm=self.llm,
-            retriever=retriever,
-            memory=self.memory,
-            return_source_documents=True,
-            combine_docs_chain_kwargs={"prompt": self.prompt_template},
-            verbose=True
+            prompt=self.prompt_template
         )
         
         print("✅ สร้าง RAG Chain สำเร็จ")
     
-    def ask_question(self, question: str) -> Dict[str, Any]:
+    def _retrieve_documents(self, question: str,
+                            query_embedding: Optional[List[float]] = None) -> List[Document]:
+        """
+        ค้นหาเอกสารที่เกี่ยวข้อง กรองตาม metadata และตัดให้เหลือเฉพาะ chunks ที่จะใช้เป็น context
+        
+        Args:
+            question: คำถามภาษาไทย
+            query_embedding: embedding ของคำถาม (ถ้าคำนวณไว้แล้ว)
+            
+        Returns:
+            List[Document]: chunks ที่เลือกแล้ว (ว่างถ้าไม่พบข้อมูล)
+        """
+        cache_key = self._retrieval_key(question)
+        cached_docs = self._retrieval_cache.get(cache_key)
+        if cached_docs is not None:
+            logger.debug("⚡ ใช้ผลค้นหาจาก cache")
+            return list(cached_docs)
+        
+        # read lock ของ vector store ที่แชร์ข้าม session: ไม่ค้นระหว่างที่ session อื่นกำลังเพิ่มเอกสาร
+        # (index, docstore และ index_to_docstore_id ถูกแก้ไขแบบ in-place)
+        with self.vector_store_manager.lock.read():
+            relevant_docs = self._search_and_filter(question, query_embedding)
+        self._retrieval_cache.put(cache_key, relevant_docs)
+        return list(relevant_docs)
+    
+    def _warm_up_llm(self) -> None:
+        """เริ่มโหลดโมเดล LLM ใน background ระหว่างที่ค้นหาเอกสาร เฉพาะเมื่อโมเดลอาจถูก unload ไปแล้ว"""
+        if self.llm.needs_warm_up():
+            threading.Thread(target=self.llm.warm_up, daemon=True).start()
+    
+    def _store_state(self) -> Tuple[int, int]:
+        """สถานะของ vector store สำหรับ cache"""
+        # vector store แชร์กันทุก session → ใช้ขนาด store ประกอบ key ผลเก่าจะไม่ถูกใช้หลังมีการเพิ่มเอกสาร
+        store = self.vector_store_manager
+        return (id(store.vector_store), len(store.documents))
+    
+    def _semantic_state(self) -> Tuple[Tuple[int, int], bytes]:
+        """สถานะสำหรับ semantic cache: สถานะ vector store + hash ของประวัติสนทนาทั้งหมด
+        
+        คำถามต่อเนื่อง (เช่น "แล้ววิชานั้นมีกี่หน่วยกิต") ขึ้นกับประวัติ → ใช้คำตอบเดิมได้เฉพาะเมื่อประวัติตรงกัน
+        """
+        history = hashlib.blake2b(digest_size=16)
+        for message in self.memory.chat_memory.messages:
+            history.update(message.content.encode('utf-8'))
+            history.update(b'\0')
+        return (self._store_state(), history.digest())
+    
+    def _retrieval_key(self, question: str) -> Tuple[str, Tuple[int, int]]:
+        """key ของ retrieval cache"""
+        return (" ".join(question.split()), self._store_state())
+    
+    def _semantic_lookup(self, question: str,
+                         embedding: Optional[List[float]] = None
+                         ) -> Tuple[Optional[List[float]], Optional[Tuple[str, List[Dict[str, Any]]]]]:
+        """
+        embed คำถาม (ถ้ายังไม่มี embedding) แล้วหาคำตอบของคำถามเดิมที่ความหมายเดียวกันใน semantic cache
+        
+        Returns:
+            (embedding ของคำถาม หรือ None ถ้าคำถามนี้ไม่ใช้ cache, (answer, sources) หรือ None ถ้าไม่พบ)
+        """
+        if _RE_ANY_DIGIT.search(question):
+            return None, None
+        
+        if embedding is None:
+            embedding = self.vector_store_manager.embeddings.embed_query(question)
+        entry = self._semantic_cache.get(embedding)
+        if entry is not None and entry[0] == self._semantic_state():
+            logger.debug("⚡ ใช้คำตอบจาก semantic cache")
+            return embedding, entry[1:]
+        return embedding, None
+    
+    def _cached_answer(self, prompt: str) -> Tuple[bytes, Optional[str]]:
+        """
+        หาคำตอบของ prompt เดิมทุกตัวอักษร (คำถาม + context + ประวัติ) ใน answer cache
+        
+        Returns:
+            (key ของ prompt สำหรับ _store_answer, คำตอบ หรือ None ถ้าไม่พบ)
+        """
+        prompt_key = hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).digest()
+        answer = self._answer_cache.get(prompt_key)
+        if answer is not None:
+            logger.debug("⚡ ใช้คำตอบจาก cache")
+        return prompt_key, answer
+    
+    def _store_answer(self, prompt_key: bytes, answer: str) -> None:
+        """เก็บคำตอบลง answer cache (ยกเว้นคำตอบที่สั้นเกินไป ข้อความแจ้งข้อผิดพลาด หรือคำตอบแทน)"""
+        if _cacheable_answer(answer):
+            self._answer_cache.put(prompt_key, answer)
+    
+    def _search_and_filter(self, question: str,
+                           query_embedding: Optional[List[float]] = None,
+                           candidates: Optional[List[Document]] = None) -> List[Document]:
+        """ค้นหาใน vector store แล้วกรอง/จัดลำดับตามรหัสวิชา ชั้นปี และภาคการศึกษาในคำถาม
+        
+        ถ้ามี query_embedding (embed ไว้แล้วแบบ batch) จะค้นด้วย vector นั้นโดยไม่ embed คำถามซ้ำ
+        ถ้ามี candidates (ผลค้นแบบไม่กรองจาก search_by_vectors) จะใช้แทนการค้นแบบไม่กรอง
+        """
+        # ตรวจจับรหัสวิชาในคำถาม (รองรับทั้ง 05506231 และ 0550 6231)
+        question_course_code = _RE_QUESTION_COURSE_CODE.search(question)
+        code_hits = None
+        if question_course_code:
+            # ดึงรหัสจาก regex (group 3 = 8 หลักติด, group 1+2 = 4+4 หลักแยก)
+            target_code = question_course_code.group(3) or (
+                question_course_code.group(1) + question_course_code.group(2)
+            )
+            # chunks ที่มีรหัสนั้นจาก index โดยตรง ไม่ต้อง embed/ค้นหา
+            code_hits = self.vector_store_manager.find_by_course_code(target_code)[:10]
+        
+        # ตรวจจับชั้นปี/ภาคการศึกษาในคำถาม
+        question_year = _RE_QUESTION_YEAR.search(question)
+        question_semester = _RE_QUESTION_SEMESTER.search(question)
+        year_str = question_year.group(1) if question_year else None
+        semester_str = question_semester.group(1) if question_semester else None
+        
+        # ถามปี/ภาค (ไม่ได้ถามรหัสวิชา) → กรองด้วย metadata ตั้งแต่ตอนค้นใน vector store
+        metadata_filter = {}
+        if not question_course_code:
+            if year_str:
+                metadata_filter["year"] = year_str
+            if semester_str:
+                metadata_filter["semester"] = semester_str
+        
+        # ค้นหาเอกสารที่เกี่ยวข้อง - เพิ่ม k เป็น 10 สำหรับคำถามเกี่ยวกับรายวิชา
+        vector_store = self.vector_store_manager.vector_store
+        if code_hits:
+            relevant_docs = code_hits
+            logger.debug("⚡ พบรหัสวิชาใน index %d chunks", len(code_hits))
+        elif query_embedding is None and not metadata_filter:
+            relevant_docs = vector_store.similarity_search(
+                question, 
+                k=10  # เพิ่มเป็น 10 เพื่อดูข้อมูลครบถ้วนสำหรับตาราง
+            )
+        else:
+            if query_embedding is None:
+                # embed ครั้งเดียว ใช้ได้ทั้งค้นแบบกรองและแบบไม่กรอง
+                query_embedding = self.vector_store_manager.embeddings.embed_query(question)
+            relevant_docs = []
+            if metadata_filter:
+                # FAISS กรอง metadata หลังค้น → ดึงผู้สมัครมากขึ้น (fetch_k) ให้เหลือพอหลังกรอง
+                relevant_docs = vector_store.similarity_search_by_vector(
+                    query_embedding, k=10, filter=metadata_filter, fetch_k=100
+                )
+                logger.debug("🎯 กรอง metadata %s ได้ %d chunks", metadata_filter, len(relevant_docs))
+            # รวมผลค้นแบบไม่กรองต่อท้ายเสมอ - chunk ที่ metadata ไม่ตรง (เช่นนำเข้าก่อนมี metadata)
+            # แต่มี "ปีที่ X ภาคการศึกษาที่ Y" ใน content ยังถูกให้คะแนนด้านล่างได้
+            if candidates is None:
+                candidates = vector_store.similarity_search_by_vector(query_embedding, k=10)
+            seen_contents = {doc.page_content for doc in relevant_docs}
+            relevant_docs = relevant_docs + [
+                doc for doc in candidates if doc.page_content not in seen_contents
+            ]
+        
+        # ตรวจสอบคุณภาพของ context
+        if not relevant_docs:
+            return []
+        
+        # 🎯 กรองเอกสารที่เกี่ยวข้องตามคำถาม (Metadata Filtering)
+        
+        if question_course_code:
+            # ค้นหาในหลายรูปแบบ: "05506231" หรือ "0550 6231" หรือ "0550-6231"
+            code_pattern = _course_code_pattern(target_code)
+        
+        # chunks ที่ตรงมาก (รหัสวิชา / ปีและภาคตรง) ขึ้นก่อน ตามด้วยที่ตรงบางส่วน - คงลำดับความคล้ายในแต่ละกลุ่ม
+        high_priority: List[Document] = []
+        low_priority: List[Document] = []
+        
+        # 🔍 กรองตาม metadata และ content ถ้าพบคำสำคัญในคำถาม
+        for doc in relevant_docs:
+            metadata = doc.metadata
+            content = doc.page_content
+            
+            # ถ้าถามรหัสวิชาเฉพาะ → ต้องมีรหัสนั้นใน chunk (รองรับทั้งติดกันและมีช่องว่าง)
+            # เช็ค metadata ก่อน (รหัสทุกรูปแบบถูกเก็บเป็น 8 หลักตอนนำเข้า) - regex บน content
+            # เหลือไว้สำหรับ chunks ที่นำเข้าก่อนหน้านี้ซึ่ง metadata มีแค่รหัสแบบติดกัน
+            if question_course_code:
+                if (target_code in metadata.get("course_codes", "") or
+                    code_pattern.search(content)):
+                    # พบรหัสวิชา! priority สูงมาก
+                    high_priority.append(doc)
+                    logger.debug("✅ พบรหัสวิชา %s ใน chunk: %.100s", target_code, content)
+                    continue
+            
+            # ถ้าถามปี/ภาค → ค้นหาทั้ง metadata และ content โดยตรง
+            elif question_year or question_semester:
+                match_score = 0  # คะแนนความตรง
+                
+                # ถ้าถามทั้งปีและภาค
+                if question_year and question_semester:
+                    # ตรวจสอบ metadata ก่อน (แม่นยำที่สุด)
+                    meta_year_match = metadata.get("year") == year_str
+                    meta_semester_match = metadata.get("semester") == semester_str
+                    
+                    if meta_year_match and meta_semester_match:
+                        match_score = 100  # สมบูรณ์แบบ!
+                    elif meta_year_match or meta_semester_match:
+                        match_score = 50  # ตรงบางส่วน
+                    
+                    # ถ้า metadata ไม่ตรง → ค้นหาใน content โดยตรง
+                    else:
+                        # ค้นหาว่ามีคำว่า "ปีที่ X ภาคการศึกษาที่ Y" ใน content หรือไม่
+                        year_in_content = _year_pattern(year_str).search(content)
+                        semester_in_content = _semester_pattern(semester_str).search(content)
+                        
+                        if year_in_content and semester_in_content:
+                            match_score = 80  # เจอใน content ทั้งคู่
+                        elif year_in_content or semester_in_content:
+                            match_score = 40  # เจอใน content บางส่วน
+                    
+                    # ถ้ามีคะแนน → เอามา
+                    if match_score > 0:
+                        # Priority สูงถ้าคะแนนสูง
+                        if match_score >= 80:
+                            high_priority.append(doc)
+                            logger.debug("✅ [คะแนน %d] พบ ปี%s ภาค%s: %.100s", match_score, year_str, semester_str, content)
+                        else:
+                            low_priority.append(doc)
+                            logger.debug("⚠️ [คะแนน %d] พบบางส่วน ปี%s ภาค%s", match_score, year_str, semester_str)
+                        continue
+                
+                # ถ้าถามเฉพาะปี หรือเฉพาะภาค
+                elif question_year:
+                    if (metadata.get("year") == year_str or 
+                        _year_pattern(year_str).search(content)):
+                        low_priority.append(doc)
+                        logger.debug("✅ พบ ปี%s", year_str)
+                        continue
+                elif question_semester:
+                    if (metadata.get("semester") == semester_str or 
+                        _semester_pattern(semester_str).search(content)):
+                        low_priority.append(doc)
+                        logger.debug("✅ พบ ภาค%s", semester_str)
+                        continue
+            
+            # ถ้าไม่มีเงื่อนไขพิเศษ → เอาทุก doc
+            else:
+                low_priority.append(doc)
+        
+        filtered_docs = high_priority + low_priority
+        
+        # ถ้ากรองแล้วไม่เหลือเลย → ใช้ docs เดิม
+        if not filtered_docs:
+            filtered_docs = relevant_docs
+            logger.debug("⚠️ ไม่พบเอกสารที่ตรงเงื่อนไข ใช้ทั้งหมด %d chunks", len(relevant_docs))
+        else:
+            logger.debug("✅ กรองแล้วเหลือ %d chunks ที่ตรงเงื่อนไข", len(filtered_docs))
+        
+        # ใช้ top 2 chunks (ลดเพื่อป้องกัน Ollama ล่ม)
+        num_chunks = 5 if (question_year or question_semester or "อะไรบ้าง" in question or "ทั้งหมด" in question) else 3
+        
+        # Deduplication - ใช้เนื้อหาเต็มเป็น key (chunk ตารางมักขึ้นต้นเหมือนกัน เช่น "ปีที่ 1"
+        # ตัดแค่ 100 ตัวแรกจะทิ้ง chunk ที่ต่างกันไป; hash ของ str ถูก cache ไว้ในตัว object อยู่แล้ว)
+        # หยุดเมื่อได้ครบ num_chunks - chunks ที่เหลือจะถูกตัดทิ้งอยู่ดี
+        unique_docs = []
+        seen_contents = set()
+        for doc in filtered_docs:
+            content = doc.page_content
+            if content not in seen_contents:
+                unique_docs.append(doc)
+                if len(unique_docs) >= num_chunks:
+                    break
+                seen_contents.add(content)
+        
+        return unique_docs
+    
+    def _build_context(self, relevant_docs: List[Document]) -> str:
+        """สร้าง context จาก chunks ที่เลือก (จำกัดความยาวรวม)"""
+        # 🔥 สร้าง context โดยใช้เนื้อหาเต็ม (ไม่ตัด) สำหรับตาราง
+        # gemma2:2b รองรับ ~2048 tokens ≈ 1500-1800 chars
+        context_parts = []
+        total_chars = 0
+        max_context_chars = 2000  # เพิ่มขึ้นสำหรับตารางข้อมูล
+        
+        for doc in relevant_docs:
+            # คำนวณว่ายังใส่ได้อีกเท่าไหร่
+            remaining = max_context_chars - total_chars
+            
+            if remaining <= 0:
+                break
+            
+            # ใช้เนื้อหาเต็มถ้ายังไม่เกิน limit (ตัดเฉพาะ chunk สุดท้ายที่ล้น)
+            content = doc.page_content
+            content_len = len(content)
+            if content_len > remaining:
+                # ตัดที่ท้ายบรรทัดสุดท้ายที่ใส่ได้ ไม่ให้แถวของตารางขาดกลางแถว
+                cut = content.rfind('\n', 0, remaining)
+                content_len = cut if cut > 0 else remaining
+                content = content[:content_len]
+            
+            # เพิ่ม metadata hint ถ้ามี
+            year = doc.metadata.get("year")
+            semester = doc.metadata.get("semester")
+            if year and semester:
+                metadata_hint = f"[ปีที่ {year} ภาคการศึกษาที่ {semester}]\n"
+                context_parts.append(metadata_hint + content)
+                total_chars += len(metadata_hint) + content_len
+            else:
+                context_parts.append(content)
+                total_chars += content_len
+        
+        context = "\n\n---\n\n".join(context_parts)
+        
+        # Debug: แสดง context
+        logger.debug("📄 ใช้ context รวม %d chars จาก %d chunks: %.200s...", len(context), len(context_parts), context)
+        
+        return context
+    
+    def _format_sources(self, relevant_docs: List[Document]) -> List[Dict[str, Any]]:
+        """จัดรูปแบบแหล่งข้อมูลสำหรับแสดงผล"""
+        sources = []
+        seen_sources = set()
+        for doc in relevant_docs:
+            metadata = doc.metadata
+            filename = metadata.get("filename", "ไม่ทราบ")
+            chunk_index = metadata.get("chunk_index", 0)
+            
+            # หลีกเลี่ยงการซ้ำ (เช็คก่อนสร้าง dict/ตัด preview)
+            source_key = (filename, chunk_index)
+            if source_key in seen_sources:
+                continue
+            seen_sources.add(source_key)
+            
+            content = doc.page_content
+            sources.append({
+                "content": content[:300] + "..." if len(content) > 300 else content,
+                "metadata": metadata,
+                "filename": filename,
+                "chunk_index": chunk_index
+            })
+        
+        return sources
+    
+    def _history_turns(self) -> List[Tuple[str, str]]:
+        """จับคู่ข้อความใน memory เป็นรอบสนทนา (คำถาม, คำตอบ)"""
+        messages = self.memory.chat_memory.messages
+        return [
+            (human_msg.content, ai_msg.content)
+            for human_msg, ai_msg in zip(messages[0::2], messages[1::2])
+        ]
+    
+    def _format_chat_history(self, question: str) -> str:
+        """
+        แปลงประวัติการสนทนาใน memory เป็นข้อความสำหรับ prompt
+        
+        ใช้เฉพาะ history_window รอบที่ใกล้เคียงกับคำถามที่สุด (cosine similarity)
+        เพื่อไม่ให้ prompt ยาวขึ้นเรื่อยๆ ตามจำนวนรอบสนทนา
+        """
+        turns = self._history_turns()
+        
+        if len(turns) > self.history_window:
+            embeddings = self.vector_store_manager.embeddings
+            turn_texts = [f"{q}\n{a}" for q, a in turns]
+            
+            # embed เฉพาะรอบที่ยังไม่เคยคำนวณ
+            new_texts = [text for text in turn_texts if text not in self._turn_embeddings]
+            if new_texts:
+                for text, vector in zip(new_texts, embeddings.embed_documents_np(new_texts)):
+                    self._turn_embeddings[text] = vector
+            
+            turn_matrix = np.stack([self._turn_embeddings[text] for text in turn_texts])
+            query_vector = np.asarray(embeddings.embed_query(question), dtype=np.float32)
+            
+            scores = turn_matrix @ query_vector / (
+                np.linalg.norm(turn_matrix, axis=1) * np.linalg.norm(query_vector) + 1e-12
+            )
+            
+            # เลือกรอบที่คะแนนสูงสุด แต่คงลำดับเวลาเดิมไว้
+            top_indices = sorted(np.argsort(scores)[-self.history_window:])
+            turns = [turns[i] for i in top_indices]
+        
+        lines = []
+        for human, assistant in turns:
+            lines.append(f"Human: {human}")
+            lines.append(f"Assistant: {assistant}")
+        return "\n".join(lines)
+    
+    def _prune_memory(self):
+        """ตัด memory ให้เหลือไม่เกิน max_history_turns รอบล่าสุด"""
+        messages = self.memory.chat_memory.messages
+        max_messages = self.max_history_turns * 2
+        
+        if len(messages) > max_messages:
+            self.memory.chat_memory.messages = messages[-max_messages:]
+            
+            # ลบ embedding ของรอบที่ถูกตัดออก
+            remaining = {f"{q}\n{a}" for q, a in self._history_turns()}
+            self._turn_embeddings = {
+                text: vector for text, vector in self._turn_embeddings.items()
+                if text in remaining
+            }
+    
+    def ask_question(self, question: str,
+                     query_embedding: Optional[List[float]] = None) -> Dict[str, Any]:
         """
         ถามคำถามและได้รับคำตอบพร้อมแหล่งข้อมูล
         
         Args:
             question: คำถามภาษาไทย
+            query_embedding: embedding ของคำถาม (ถ้าคำนวณไว้แล้ว เช่นจาก ask_batch)
             
         Returns:
             Dict containing answer, sources, and metadata
@@ -259,7 +1057,7 @@ class ThaiRAGSystem:
             }
         
         try:
-            print(f"🤔 กำลังประมวลผลคำถาม: {question}")
+            logger.debug("🤔 กำลังประมวลผลคำถาม: %s", question)
             
             # ตรวจสอบว่ามี vector store หรือไม่
             if not self.vector_store_manager.vector_store:
@@ -270,203 +1068,130 @@ class ThaiRAGSystem:
                     "timestamp": datetime.now().isoformat()
                 }
             
-            # ค้นหาเอกสารที่เกี่ยวข้อง - เพิ่ม k เป็น 10 สำหรับคำถามเกี่ยวกับรายวิชา
-            relevant_docs = self.vector_store_manager.vector_store.similarity_search(
-                question, 
-                k=10  # เพิ่มเป็น 10 เพื่อดูข้อมูลครบถ้วนสำหรับตาราง
-            )
-            
-            # ตรวจสอบคุณภาพของ context
-            if not relevant_docs:
-                return {
-                    "answer": "ขออภัย ไม่พบข้อมูลที่เกี่ยวข้องในเอกสารที่อัพโหลด",
-                    "sources": [],
-                    "question": question,
-                    "timestamp": datetime.now().isoformat()
-                }
-            
-            # 🎯 กรองเอกสารที่เกี่ยวข้องตามคำถาม (Metadata Filtering)
-            import re
-            
-            # ตรวจจับรหัสวิชาในคำถาม (รองรับทั้ง 05506231 และ 0550 6231)
-            question_course_code = re.search(r'\b(\d{4})\s*(\d{4})\b|\b(\d{8})\b', question)
-            
-            # ตรวจจับชั้นปี/ภาคการศึกษาในคำถาม
-            question_year = re.search(r'ปีที่\s*(\d+)', question)
-            question_semester = re.search(r'ภาคการศึกษาที่\s*(\d+)', question)
-            
-            filtered_docs = []
-            
-            # 🔍 กรองตาม metadata และ content ถ้าพบคำสำคัญในคำถาม
-            for doc in relevant_docs:
-                metadata = doc.metadata
-                content = doc.page_content
-                
-                # ถ้าถามรหัสวิชาเฉพาะ → ต้องมีรหัสนั้นใน content (รองรับทั้งติดกันและมีช่องว่าง)
-                if question_course_code:
-                    # ดึงรหัสจาก regex (group 1+2 หรือ group 3)
-                    if question_course_code.group(3):  # 8 หลักติด
-                        target_code = question_course_code.group(3)
-                    else:  # 4+4 หลักแยก
-                        target_code = question_course_code.group(1) + question_course_code.group(2)
-                    
-                    # ค้นหาในหลายรูปแบบ: "05506231" หรือ "0550 6231" หรือ "0550-6231"
-                    pattern1 = target_code  # ติดกัน
-                    pattern2 = target_code[:4] + r'\s+' + target_code[4:]  # มีช่องว่าง
-                    pattern3 = target_code[:4] + r'\s*-\s*' + target_code[4:]  # มีขีด
-                    
-                    if (target_code in content or 
-                        re.search(pattern2, content) or
-                        re.search(pattern3, content) or
-                        target_code in metadata.get("course_codes", "")):
-                        # พบรหัสวิชา! priority สูงมาก
-                        filtered_docs.insert(0, doc)
-                        print(f"✅ พบรหัสวิชา {target_code} ใน chunk: {content[:100]}")
-                        continue
-                
-                # ถ้าถามปี/ภาค → ค้นหาทั้ง metadata และ content โดยตรง
-                elif question_year or question_semester:
-                    match_score = 0  # คะแนนความตรง
-                    
-                    # ถ้าถามทั้งปีและภาค
-                    if question_year and question_semester:
-                        year_str = question_year.group(1)
-                        semester_str = question_semester.group(1)
-                        
-                        # ตรวจสอบ metadata ก่อน (แม่นยำที่สุด)
-                        meta_year_match = metadata.get("year") == year_str
-                        meta_semester_match = metadata.get("semester") == semester_str
-                        
-                        if meta_year_match and meta_semester_match:
-                            match_score = 100  # สมบูรณ์แบบ!
-                        elif meta_year_match or meta_semester_match:
-                            match_score = 50  # ตรงบางส่วน
-                        
-                        # ถ้า metadata ไม่ตรง → ค้นหาใน content โดยตรง
-                        else:
-                            # ค้นหาว่ามีคำว่า "ปีที่ X ภาคการศึกษาที่ Y" ใน content หรือไม่
-                            year_in_content = re.search(rf'ปีที่\s*{year_str}', content)
-                            semester_in_content = re.search(rf'ภาคการศึกษาที่\s*{semester_str}', content)
-                            
-                            if year_in_content and semester_in_content:
-                                match_score = 80  # เจอใน content ทั้งคู่
-                            elif year_in_content or semester_in_content:
-                                match_score = 40  # เจอใน content บางส่วน
-                        
-                        # ถ้ามีคะแนน → เอามา
-                        if match_score > 0:
-                            # Priority สูงถ้าคะแนนสูง
-                            if match_score >= 80:
-                                filtered_docs.insert(0, doc)
-                                print(f"✅ [คะแนน {match_score}] พบ ปี{year_str} ภาค{semester_str}: {content[:100]}")
-                            else:
-                                filtered_docs.append(doc)
-                                print(f"⚠️ [คะแนน {match_score}] พบบางส่วน ปี{year_str} ภาค{semester_str}")
-                            continue
-                    
-                    # ถ้าถามเฉพาะปี หรือเฉพาะภาค
-                    elif question_year:
-                        year_str = question_year.group(1)
-                        if (metadata.get("year") == year_str or 
-                            re.search(rf'ปีที่\s*{year_str}', content)):
-                            filtered_docs.append(doc)
-                            print(f"✅ พบ ปี{year_str}")
-                            continue
-                    elif question_semester:
-                        semester_str = question_semester.group(1)
-                        if (metadata.get("semester") == semester_str or 
-                            re.search(rf'ภาคการศึกษาที่\s*{semester_str}', content)):
-                            filtered_docs.append(doc)
-                            print(f"✅ พบ ภาค{semester_str}")
-                            continue
-                
-                # ถ้าไม่มีเงื่อนไขพิเศษ → เอาทุก doc
-                else:
-                    filtered_docs.append(doc)
+            query_embedding, cached = self._semantic_lookup(question, query_embedding)
             
-            # ถ้ากรองแล้วไม่เหลือเลย → ใช้ docs เดิม
-            if not filtered_docs:
-                filtered_docs = relevant_docs
-                print(f"⚠️ ไม่พบเอกสารที่ตรงเงื่อนไข ใช้ทั้งหมด {len(relevant_docs)} chunks")
+            if cached is not None:
+                answer, sources = cached[0], list(cached[1])
             else:
-                print(f"✅ กรองแล้วเหลือ {len(filtered_docs)} chunks ที่ตรงเงื่อนไข")
-            
-            # Deduplication
-            unique_docs = []
-            seen_contents = set()
-            for doc in filtered_docs:
-                # ใช้ 100 ตัวอักษรแรกเป็น signature
-                signature = doc.page_content[:100].strip()
-                if signature not in seen_contents:
-                    unique_docs.append(doc)
-                    seen_contents.add(signature)
-            
-            # ใช้ top 2 chunks (ลดเพื่อป้องกัน Ollama ล่ม)
-            num_chunks = 5 if (question_year or question_semester or "อะไรบ้าง" in question or "ทั้งหมด" in question) else 3
-            relevant_docs = unique_docs[:num_chunks]
-            
-            # 🔥 สร้าง context โดยใช้เนื้อหาเต็ม (ไม่ตัด) สำหรับตาราง
-            # gemma2:2b รองรับ ~2048 tokens ≈ 1500-1800 chars
-            context_parts = []
-            total_chars = 0
-            max_context_chars = 2000  # เพิ่มขึ้นสำหรับตารางข้อมูล
-            
-            for doc in relevant_docs:
-                # คำนวณว่ายังใส่ได้อีกเท่าไหร่
-                remaining = max_context_chars - total_chars
+                # โหลดโมเดลไปพร้อมกับการค้นหา (ครั้งแรก/หลังโมเดลถูก unload ไม่ต้องรอโหลดหลังค้นเสร็จ)
+                self._warm_up_llm()
+                relevant_docs = self._retrieve_documents(question, query_embedding)
                 
-                if remaining <= 0:
-                    break
+                if not relevant_docs:
+                    return {
+                        "answer": "ขออภัย ไม่พบข้อมูลที่เกี่ยวข้องในเอกสารที่อัพโหลด",
+                        "sources": [],
+                        "question": question,
+                        "timestamp": datetime.now().isoformat()
+                    }
                 
-                # ใช้เนื้อหาเต็มถ้ายังไม่เกิน limit
-                content = doc.page_content[:remaining]
+                context = self._build_context(relevant_docs)
                 
-                # เพิ่ม metadata hint ถ้ามี
-                metadata_hint = ""
-                if doc.metadata.get("year") and doc.metadata.get("semester"):
-                    metadata_hint = f"[ปีที่ {doc.metadata['year']} ภาคการศึกษาที่ {doc.metadata['semester']}]\n"
+                # เรียก LLM ด้วย prompt ตามประเภทคำถาม พร้อม context และประวัติสนทนาที่เตรียมไว้
+                prompt = self._prompt_for(question).format(
+                    context=context,
+                    chat_history=self._format_chat_history(question),
+                    question=question
+                )
+                prompt_key, answer = self._cached_answer(prompt)
+                if answer is None:
+                    answer = self.llm.invoke(prompt)
+                    self._store_answer(prompt_key, answer)
                 
-                context_parts.append(metadata_hint + content)
-                total_chars += len(metadata_hint) + len(content)
+                # จัดรูปแบบแหล่งข้อมูล
+                sources = self._format_sources(relevant_docs)
+                
+                # ถ้าคำตอบสั้นเกินไปหรือไม่มีเนื้อหา
+                if len(answer.strip()) < 10:
+                    answer = "ขออภัย ไม่สามารถสร้างคำตอบที่มีความหมายจากข้อมูลในเอกสารได้ กรุณาลองถามคำถามใหม่หรือให้รายละเอียดเพิ่มเติม"
+                elif query_embedding is not None and _cacheable_answer(answer):
+                    self._semantic_cache.put(query_embedding, (self._semantic_state(), answer, sources))
             
-            context = "\n\n---\n\n".join(context_parts)
+            # บันทึกลง memory (chain ไม่มี memory ในตัว) แล้วตัดรอบเก่าที่เกิน max_history_turns
+            self.memory.save_context({"question": question}, {"answer": answer})
+            self._prune_memory()
             
-            print(f"� ใช้ context รวม {total_chars} chars จาก {len(context_parts)} chunks")
+            logger.debug("✅ คำตอบ: %.100s...", answer)
             
-            # Debug: แสดง context
-            print(f"📄 Context ที่พบ ({len(context)} chars): {context[:200]}...")
+            return {
+                "answer": answer,
+                "sources": sources,
+                "question": question,
+                "timestamp": datetime.now().isoformat(),
+                "chat_history_length": len(self.memory.chat_memory.messages)
+            }
             
-            # เรียกใช้ RAG Chain ด้วย ConversationalRetrievalChain
-            result = self.rag_chain({
+        except Exception as e:
+            print(f"❌ เกิดข้อผิดพลาดในการตอบคำถาม: {e}")
+            return {
+                "answer": f"ขออภัย เกิดข้อผิดพลาด: {str(e)}",
+                "sources": [],
                 "question": question,
-                "chat_history": self.memory.chat_memory.messages
-            })
+                "timestamp": datetime.now().isoformat()
+            }
+    
+    async def ask_question_async(self, question: str,
+                                 query_embedding: Optional[List[float]] = None) -> Dict[str, Any]:
+        """
+        ask_question แบบ async สำหรับ caller ที่ถามหลายคำถามพร้อมกัน (เช่น asyncio.gather)
+        
+        การค้นหาเอกสาร (embedding/FAISS) ทำใน thread แยก และรอคำตอบจาก LLM ผ่าน ollama.AsyncClient
+        จึงไม่ block event loop - Ollama ต้องตั้ง OLLAMA_NUM_PARALLEL (เช่น 4) ที่ฝั่ง server
+        จึงจะสร้างคำตอบหลายคำถามพร้อมกันได้จริง
+        
+        หมายเหตุ: คำถามที่ถามพร้อมกันใน ThaiRAGSystem เดียวกันใช้ประวัติสนทนา ณ ตอนเริ่มถาม
+        และถูกบันทึกลง memory ตามลำดับที่ตอบเสร็จ
+        
+        Args:
+            question: คำถามภาษาไทย
+            query_embedding: embedding ของคำถาม (ถ้าคำนวณไว้แล้ว เช่นจาก ask_batch_async)
             
-            # จัดรูปแบบแหล่งข้อมูล
-            sources = []
-            seen_sources = set()
-            for doc in relevant_docs:
-                source_info = {
-                    "content": doc.page_content[:300] + "..." if len(doc.page_content) > 300 else doc.page_content,
-                    "metadata": doc.metadata,
-                    "filename": doc.metadata.get("filename", "ไม่ทราบ"),
-                    "chunk_index": doc.metadata.get("chunk_index", 0)
-                }
-                
-                # หลีกเลี่ยงการซ้ำ
-                source_key = f"{source_info['filename']}_{source_info['chunk_index']}"
-                if source_key not in seen_sources:
-                    sources.append(source_info)
-                    seen_sources.add(source_key)
+        Returns:
+            Dict ในรูปแบบเดียวกับ ask_question
+        """
+        if self.rag_chain is None or not self.vector_store_manager.vector_store:
+            # ข้อความแจ้งว่าระบบยังไม่พร้อม (ไม่มีการค้นหา/เรียก LLM)
+            return self.ask_question(question)
+        
+        try:
+            logger.debug("🤔 กำลังประมวลผลคำถาม (async): %s", question)
             
-            # ตรวจสอบคำตอบ
-            answer = result.get("answer", result.get("text", "ไม่สามารถสร้างคำตอบได้"))
+            query_embedding, cached = await asyncio.to_thread(self._semantic_lookup, question, query_embedding)
             
-            # ถ้าคำตอบสั้นเกินไปหรือไม่มีเนื้อหา
-            if len(answer.strip()) < 10:
-                answer = "ขออภัย ไม่สามารถสร้างคำตอบที่มีความหมายจากข้อมูลในเอกสารได้ กรุณาลองถามคำถามใหม่หรือให้รายละเอียดเพิ่มเติม"
+            if cached is not None:
+                answer, sources = cached[0], list(cached[1])
+            else:
+                self._warm_up_llm()
+                relevant_docs = await asyncio.to_thread(self._retrieve_documents, question, query_embedding)
+                
+                if not relevant_docs:
+                    return {
+                        "answer": "ขออภัย ไม่พบข้อมูลที่เกี่ยวข้องในเอกสารที่อัพโหลด",
+                        "sources": [],
+                        "question": question,
+                        "timestamp": datetime.now().isoformat()
+                    }
+                
+                prompt = self._prompt_for(question).format(
+                    context=self._build_context(relevant_docs),
+                    chat_history=await asyncio.to_thread(self._format_chat_history, question),
+                    question=question
+                )
+                prompt_key, answer = self._cached_answer(prompt)
+                if answer is None:
+                    answer = await self.llm.ainvoke(prompt)
+                    self._store_answer(prompt_key, answer)
+                sources = self._format_sources(relevant_docs)
+                
+                # ถ้าคำตอบสั้นเกินไปหรือไม่มีเนื้อหา
+                if len(answer.strip()) < 10:
+                    answer = "ขออภัย ไม่สามารถสร้างคำตอบที่มีความหมายจากข้อมูลในเอกสารได้ กรุณาลองถามคำถามใหม่หรือให้รายละเอียดเพิ่มเติม"
+                elif query_embedding is not None and _cacheable_answer(answer):
+                    self._semantic_cache.put(query_embedding, (self._semantic_state(), answer, sources))
             
-            print(f"✅ คำตอบ: {answer[:100]}...")
+            # บันทึกลง memory เหมือนกับ ask_question
+            self.memory.save_context({"question": question}, {"answer": answer})
+            self._prune_memory()
             
             return {
                 "answer": answer,
@@ -485,33 +1210,206 @@ class ThaiRAGSystem:
                 "timestamp": datetime.now().isoformat()
             }
     
-    def get_chat_history(self) -> List[Dict[str, str]]:
-        """ดึงประวัติการสนทนา"""
-        history = []
-        messages = self.memory.chat_memory.messages
+    def ask_batch(self, questions: List[str]) -> List[Dict[str, Any]]:
+        """
+        ถามหลายคำถามต่อกัน (เช่น ชุดคำถามสำหรับประเมินระบบ)
         
-        for i in range(0, len(messages), 2):
-            if i + 1 < len(messages):
-                human_msg = messages[i]
-                ai_msg = messages[i + 1]
-                
-                history.append({
-                    "question": human_msg.content,
-                    "answer": ai_msg.content,
-                    "timestamp": datetime.now().isoformat()  # อาจจะเก็บ timestamp จริงใน metadata
-                })
+        embed คำถามที่ยังไม่อยู่ใน cache ทั้งหมดในครั้งเดียว แล้วค้นใน FAISS ด้วย vectors ทั้งชุด
+        ในครั้งเดียว (search_by_vectors) จากนั้นตอบทีละคำถามตามลำดับผ่าน ask_question (ประวัติสนทนาต่อเนื่องเหมือนถามทีละข้อ)
+        
+        Args:
+            questions: รายการคำถาม
+            
+        Returns:
+            List[Dict]: ผลลัพธ์แบบเดียวกับ ask_question เรียงตามลำดับคำถาม
+        """
+        embeddings = self._prefetch_retrieval(questions)
+        return [self.ask_question(q, embeddings.get(q)) for q in questions]
+    
+    async def ask_batch_async(self, questions: List[str]) -> List[Dict[str, Any]]:
+        """
+        ถามหลายคำถามพร้อมกัน: ค้นหาเอกสารแบบ batch ครั้งเดียว แล้วรอคำตอบจาก LLM พร้อมกัน
+        ผ่าน ask_question_async (คำถามที่อยู่ใน cache ไม่ต้องเรียก LLM)
+        
+        ต่างจาก ask_batch ตรงที่ทุกคำถามเห็นประวัติสนทนา ณ ตอนเริ่ม (ไม่ต่อเนื่องกันระหว่างคำถามในชุด)
+        
+        Returns:
+            List[Dict]: ผลลัพธ์แบบเดียวกับ ask_question เรียงตามลำดับคำถาม
+        """
+        embeddings = await asyncio.to_thread(self._prefetch_retrieval, questions)
+        return list(await asyncio.gather(
+            *(self.ask_question_async(q, embeddings.get(q)) for q in questions)
+        ))
+    
+    def _prefetch_retrieval(self, questions: List[str]) -> Dict[str, np.ndarray]:
+        """
+        embed คำถามที่ยังไม่อยู่ใน retrieval cache ในครั้งเดียว ค้นใน FAISS ครั้งเดียว แล้วเก็บผลลง cache
+        
+        Returns:
+            Dict: คำถาม → embedding (เฉพาะคำถามที่เพิ่ง embed)
+        """
+        store = self.vector_store_manager
+        embeddings: Dict[str, np.ndarray] = {}
+        if store is not None and store.vector_store is not None:
+            # คำถามซ้ำในชุดเดียวกันหรือที่ค้นไปแล้ว ไม่ต้อง embed อีก
+            pending = [
+                q for q in dict.fromkeys(questions)
+                if self._retrieval_key(q) not in self._retrieval_cache
+            ]
+            if pending:
+                try:
+                    vectors = store.embeddings.embed_documents_np(pending)
+                    with store.lock.read():
+                        candidates = store.search_by_vectors(vectors, k=10)
+                        for q, vector, docs in zip(pending, vectors, candidates):
+                            embeddings[q] = vector
+                            self._retrieval_cache.put(
+                                self._retrieval_key(q), self._search_and_filter(q, vector, docs)
+                            )
+                    logger.debug("⚡ ค้นหาล่วงหน้าแบบ batch %d คำถาม", len(pending))
+                except Exception as e:
+                    # ค้นแยกทีละคำถามใน ask_question แทน
+                    print(f"⚠️ ค้นหาแบบ batch ไม่สำเร็จ: {e}")
+        return embeddings
+    
+    def ask_question_stream(self, question: str) -> Iterator[str]:
+        """
+        ถามคำถามและส่งคำตอบกลับทีละส่วนระหว่างที่ LLM กำลังสร้าง
+        
+        เมื่อ generator ทำงานจบ ผลลัพธ์เต็ม (answer, sources, ...) จะอยู่ใน self.last_result
+        ในรูปแบบเดียวกับ ask_question
+        
+        Args:
+            question: คำถามภาษาไทย
+            
+        Yields:
+            str: ข้อความคำตอบทีละส่วน
+        """
+        self.last_result = {
+            "answer": "ขออภัย ไม่มีเอกสารในระบบ กรุณาอัพโหลดเอกสารก่อน",
+            "sources": [],
+            "question": question,
+            "timestamp": datetime.now().isoformat()
+        }
+        
+        if not self.vector_store_manager.vector_store:
+            yield self.last_result["answer"]
+            return
         
-        return history
+        try:
+            logger.debug("🤔 กำลังประมวลผลคำถาม (stream): %s", question)
+            
+            query_embedding, cached = self._semantic_lookup(question)
+            if cached is not None:
+                answer, sources = cached[0], list(cached[1])
+                yield answer
+                
+                self.memory.save_context({"question": question}, {"answer": answer})
+                self._prune_memory()
+                self.last_result = {
+                    "answer": answer,
+                    "sources": sources,
+                    "question": question,
+                    "timestamp": datetime.now().isoformat(),
+                    "chat_history_length": len(self.memory.chat_memory.messages)
+                }
+                return
+            
+            # โหลดโมเดลไปพร้อมกับการค้นหา (ครั้งแรก/หลังโมเดลถูก unload ไม่ต้องรอโหลดหลังค้นเสร็จ)
+            self._warm_up_llm()
+            relevant_docs = self._retrieve_documents(question, query_embedding)
+            
+            if not relevant_docs:
+                self.last_result["answer"] = "ขออภัย ไม่พบข้อมูลที่เกี่ยวข้องในเอกสารที่อัพโหลด"
+                yield self.last_result["answer"]
+                return
+            
+            prompt = self._prompt_for(question).format(
+                context=self._build_context(relevant_docs),
+                chat_history=self._format_chat_history(question),
+                question=question
+            )
+            
+            prompt_key, answer = self._cached_answer(prompt)
+            
+            if answer is not None:
+                yield answer
+            else:
+                # ตัดบรรทัดซ้ำและจำกัดความยาวแบบเดียวกับ OllamaLLM._call แล้วแสดงทีละบรรทัดที่ผ่านแล้ว
+                # ยังไม่แสดงจนกว่าจะได้อย่างน้อย 10 ตัวอักษร - คำตอบที่สั้นกว่านั้นจะถูกแทนด้วยข้อความแจ้ง
+                # แบบเดียวกับ ask_question (ผู้ใช้จึงเห็นตรงกับที่บันทึกลงประวัติ)
+                accumulator = _AnswerAccumulator()
+                shown_length = 0
+                held = ""
+                tokens = self.llm.stream(prompt)
+                try:
+                    for token in tokens:
+                        done = accumulator.feed(token)
+                        held += accumulator.pop_text()
+                        if held and shown_length + len(held) >= 10:
+                            shown_length += len(held)
+                            yield held
+                            held = ""
+                        if done:
+                            break
+                finally:
+                    tokens.close()
+                
+                # ส่วนที่แสดงไปแล้ว (≥ 10 ตัวอักษร) เป็นส่วนต้นของ result() เสมอ
+                answer = accumulator.result()
+                
+                # ถ้าคำตอบสั้นเกินไปหรือไม่มีเนื้อหา (ยังไม่ได้แสดงอะไรไป)
+                if len(answer.strip()) < 10:
+                    answer = "ขออภัย ไม่สามารถสร้างคำตอบที่มีความหมายจากข้อมูลในเอกสารได้ กรุณาลองถามคำถามใหม่หรือให้รายละเอียดเพิ่มเติม"
+                else:
+                    self._store_answer(prompt_key, answer)
+                if len(answer) > shown_length:
+                    yield answer[shown_length:]
+            
+            sources = self._format_sources(relevant_docs)
+            if query_embedding is not None and _cacheable_answer(answer):
+                self._semantic_cache.put(query_embedding, (self._semantic_state(), answer, sources))
+            
+            # บันทึกลง memory เหมือนกับ ask_question
+            self.memory.save_context({"question": question}, {"answer": answer})
+            self._prune_memory()
+            
+            self.last_result = {
+                "answer": answer,
+                "sources": sources,
+                "question": question,
+                "timestamp": datetime.now().isoformat(),
+                "chat_history_length": len(self.memory.chat_memory.messages)
+            }
+            
+        except Exception as e:
+            print(f"❌ เกิดข้อผิดพลาดในการตอบคำถาม: {e}")
+            self.last_result["answer"] = f"ขออภัย เกิดข้อผิดพลาด: {str(e)}"
+            yield self.last_result["answer"]
+    
+    def get_chat_history(self) -> List[Dict[str, str]]:
+        """ดึงประวัติการสนทนา"""
+        timestamp = datetime.now().isoformat()  # อาจจะเก็บ timestamp จริงใน metadata
+        return [
+            {"question": question, "answer": answer, "timestamp": timestamp}
+            for question, answer in self._history_turns()
+        ]
     
     def clear_chat_history(self):
         """ล้างประวัติการสนทนา"""
         self.memory.clear()
+        self._turn_embeddings = {}
         print("✅ ล้างประวัติการสนทนาเสร็จสิ้น")
     
     def update_vector_store(self, vector_store_manager):
         """อัพเดท vector store และ RAG chain"""
         self.vector_store_manager = vector_store_manager
         self._setup_rag_chain()
+        
+        # เอกสารเปลี่ยน → ผลค้นหาและคำตอบเดิมใช้ไม่ได้แล้ว
+        self._retrieval_cache.clear()
+        self._answer_cache.clear()
+        self._semantic_cache.clear()
         print("✅ อัพเดท vector store เสร็จสิ้น")
     
     def get_system_stats(self) -> Dict[str, Any]:
@@ -523,20 +1421,12 @@ class ThaiRAGSystem:
             "llm_model": self.llm.model_name,
             "chat_history_length": len(self.memory.chat_memory.messages) // 2,
             "rag_chain_ready": self.rag_chain is not None,
+            "retrieval_cache": self._retrieval_cache.stats(),
+            "answer_cache": self._answer_cache.stats(),
             "timestamp": datetime.now().isoformat()
         }
 
 
-# โมเดล LLM ที่แนะนำสำหรับภาษาไทย
-RECOMMENDED_THAI_LLM_MODELS = {
-    "small_fast": "gemma2:2b",        # เล็ก, เร็ว, RAM น้อย (4GB) - แนะนำสำหรับเริ่มต้น
-    "balanced": "llama3.1:8b",        # สมดุล, RAM ปานกลาง (8GB)
-    "gemma2":"latest",
-    "large": "llama3.1:70b"         # ใหญ่, คุณภาพสูง (80GB)
-    
-}
-
-
 # ตัวอย่างการใช้งาน
 if __name__ == "__main__":
     # นำเข้าโมดูลที่จำเป็น
@@ -578,9 +1468,8 @@ if __name__ == "__main__":
     print("🤖 เริ่มทดสอบ RAG System")
     print("=" * 50)
     
-    for question in questions:
-        result = rag_system.ask_question(question)
-        
+    # ค้นหาเอกสารของทุกคำถามแบบ batch แล้วตอบตามลำดับ (คำถามสุดท้ายอ้างถึงคำตอบก่อนหน้า)
+    for result in rag_system.ask_batch(questions):
         print(f"\n❓ คำถาม: {result['question']}")
         print(f"🤖 คำตอบ: {result['answer']}")
         print(f"📚 จำนวนแหล่งข้อมูล: {len(result['sources'])}")
@@ -0,0 +1,28 @@
+"""
+Recommended Models for Thai RAG Chatbot
+รายชื่อโมเดลที่แนะนำ (แยกออกมาเพื่อให้ import ได้โดยไม่ต้องโหลด torch/langchain)
+"""
+
+# โมเดล embedding ที่แนะนำสำหรับภาษาไทย
+RECOMMENDED_THAI_MODELS = {
+    "fast": "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+    "balanced": "sentence-transformers/distiluse-base-multilingual-cased", 
+    "best": "sentence-transformers/paraphrase-multilingual-mpnet-base-v2",
+    "thai_specific": "airesearch/wangchanberta-base-att-spm-uncased"  # ถ้ามี
+}
+
+
+# โมเดล LLM ที่แนะนำสำหรับภาษาไทย
+# tag มาตรฐานของ Ollama (เช่น gemma2:2b, llama3.1:8b) เป็นโมเดล quantize 4-bit (Q4) อยู่แล้ว
+# ขนาด RAM ด้านล่างจึงเป็นของรุ่น Q4 - ถ้า RAM พอและต้องการคุณภาพสูงขึ้นใช้ tag -q8_0 แทนได้
+RECOMMENDED_THAI_LLM_MODELS = {
+    "small_fast": "gemma2:2b",        # เล็ก, เร็ว, RAM น้อย (4GB) - แนะนำสำหรับเริ่มต้น
+    "balanced": "llama3.1:8b",        # สมดุล, RAM ปานกลาง (8GB)
+    "gemma2":"latest",
+    "large": "llama3.1:70b"         # ใหญ่, คุณภาพสูง (80GB)
+    
+}
+
+
+# backend สำหรับรันโมเดล embedding (ใช้ใน sidebar และ LocalThaiEmbeddings)
+EMBEDDING_BACKENDS = ("auto", "cuda-fp16", "cpu-int8", "cpu-fp32")
@@ -4,18 +4,97 @@ Vector Store Manager for Thai RAG Chatbot
 """
 
 import os
+import json
 import pickle
-from typing import List, Dict, Any, Optional, Tuple
+import hashlib
+import re
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple, Set, Iterable
 from pathlib import Path
 
 import numpy as np
 import faiss
+import torch
 from sentence_transformers import SentenceTransformer
 
 from langchain.schema import Document
 from langchain.vectorstores import FAISS
+from langchain.vectorstores.utils import DistanceStrategy
+from langchain.docstore.in_memory import InMemoryDocstore
 from langchain.embeddings.base import Embeddings
 
+# โมเดล embedding ที่แนะนำสำหรับภาษาไทย
+from recommended_models import RECOMMENDED_THAI_MODELS, EMBEDDING_BACKENDS
+
+
+# โฟลเดอร์เก็บโมเดล ONNX ที่ quantize แล้ว (สร้างครั้งแรกแล้วใช้ซ้ำ)
+ONNX_CACHE_DIR = Path("./models/onnx")
+ONNX_INT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+# cache ของ TensorRT engine (build ครั้งแรกใช้เวลานาน)
+TRT_CACHE_DIR = Path("./models/trt")
+
+# รหัสวิชา 8 หลัก ทั้งแบบติดกันและแยกด้วยช่องว่าง/ขีด (05506231, 0550 6231, 0550-6231)
+_RE_COURSE_CODE = re.compile(r'\b(\d{4})\s*(?:-\s*)?(\d{4})\b')
+
+
+class _ReadWriteLock:
+    """
+    lock ที่ให้ค้นหา (อ่าน) พร้อมกันได้หลาย thread แต่แก้ไข index (เขียน) ได้ทีละ thread
+    
+    - ผู้เขียนที่รออยู่ได้ก่อนผู้อ่านรายใหม่ (ค้นหาต่อเนื่องไม่ทำให้การเพิ่มเอกสารรอไม่จบ)
+    - thread ที่ถือ lock อยู่แล้ว (อ่านหรือเขียน) อ่านซ้อนได้ทันที
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer: Optional[int] = None
+        self._writers_waiting = 0
+        self._local = threading.local()
+    
+    @contextmanager
+    def read(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth or self._writer == threading.get_ident():
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+        
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer is not None or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = threading.get_ident()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = None
+                self._cond.notify_all()
+
 
 class LocalThaiEmbeddings(Embeddings):
     """
@@ -23,7 +102,10 @@ class LocalThaiEmbeddings(Embeddings):
     ใช้ Sentence Transformers models ที่รองรับภาษาไทย
     """
     
-    def __init__(self, model_name: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"):
+    def __init__(self, 
+                 model_name: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+                 batch_size: int = 128,
+                 backend: str = "auto"):
         """
         Args:
             model_name: ชื่อโมเดล embedding ที่จะใช้
@@ -31,12 +113,30 @@ class LocalThaiEmbeddings(Embeddings):
                        - paraphrase-multilingual-MiniLM-L12-v2 (เร็ว, รองรับหลายภาษา)
                        - distiluse-base-multilingual-cased (ดี, รองรับหลายภาษา)
                        - paraphrase-multilingual-mpnet-base-v2 (ดีที่สุด, ช้าหน่อย)
+            batch_size: จำนวนข้อความต่อ batch ตอนสร้าง embeddings
+            backend: วิธีรันโมเดล
+                     - auto: GPU → FP16, CPU → ONNX INT8
+                     - cuda-fp16: ONNX Runtime TensorRT (FP16) / CUDA provider บน GPU
+                                  ถ้าไม่มี ORT-GPU จะใช้ PyTorch FP16
+                     - cpu-int8: ONNX Runtime + dynamic INT8 quantization
+                     - cpu-fp32: PyTorch FP32 (แบบเดิม)
         """
         self.model_name = model_name
-        print(f"🔄 กำลังโหลดโมเดล embedding: {model_name}")
+        self.batch_size = batch_size
+        
+        # embedding ของคำถามที่เคยถาม (คำถามซ้ำ/กดถามใหม่ ไม่ต้องผ่านโมเดลอีก) - ผูกกับ instance
+        # เพราะผลขึ้นกับโมเดลที่โหลด; chunks เอกสารไม่ต้อง cache เพราะ add_documents ข้าม chunk ซ้ำตาม hash แล้ว
+        self._encode_query_cached = lru_cache(maxsize=1024)(self._encode_query)
+        
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"ไม่รองรับ embedding backend: {backend}")
+        if backend == "auto":
+            backend = "cuda-fp16" if torch.cuda.is_available() else "cpu-int8"
+        self.backend = backend
+        print(f"🔄 กำลังโหลดโมเดล embedding: {model_name} ({backend})")
         
         try:
-            self.model = SentenceTransformer(model_name)
+            self.model = self._load_model(model_name)
             print(f"✅ โหลดโมเดล {model_name} สำเร็จ")
         except Exception as e:
             print(f"❌ ไม่สามารถโหลดโมเดล {model_name}: {e}")
@@ -45,24 +145,142 @@ class LocalThaiEmbeddings(Embeddings):
             print(f"🔄 กำลังลองใช้โมเดลสำรอง: {backup_model}")
             self.model = SentenceTransformer(backup_model)
             self.model_name = backup_model
+            self.backend = "cpu-fp32"
+    
+    def _load_model(self, model_name: str) -> SentenceTransformer:
+        """โหลดโมเดลตาม backend (ถ้าโหลดแบบเร่งความเร็วไม่ได้ จะใช้ FP32 แทน)"""
+        try:
+            if self.backend == "cuda-fp16":
+                try:
+                    return self._load_onnx_gpu_model(model_name)
+                except Exception as e:
+                    print(f"⚠️ ใช้ ONNX Runtime GPU ไม่ได้ ({e}) - ใช้ PyTorch FP16 แทน")
+                    return SentenceTransformer(
+                        model_name,
+                        device="cuda",
+                        model_kwargs={"torch_dtype": torch.float16}
+                    )
+            if self.backend == "cpu-int8":
+                return self._load_int8_onnx_model(model_name)
+        except Exception as e:
+            print(f"⚠️ ใช้ backend {self.backend} ไม่ได้ ({e}) - ใช้ PyTorch FP32 แทน")
+            self.backend = "cpu-fp32"
+        
+        return SentenceTransformer(model_name)
+    
+    def _load_onnx_gpu_model(self, model_name: str) -> SentenceTransformer:
+        """โหลดโมเดล ONNX บน GPU (TensorRT FP16 ถ้ามี ไม่งั้นใช้ CUDA provider)"""
+        import onnxruntime as ort
+        
+        available_providers = ort.get_available_providers()
+        
+        if "TensorrtExecutionProvider" in available_providers:
+            provider = "TensorrtExecutionProvider"
+            provider_options = {
+                "trt_fp16_enable": True,
+                "trt_engine_cache_enable": True,
+                "trt_engine_cache_path": str(TRT_CACHE_DIR)
+            }
+        elif "CUDAExecutionProvider" in available_providers:
+            provider = "CUDAExecutionProvider"
+            provider_options = {}
+        else:
+            raise RuntimeError(f"ไม่พบ GPU provider ใน ONNX Runtime ({available_providers})")
+        
+        return SentenceTransformer(
+            model_name,
+            backend="onnx",
+            device="cuda",
+            model_kwargs={"provider": provider, "provider_options": provider_options}
+        )
+    
+    def _load_int8_onnx_model(self, model_name: str) -> SentenceTransformer:
+        """โหลดโมเดล ONNX INT8 จาก cache บนดิสก์ (export + quantize ครั้งแรกถ้ายังไม่มี)"""
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        
+        cache_dir = ONNX_CACHE_DIR / model_name.replace("/", "__")
+        
+        if not (cache_dir / ONNX_INT8_FILE).exists():
+            print(f"🔄 กำลัง export และ quantize {model_name} เป็น ONNX INT8 (ครั้งแรกเท่านั้น)")
+            onnx_model = SentenceTransformer(model_name, backend="onnx")
+            onnx_model.save(str(cache_dir))
+            export_dynamic_quantized_onnx_model(onnx_model, "avx512_vnni", str(cache_dir))
+        
+        return SentenceTransformer(
+            str(cache_dir),
+            backend="onnx",
+            model_kwargs={"file_name": ONNX_INT8_FILE}
+        )
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """สร้าง embeddings สำหรับรายการข้อความ"""
+        return self.embed_documents_np(texts).tolist()
+    
+    def embed_documents_np(self, texts: List[str]) -> np.ndarray:
+        """
+        สร้าง embeddings เป็น numpy array float32 ขนาด (len(texts), dim)
+        
+        สำหรับผู้เรียกที่ใช้ต่อกับ FAISS/numpy โดยตรง (ไม่ต้องแปลงเป็น list ของ float แล้วแปลงกลับ)
+        """
         try:
-            embeddings = self.model.encode(texts, convert_to_tensor=False)
-            return embeddings.tolist()
+            if self.model.backend != "torch" or self.model.tokenizer.padding_side != "right":
+                # ONNX backend: ให้ SentenceTransformer จัดการ batch เอง
+                embeddings = self.model.encode(
+                    texts,
+                    batch_size=self.batch_size,
+                    show_progress_bar=False,
+                    convert_to_numpy=True
+                )
+            else:
+                embeddings = self._encode_pretokenized(texts)
+            return np.asarray(embeddings, dtype=np.float32)
         except Exception as e:
             print(f"❌ ไม่สามารถสร้าง embeddings: {e}")
             raise
     
+    def _encode_pretokenized(self, texts: List[str]) -> np.ndarray:
+        """
+        tokenize ทุกข้อความในครั้งเดียว แล้วส่งเข้าโมเดลทีละ batch
+        
+        ข้อความถูกเรียงตามจำนวน token ก่อนแบ่ง batch (batch หนึ่งมีความยาวใกล้เคียงกัน)
+        แต่ละ batch ถูกตัด padding เหลือแค่ความยาวสูงสุดของ batch นั้น และผ่าน
+        modules ของ SentenceTransformer ตามปกติ (pooling/dense/normalize ของแต่ละโมเดล)
+        ผลลัพธ์คืนในลำดับเดิมของ texts
+        """
+        features = self.model.tokenize(texts)
+        lengths = features["attention_mask"].sum(dim=1)
+        order = torch.argsort(lengths, descending=True)
+        device = self.model.device
+        
+        outputs = []
+        with torch.inference_mode():
+            for start in range(0, len(texts), self.batch_size):
+                batch_idx = order[start:start + self.batch_size]
+                max_len = int(lengths[batch_idx].max())
+                batch = {
+                    key: (value[batch_idx, :max_len] if value.dim() == 2 else value[batch_idx]).to(device)
+                    for key, value in features.items()
+                }
+                # upcast เป็น fp32 ก่อนส่งต่อ (กรณีโมเดลรัน FP16)
+                outputs.append(self.model(batch)["sentence_embedding"].float().cpu())
+        
+        # คืนลำดับเดิม
+        embeddings = torch.empty((len(texts), outputs[0].shape[1]), dtype=torch.float32)
+        embeddings[order] = torch.cat(outputs)
+        return embeddings.numpy()
+    
     def embed_query(self, text: str) -> List[float]:
         """สร้าง embedding สำหรับคำถาม"""
         try:
-            embedding = self.model.encode([text], convert_to_tensor=False)
-            return embedding[0].tolist()
+            return list(self._encode_query_cached(text))
         except Exception as e:
             print(f"❌ ไม่สามารถสร้าง embedding สำหรับคำถาม: {e}")
             raise
+    
+    def _encode_query(self, text: str) -> Tuple[float, ...]:
+        """encode คำถามหนึ่งข้อความ (คืน tuple เพื่อให้ค่าที่ cache ไว้ถูกแก้ไขไม่ได้)"""
+        embedding = self.model.encode([text], show_progress_bar=False, convert_to_numpy=True)
+        return tuple(embedding[0].tolist())
 
 
 class ThaiVectorStoreManager:
@@ -70,65 +288,246 @@ class ThaiVectorStoreManager:
     
     def __init__(self, 
                  embedding_model: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-                 vector_store_path: str = "./vectorstore"):
+                 vector_store_path: str = "./vectorstore",
+                 embed_batch_size: int = 128,
+                 embedding_backend: str = "auto",
+                 insert_batch_size: int = 3000,
+                 faiss_threads: Optional[int] = None):
         """
         Args:
             embedding_model: ชื่อโมเดล embedding
             vector_store_path: เส้นทางเก็บ vector store
+            embed_batch_size: จำนวนข้อความต่อ batch ตอนสร้าง embeddings
+            embedding_backend: วิธีรันโมเดล embedding (auto, cuda-fp16, cpu-int8, cpu-fp32)
+            insert_batch_size: จำนวนเอกสารต่อรอบที่ embed แล้วเพิ่มลง FAISS (จำกัด RAM สูงสุด)
+            faiss_threads: จำนวน OpenMP threads ของ FAISS (None = ครึ่งหนึ่งของ CPU cores
+                           ที่เหลือไว้ให้โมเดล embedding ไม่แย่ง core กัน; ตั้งค่าทั้ง process)
         """
         self.embedding_model_name = embedding_model
+        self.insert_batch_size = insert_batch_size
         self.vector_store_path = Path(vector_store_path)
         self.vector_store_path.mkdir(exist_ok=True)
         
+        if faiss_threads is None:
+            faiss_threads = max(1, (os.cpu_count() or 2) // 2)
+        faiss.omp_set_num_threads(faiss_threads)
+        
         # สร้าง embedding model
-        self.embeddings = LocalThaiEmbeddings(embedding_model)
+        self.embeddings = LocalThaiEmbeddings(
+            embedding_model,
+            batch_size=embed_batch_size,
+            backend=embedding_backend
+        )
+        
+        # ค้นหาพร้อมกันได้หลาย session (lock.read) แต่ห้ามค้นระหว่างที่ index/docstore/documents
+        # กำลังถูกแก้ไข (lock.write) - index ถูกแชร์ข้าม session และ LangChain ไม่มี lock ในตัว
+        self.lock = _ReadWriteLock()
         
         # Vector store
         self.vector_store: Optional[FAISS] = None
         self.documents: List[Document] = []
         
-        # Metadata สำหรับการจัดการ
-        self.metadata_path = self.vector_store_path / "metadata.pkl"
+        # hash ของเนื้อหาที่อยู่ใน vector store แล้ว (กันการ embed chunk ซ้ำ)
+        self.content_hashes: Set[str] = set()
+        
+        # hash ของไฟล์ที่เคยนำเข้าแล้ว (ข้ามไฟล์ที่อัพโหลดซ้ำได้ตั้งแต่ก่อนอ่านไฟล์)
+        self.file_hashes: Set[str] = set()
+        
+        # รหัสวิชา → ตำแหน่งของ chunks ใน self.documents ที่มีรหัสนั้น (ไม่บันทึกลงดิสก์ สร้างใหม่ตอนโหลด)
+        self.course_code_index: Dict[str, List[int]] = {}
+        
+        # จำนวน vector ตอนสร้าง ANN index ครั้งล่าสุด (ใช้ตัดสินว่าต้องสร้างใหม่เมื่อ store โตขึ้น)
+        self._ann_built_vectors = 0
+        
+        # ไฟล์ที่บันทึก: FAISS index + เอกสารแบบ JSON Lines + metadata แบบ JSON (ไม่มี pickle)
         self.faiss_index_path = self.vector_store_path / "index.faiss"
+        self.documents_path = self.vector_store_path / "documents.jsonl"
+        self.metadata_json_path = self.vector_store_path / "metadata.json"
+        
+        # รูปแบบเก่า (pickle) - ยังโหลดได้ และถูกแทนด้วยรูปแบบใหม่เมื่อบันทึกครั้งถัดไป
+        self.metadata_path = self.vector_store_path / "metadata.pkl"
         self.faiss_pkl_path = self.vector_store_path / "index.pkl"
     
-    def add_documents(self, documents: List[Document]) -> None:
-        """เพิ่มเอกสารลงใน vector store"""
+    @staticmethod
+    def _content_hash(content: str) -> str:
+        """hash ของเนื้อหา chunk (คงที่ข้าม process จึงบันทึกลงดิสก์ได้)"""
+        return hashlib.sha1(content.strip().encode("utf-8")).hexdigest()
+    
+    def _index_course_codes(self, start: int = 0) -> None:
+        """เพิ่ม chunks ตั้งแต่ตำแหน่ง start ของ self.documents ลงใน course_code_index"""
+        for i in range(start, len(self.documents)):
+            codes = {a + b for a, b in _RE_COURSE_CODE.findall(self.documents[i].page_content)}
+            for code in codes:
+                self.course_code_index.setdefault(code, []).append(i)
+    
+    def find_by_course_code(self, course_code: str) -> List[Document]:
+        """chunks ที่มีรหัสวิชานี้ (รหัส 8 หลักแบบติดกัน) เรียงตามลำดับที่นำเข้า"""
+        with self.lock.read():
+            return [self.documents[i] for i in self.course_code_index.get(course_code, ())]
+    
+    def add_documents(self, documents: List[Document], file_hashes: Optional[Iterable[str]] = None) -> int:
+        """
+        เพิ่มเอกสารลงใน vector store
+        
+        Args:
+            documents: chunks ที่จะเพิ่ม
+            file_hashes: hash ของไฟล์ต้นทาง (บันทึกไว้ว่านำเข้าแล้ว เมื่อเพิ่มสำเร็จ)
+        
+        Returns:
+            int: จำนวนเอกสารที่เพิ่มจริง (ไม่นับ chunk ที่ซ้ำกับที่มีอยู่แล้ว)
+        """
         if not documents:
             print("⚠️ ไม่มีเอกสารที่จะเพิ่ม")
-            return
+            return 0
         
         print(f"🔄 กำลังเพิ่ม {len(documents)} เอกสารลงใน vector store...")
         
-        # กรองเอกสารที่ซ้ำกันออก (deduplication ก่อน embed)
+        # กรองเอกสารที่ซ้ำกันออก ทั้งใน batch นี้และที่อยู่ใน vector store แล้ว (deduplication ก่อน embed)
+        # สรุปจำนวนที่ข้ามครั้งเดียวด้านล่าง (ไม่ print ทีละ chunk - นำเข้าไฟล์ซ้ำจะมีเป็นพันบรรทัด)
+        # hash ใหม่เก็บแยกไว้ก่อน แล้วรวมเข้า self.content_hashes หลังเพิ่มลง index สำเร็จเท่านั้น
+        # (ถ้า embed/เพิ่มล้มเหลว chunk เหล่านั้นต้องเพิ่มใหม่ได้ในครั้งถัดไป ไม่ถูกข้ามว่าซ้ำ)
         unique_docs = []
-        seen_contents = set()
+        new_hashes = []
+        content_hashes = self.content_hashes
+        batch_hashes = set()
         
         for doc in documents:
             # ใช้ content ทั้งหมดเป็น signature
-            content_hash = hash(doc.page_content.strip())
-            if content_hash not in seen_contents:
+            content_hash = self._content_hash(doc.page_content)
+            if content_hash not in content_hashes and content_hash not in batch_hashes:
                 unique_docs.append(doc)
-                seen_contents.add(content_hash)
-            else:
-                print(f"  ⏭️ ข้าม chunk ที่ซ้ำ (hash: {content_hash})")
+                new_hashes.append(content_hash)
+                batch_hashes.add(content_hash)
         
         print(f"  ✂️ กรองแล้ว: {len(documents)} → {len(unique_docs)} เอกสาร (ลบซ้ำ {len(documents) - len(unique_docs)} ชิ้น)")
         
         if not unique_docs:
             print("⚠️ ไม่มีเอกสารใหม่หลังกรอง")
-            return
+            self.file_hashes.update(file_hashes or ())
+            return 0
         
+        # embed และเพิ่มทีละ insert_batch_size เอกสาร (ไม่ต้องถือ embeddings ของทั้งชุดไว้ใน RAM พร้อมกัน)
+        for start in range(0, len(unique_docs), self.insert_batch_size):
+            end = start + self.insert_batch_size
+            batch = unique_docs[start:end]
+            texts = [doc.page_content for doc in batch]
+            metadatas = [doc.metadata for doc in batch]
+            
+            # embed เป็น numpy array แล้วส่งให้ FAISS โดยตรง (from_documents/add_documents เรียก
+            # embed_documents ซึ่งแปลงทุกค่าเป็น Python float ก่อนถูกแปลงกลับเป็น array อีกรอบ)
+            # embed นอก lock (ใช้เวลานาน) - การค้นหารอเฉพาะช่วงที่เพิ่มลง index/docstore ด้านล่าง
+            text_embeddings = list(zip(texts, self.embeddings.embed_documents_np(texts)))
+            
+            with self.lock.write():
+                if self.vector_store is None:
+                    # สร้าง vector store ใหม่ - normalize vectors แล้วค้นด้วย inner product (= cosine similarity)
+                    # (vector store ที่มีอยู่แล้วใช้ metric เดิมของมันต่อ)
+                    self.vector_store = FAISS.from_embeddings(
+                        text_embeddings,
+                        self.embeddings,
+                        metadatas=metadatas,
+                        normalize_L2=True,
+                        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+                    )
+                else:
+                    # เพิ่มเอกสารลงใน vector store ที่มีอยู่
+                    self.vector_store.add_embeddings(text_embeddings, metadatas=metadatas)
+                
+                # ใช้ Document ชุดเดียวกับใน docstore ของ FAISS (LangChain สร้าง Document และ metadata dict
+                # ใหม่ตอนเพิ่ม - ถ้าเก็บ batch ไว้ด้วยจะมีทุก chunk สองชุดใน RAM)
+                store = self.vector_store
+                first_new = len(self.documents)
+                positions = range(first_new, len(store.index_to_docstore_id))
+                self.documents.extend([store.docstore.search(store.index_to_docstore_id[i]) for i in positions])
+                self._index_course_codes(first_new)
+                content_hashes.update(new_hashes[start:end])
+        
+        self.file_hashes.update(file_hashes or ())
+        
+        print(f"✅ เพิ่มเอกสารเสร็จสิ้น รวม {len(self.documents)} เอกสาร")
+        
+        return len(unique_docs)
+    
+    def build_ann_index(self, 
+                        hnsw_m: int = 32,
+                        pq_m: int = 16,
+                        pq_nbits: int = 8,
+                        ivfpq_min_vectors: int = 50000,
+                        hnsw_sq8: bool = True,
+                        sq8_min_vectors: int = 20000,
+                        hnsw_ef_search: int = 64,
+                        rebuild_growth: float = 2.0) -> None:
+        """
+        แปลง flat index เป็น ANN index หลังเพิ่มเอกสารชุดใหญ่ (ค้นหาเร็วกว่า brute force)
+        
+        - เอกสารน้อยกว่า sq8_min_vectors → HNSW เก็บ vector fp32 เต็ม (IndexHNSWFlat)
+        - เอกสารน้อยกว่า ivfpq_min_vectors → HNSW เก็บ vector แบบ 8-bit scalar quantizer
+          (IndexHNSWSQ: 1 byte/มิติ แทน 4, recall ลดลงเล็กน้อย) ถ้า hnsw_sq8=True
+        - เอกสารมาก → IndexIVFPQ (บีบอัด vector ด้วย PQ ประหยัด RAM)
+        
+        ช่วงค่าของ SQ8 train จาก vector ที่มีตอนสร้าง - เมื่อ index HNSW โตขึ้น rebuild_growth เท่า
+        จากครั้งที่สร้างล่าสุด จะสร้าง (และ train) ใหม่จาก vector ทั้งหมด และเปลี่ยนชนิด index
+        ตามจำนวนใหม่ด้วย (IVF-PQ ไม่สร้างใหม่ เพราะ vector ที่ถอดจาก PQ คลาดเคลื่อนมากเกินไป)
+        
+        ลำดับ vector เหมือนเดิม จึงใช้ docstore mapping ของ LangChain ต่อได้เลย
+        และ index ทุกแบบรองรับการ add เพิ่มภายหลัง
+        
+        Args:
+            hnsw_m: จำนวน neighbors ต่อ node ของ HNSW
+            pq_m: จำนวน sub-quantizers ของ PQ (ต้องหาร dimension ลงตัว)
+            pq_nbits: จำนวนบิตต่อ sub-quantizer
+            ivfpq_min_vectors: จำนวน vector ขั้นต่ำที่จะใช้ IVF-PQ
+            hnsw_sq8: เก็บ vector ของ HNSW แบบ 8-bit (ลด RAM และข้อมูลที่อ่านต่อการค้นหา 4 เท่า)
+            sq8_min_vectors: จำนวน vector ขั้นต่ำที่จะใช้ SQ8 (น้อยกว่านี้ใช้ fp32 - ประหยัดได้ไม่มาก
+                             และช่วงค่าที่ train จากตัวอย่างน้อยๆ มักไม่ครอบคลุมเอกสารที่เพิ่มภายหลัง)
+            hnsw_ef_search: ขนาด candidate list ตอนค้น HNSW (มาก = recall สูงขึ้นแต่ช้าลง)
+            rebuild_growth: สร้าง index HNSW ใหม่เมื่อจำนวน vector โตขึ้นกี่เท่าจากครั้งล่าสุด
+        """
         if self.vector_store is None:
-            # สร้าง vector store ใหม่
-            self.vector_store = FAISS.from_documents(unique_docs, self.embeddings)
-            self.documents = unique_docs.copy()
+            return
+        
+        index = self.vector_store.index
+        if index.ntotal == 0:
+            return
+        
+        # flat index → สร้างครั้งแรก; HNSW ที่โตขึ้นมาก → สร้างใหม่; นอกนั้นไม่ต้องทำซ้ำ
+        if isinstance(index, faiss.IndexHNSW):
+            if index.ntotal < rebuild_growth * max(self._ann_built_vectors, 1):
+                return
+        elif not isinstance(index, faiss.IndexFlat):
+            return
+        
+        with self.lock.read():
+            n_vectors, dim = index.ntotal, index.d
+            vectors = index.reconstruct_n(0, n_vectors)  # SQ8 → ค่าที่ถอดกลับ (ใกล้เคียงค่าเดิม)
+        metric = index.metric_type  # คง metric เดิม (L2 หรือ inner product)
+        
+        if n_vectors >= ivfpq_min_vectors and dim % pq_m == 0:
+            nlist = int(np.sqrt(n_vectors))
+            quantizer = faiss.IndexFlat(dim, metric)
+            ann_index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits, metric)
+            ann_index.train(vectors)
+            ann_index.nprobe = min(16, nlist)
+            index_type = f"IVF-PQ (nlist={nlist}, m={pq_m})"
+        elif hnsw_sq8 and n_vectors >= sq8_min_vectors:
+            ann_index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, hnsw_m, metric)
+            ann_index.train(vectors)  # หาช่วงค่าของแต่ละมิติสำหรับ quantize
+            ann_index.hnsw.efSearch = hnsw_ef_search
+            index_type = f"HNSW-SQ8 (M={hnsw_m})"
         else:
-            # เพิ่มเอกสารลงใน vector store ที่มีอยู่
-            self.vector_store.add_documents(unique_docs)
-            self.documents.extend(unique_docs)
+            ann_index = faiss.IndexHNSWFlat(dim, hnsw_m, metric)
+            ann_index.hnsw.efSearch = hnsw_ef_search
+            index_type = f"HNSW (M={hnsw_m})"
         
-        print(f"✅ เพิ่มเอกสารเสร็จสิ้น รวม {len(self.documents)} เอกสาร")
+        ann_index.add(vectors)
+        with self.lock.write():
+            # มีการเพิ่ม/แทนที่ index ระหว่างสร้าง → ไม่สลับ (vector ใหม่จะหายไป) รอรอบถัดไป
+            if self.vector_store is None or self.vector_store.index is not index or index.ntotal != n_vectors:
+                return
+            self.vector_store.index = ann_index
+            self._ann_built_vectors = n_vectors
+        
+        print(f"✅ สร้าง ANN index แบบ {index_type} จาก {n_vectors} vectors")
     
     def save_vector_store(self) -> None:
         """บันทึก vector store ลงดิสก์"""
@@ -136,81 +535,190 @@ class ThaiVectorStoreManager:
             print("⚠️ ไม่มี vector store ที่จะบันทึก")
             return
         
-        try:
-            print("🔄 กำลังบันทึก vector store...")
-            
-            # บันทึก FAISS index
-            self.vector_store.save_local(str(self.vector_store_path))
-            
-            # บันทึก metadata
-            metadata = {
-                "embedding_model": self.embedding_model_name,
-                "total_documents": len(self.documents),
-                "documents": self.documents
-            }
-            
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump(metadata, f)
-            
-            print(f"✅ บันทึก vector store เสร็จสิ้น ที่ {self.vector_store_path}")
+        # อ่าน index/docstore ระหว่างบันทึก - ค้นหาพร้อมกันได้ แต่ห้ามแก้ไขจนกว่าจะบันทึกเสร็จ
+        with self.lock.read():
+            try:
+                print("🔄 กำลังบันทึก vector store...")
+                store = self.vector_store
+                
+                # บันทึก FAISS index (vectors) อย่างเดียว - docstore ของ LangChain บันทึกเป็น JSON Lines แทน pickle
+                faiss.write_index(store.index, str(self.faiss_index_path))
+                
+                # เอกสารเรียงตามตำแหน่งใน index: หนึ่งบรรทัดต่อหนึ่ง chunk พร้อม id ใน docstore
+                with open(self.documents_path, 'w', encoding='utf-8') as f:
+                    for position in range(len(store.index_to_docstore_id)):
+                        doc_id = store.index_to_docstore_id[position]
+                        doc = store.docstore.search(doc_id)
+                        record = {"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata}
+                        f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                
+                # บันทึก metadata
+                metadata = {
+                    "embedding_model": self.embedding_model_name,
+                    "total_documents": len(self.documents),
+                    "distance_strategy": DistanceStrategy(store.distance_strategy).value,
+                    "normalize_L2": bool(store._normalize_L2),
+                    "content_hashes": sorted(self.content_hashes),
+                    "file_hashes": sorted(self.file_hashes)
+                }
+                
+                with open(self.metadata_json_path, 'w', encoding='utf-8') as f:
+                    json.dump(metadata, f, ensure_ascii=False)
+                
+                # ลบไฟล์รูปแบบเก่า (ถ้ามี) ไม่ให้โหลดข้อมูลที่ค้างอยู่ในภายหลัง
+                for file_path in [self.faiss_pkl_path, self.metadata_path]:
+                    if file_path.exists():
+                        file_path.unlink()
+                
+                print(f"✅ บันทึก vector store เสร็จสิ้น ที่ {self.vector_store_path}")
             
-        except Exception as e:
-            print(f"❌ ไม่สามารถบันทึก vector store: {e}")
-            raise
+            except Exception as e:
+                print(f"❌ ไม่สามารถบันทึก vector store: {e}")
+                raise
     
     def load_vector_store(self) -> bool:
         """โหลด vector store จากดิสก์"""
-        try:
-            if not self.faiss_index_path.exists() or not self.metadata_path.exists():
-                print("⚠️ ไม่พบ vector store ที่บันทึกไว้")
-                return False
+        with self.lock.write():
+            try:
+                if not self.faiss_index_path.exists():
+                    print("⚠️ ไม่พบ vector store ที่บันทึกไว้")
+                    return False
+                
+                if self.metadata_json_path.exists() and self.documents_path.exists():
+                    print("🔄 กำลังโหลด vector store...")
+                    metadata = self._load_json_store()
+                elif self.metadata_path.exists() and self.faiss_pkl_path.exists():
+                    print("🔄 กำลังโหลด vector store (รูปแบบเก่า)...")
+                    metadata = self._load_pickle_store()
+                else:
+                    print("⚠️ ไม่พบ vector store ที่บันทึกไว้")
+                    return False
+                
+                # ตรวจสอบ embedding model
+                if metadata['embedding_model'] != self.embedding_model_name:
+                    print(f"⚠️ Embedding model ไม่ตรงกัน: {metadata['embedding_model']} vs {self.embedding_model_name}")
+                    print("กำลังโหลดด้วย embedding model ใหม่...")
+                
+                # vector store รุ่นเก่าไม่มี hash → คำนวณจากเอกสาร
+                self.content_hashes = set(metadata.get('content_hashes') or ()) or {
+                    self._content_hash(doc.page_content) for doc in self.documents
+                }
+                self.file_hashes = set(metadata.get('file_hashes') or ())
+                
+                self.course_code_index = {}
+                self._index_course_codes()
+                
+                # ไม่รู้ขนาดตอนสร้างจริง → นับจากขนาดที่โหลด (สร้างใหม่เมื่อโตขึ้นจากนี้)
+                self._ann_built_vectors = self.vector_store.index.ntotal
+                
+                print(f"✅ โหลด vector store เสร็จสิ้น - {len(self.documents)} เอกสาร")
+                return True
             
-            print("🔄 กำลังโหลด vector store...")
-            
-            # โหลด metadata
-            with open(self.metadata_path, 'rb') as f:
-                metadata = pickle.load(f)
-            
-            # ตรวจสอบ embedding model
-            if metadata['embedding_model'] != self.embedding_model_name:
-                print(f"⚠️ Embedding model ไม่ตรงกัน: {metadata['embedding_model']} vs {self.embedding_model_name}")
-                print("กำลังโหลดด้วย embedding model ใหม่...")
-            
-            # โหลด FAISS vector store
-            self.vector_store = FAISS.load_local(
-                str(self.vector_store_path), 
-                self.embeddings,
-                allow_dangerous_deserialization=True
+            except Exception as e:
+                print(f"❌ ไม่สามารถโหลด vector store: {e}")
+                return False
+    
+    def _load_json_store(self) -> Dict[str, Any]:
+        """โหลด FAISS index + documents.jsonl แล้วประกอบ vector store ของ LangChain (ไม่ใช้ pickle)"""
+        with open(self.metadata_json_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        
+        doc_ids: List[str] = []
+        documents: List[Document] = []
+        with open(self.documents_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                doc_ids.append(record["id"])
+                documents.append(Document(page_content=record["page_content"], metadata=record["metadata"]))
+        
+        self.vector_store = FAISS(
+            embedding_function=self.embeddings,
+            index=faiss.read_index(str(self.faiss_index_path)),
+            docstore=InMemoryDocstore(dict(zip(doc_ids, documents))),
+            index_to_docstore_id=dict(enumerate(doc_ids)),
+            normalize_L2=metadata.get("normalize_L2", False),
+            distance_strategy=DistanceStrategy(
+                metadata.get("distance_strategy", DistanceStrategy.EUCLIDEAN_DISTANCE.value)
             )
-            
-            self.documents = metadata['documents']
-            
-            print(f"✅ โหลด vector store เสร็จสิ้น - {len(self.documents)} เอกสาร")
-            return True
-            
-        except Exception as e:
-            print(f"❌ ไม่สามารถโหลด vector store: {e}")
-            return False
+        )
+        self.documents = documents
+        return metadata
+    
+    def _load_pickle_store(self) -> Dict[str, Any]:
+        """โหลด vector store ที่บันทึกด้วยรูปแบบเก่า (FAISS.save_local + metadata.pkl)"""
+        with open(self.metadata_path, 'rb') as f:
+            metadata = pickle.load(f)
+        
+        self.vector_store = FAISS.load_local(
+            str(self.vector_store_path), 
+            self.embeddings,
+            allow_dangerous_deserialization=True
+        )
+        self.documents = metadata['documents']
+        return metadata
     
     def search_similar(self, query: str, k: int = 5, score_threshold: float = 0.0) -> List[Tuple[Document, float]]:
-        """ค้นหาเอกสารที่คล้ายกับคำถาม"""
+        """ค้นหาเอกสารที่คล้ายกับคำถาม (score เป็น cosine similarity หรือ L2 distance สำหรับ vector store รุ่นเก่า)
+        
+        ถ้ามี score_threshold จะให้ FAISS คืนเฉพาะ vector ที่ผ่านเกณฑ์ (range_search) แล้วเลือก top-k
+        จากผลนั้น - อาจได้น้อยกว่า k ผลลัพธ์
+        """
         if self.vector_store is None:
             print("⚠️ ไม่มี vector store สำหรับการค้นหา")
             return []
         
         try:
-            # ค้นหาด้วย similarity score
-            results = self.vector_store.similarity_search_with_score(query, k=k)
-            
-            # กรองตาม score threshold
-            filtered_results = [(doc, score) for doc, score in results if score >= score_threshold]
+            if not score_threshold:
+                with self.lock.read():
+                    return self.vector_store.similarity_search_with_score(query, k=k)
             
-            return filtered_results
+            store = self.vector_store
+            query_vector = np.asarray([self.embeddings.embed_query(query)], dtype=np.float32)
+            if getattr(store, "_normalize_L2", False):
+                faiss.normalize_L2(query_vector)
             
+            with self.lock.read():
+                index = store.index
+                # inner product: similarity > threshold / L2: distance < threshold (ทิศเดียวกับ LangChain)
+                higher_is_better = index.metric_type == faiss.METRIC_INNER_PRODUCT
+                try:
+                    _, scores, ids = index.range_search(query_vector, score_threshold)
+                except RuntimeError:
+                    # index ที่ไม่รองรับ range_search → LangChain กรอง top-k ตาม threshold หลังค้นหา
+                    return store.similarity_search_with_score(query, k=k, score_threshold=score_threshold)
+                
+                order = np.argsort(-scores if higher_is_better else scores)[:k]
+                return [
+                    (store.docstore.search(store.index_to_docstore_id[int(ids[i])]), float(scores[i]))
+                    for i in order
+                ]
+        
         except Exception as e:
             print(f"❌ เกิดข้อผิดพลาดในการค้นหา: {e}")
             return []
     
+    def search_by_vectors(self, query_embeddings: np.ndarray, k: int = 10) -> List[List[Document]]:
+        """
+        ค้นหาหลายคำถามด้วย embeddings ที่คำนวณไว้แล้ว (array หรือ list ของ vectors) ใน FAISS search ครั้งเดียว
+        
+        Returns:
+            List[List[Document]]: top-k chunks ของแต่ละคำถาม (ลำดับเดียวกับ similarity_search_by_vector)
+        """
+        if self.vector_store is None or len(query_embeddings) == 0:
+            return [[] for _ in query_embeddings]
+        
+        store = self.vector_store
+        queries = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        if getattr(store, "_normalize_L2", False):
+            faiss.normalize_L2(queries)
+        
+        with self.lock.read():
+            _, indices = store.index.search(queries, k)
+            return [
+                [store.docstore.search(store.index_to_docstore_id[i]) for i in row if i != -1]
+                for row in indices
+            ]
+    
     def get_retriever(self, k: int = 5, search_type: str = "similarity"):
         """สร้าง retriever สำหรับใช้ใน RAG"""
         if self.vector_store is None:
@@ -236,26 +744,23 @@ class ThaiVectorStoreManager:
     
     def clear_vector_store(self) -> None:
         """ล้าง vector store"""
-        self.vector_store = None
-        self.documents = []
+        with self.lock.write():
+            self.vector_store = None
+            self.documents = []
+            self.content_hashes = set()
+            self.file_hashes = set()
+            self.course_code_index = {}
+            self._ann_built_vectors = 0
         
         # ลบไฟล์ที่บันทึกไว้
-        for file_path in [self.faiss_index_path, self.faiss_pkl_path, self.metadata_path]:
+        for file_path in [self.faiss_index_path, self.documents_path, self.metadata_json_path,
+                          self.faiss_pkl_path, self.metadata_path]:
             if file_path.exists():
                 file_path.unlink()
         
         print("✅ ล้าง vector store เสร็จสิ้น")
 
 
-# โมเดล embedding ที่แนะนำสำหรับภาษาไทย
-RECOMMENDED_THAI_MODELS = {
-    "fast": "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-    "balanced": "sentence-transformers/distiluse-base-multilingual-cased", 
-    "best": "sentence-transformers/paraphrase-multilingual-mpnet-base-v2",
-    "thai_specific": "airesearch/wangchanberta-base-att-spm-uncased"  # ถ้ามี
-}
-
-
 # ตัวอย่างการใช้งาน
 if __name__ == "__main__":
     # สร้าง vector store manager